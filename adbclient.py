@@ -0,0 +1,189 @@
+"""
+Copyright (c) 2012 Fredrik Ehnbom
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+   1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+
+   2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+
+   3. This notice may not be removed or altered from any source
+   distribution.
+"""
+# A client for the adb server's smart socket protocol, so that talking to a
+# device doesn't need an adb process per command. Like adblog.py this must
+# not import sublime.
+#
+# Every request is sent as a four digit hex length followed by the request
+# itself, and the server answers with "OKAY" or with "FAIL" followed by a
+# hex length prefixed message. Requests starting with "host:" are handled by
+# the server itself, anything else is forwarded to the device selected by a
+# preceding "host:transport:<serial>" request. The server closes the
+# connection when a service is done, so every request needs its own socket.
+import socket
+
+try:
+    from shlex import quote
+except ImportError:
+    # Python 2
+    from pipes import quote
+
+
+DEFAULT_PORT = 5037
+
+
+class AdbError(Exception):
+    """The adb server refused a request, e.g. because the device is gone."""
+    pass
+
+
+class AdbStream(object):
+    """The output of a service running on a device, e.g. a logcat."""
+    def __init__(self, sock):
+        self.__sock = sock
+        self.__open = True
+
+    def read(self, size):
+        """Read up to size bytes, returns an empty string at the end of the
+        stream."""
+        data = self.__sock.recv(size)
+        if len(data) == 0:
+            self.__open = False
+        return data
+
+    def close(self):
+        if self.__open:
+            self.__open = False
+            try:
+                # Wakes up a thread blocked in read()
+                self.__sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self.__sock.close()
+
+    def fileno(self):
+        return self.__sock.fileno()
+
+    @property
+    def running(self):
+        return self.__open
+
+
+class AdbClient(object):
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def connect(self, serial=None, timeout=None):
+        """A socket to the server, switched to the given device's transport
+        unless serial is None. An empty serial picks the only device."""
+        sock = socket.create_connection((self.host, self.port), timeout or self.timeout)
+        try:
+            if serial is not None:
+                self.__request(sock, "host:transport:%s" % serial if serial else "host:transport-any")
+            return sock
+        except:
+            sock.close()
+            raise
+
+    def devices(self):
+        """(serial, state) of every device the server knows about."""
+        sock = self.connect()
+        try:
+            self.__request(sock, "host:devices")
+            data = self.__read_message(sock)
+        finally:
+            sock.close()
+        devices = []
+        for line in data.decode("utf-8", "replace").split("\n"):
+            fields = line.split()
+            if len(fields) >= 2:
+                devices.append((fields[0], fields[1]))
+        return devices
+
+    def shell(self, serial, command, timeout=None):
+        """Run a shell command on the device and return all of its output."""
+        sock = self.connect(serial, timeout)
+        try:
+            self.__request(sock, "shell:%s" % command)
+            chunks = []
+            while True:
+                data = sock.recv(65536)
+                if len(data) == 0:
+                    break
+                chunks.append(data)
+            return b"".join(chunks)
+        finally:
+            sock.close()
+
+    def stream(self, serial, args):
+        """Start a command on the device and return an AdbStream of its
+        output, e.g. stream(serial, ["logcat", "-v", "threadtime"])."""
+        sock = self.connect(serial)
+        try:
+            self.__request(sock, "shell:%s" % " ".join(quote(arg) for arg in args))
+        except:
+            sock.close()
+            raise
+        # The stream is open for as long as the command runs
+        sock.settimeout(None)
+        return AdbStream(sock)
+
+    def jdwp(self, serial, timeout=None):
+        """The pids of the debuggable processes on the device."""
+        sock = self.connect(serial, timeout)
+        try:
+            self.__request(sock, "jdwp")
+            # The service keeps sending updates, the first one is the list
+            # as of now
+            data = self.__read_message(sock)
+        finally:
+            sock.close()
+        return [int(pid) for pid in data.split()]
+
+    def wait_for_device(self, serial, timeout=None):
+        """Block until the device is online, e.g. after a reboot. Raises
+        socket.timeout if it isn't within timeout seconds."""
+        sock = self.connect(None, timeout)
+        try:
+            self.__request(sock, "host-serial:%s:wait-for-any-device" % serial if serial else "host:wait-for-any-device")
+            # The server answers a second time once the device is there
+            self.__read_status(sock)
+        finally:
+            sock.close()
+
+    def __request(self, sock, request):
+        request = request.encode("utf-8")
+        sock.sendall(("%04x" % len(request)).encode("ascii") + request)
+        self.__read_status(sock)
+
+    def __read_status(self, sock):
+        status = self.__read_exact(sock, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbError(self.__read_message(sock).decode("utf-8", "replace"))
+        raise AdbError("Unexpected response from the adb server: %r" % status)
+
+    def __read_message(self, sock):
+        return self.__read_exact(sock, int(self.__read_exact(sock, 4), 16))
+
+    def __read_exact(self, sock, size):
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if len(chunk) == 0:
+                raise AdbError("The adb server closed the connection")
+            data += chunk
+        return data
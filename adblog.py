@@ -0,0 +1,1680 @@
+"""
+Copyright (c) 2012 Fredrik Ehnbom
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+   1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+
+   2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+
+   3. This notice may not be removed or altered from any source
+   distribution.
+"""
+# Logcat parsing and the in-memory line store used by adbview.py. Nothing in
+# here may import sublime, so that it can be used outside of the editor too.
+import re
+import os
+import sys
+import json
+import gzip
+import mmap
+import codecs
+import threading
+import traceback
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import merge, heappush, heappop
+from itertools import islice
+
+
+# Lines in a view merging several devices start with "[serial] "
+DEVICE_PREFIX = r"(?:\[[^\]]*\] )?"
+#  "MM-DD HH:MM:SS.mmm  pid  tid L tag: message"            (logcat -v threadtime)
+THREADTIME_PATTERN = re.compile(DEVICE_PREFIX + r"(\d+)-(\d+) (\d+):(\d+):(\d+)\.(\d+) +(\d+) +(\d+) (\w) ([^:]*?) *: ?")
+#  "MM-DD HH:MM:SS.mmm L/tag( pid): message"                 (logcat -v time)
+TIME_PATTERN = re.compile(DEVICE_PREFIX + r"(\d+)-(\d+) (\d+):(\d+):(\d+)\.(\d+) (\w)/([^(]*?) *\( *(\d+)\): ?")
+
+NO_LEVEL = " "
+
+# Indices into a record
+LINE_FIELD   = 0
+TIME_FIELD   = 1
+PID_FIELD    = 2
+TID_FIELD    = 3
+LEVEL_FIELD  = 4
+TAG_FIELD    = 5
+OFFSET_FIELD = 6
+
+INDEXED_FIELDS = (PID_FIELD, TID_FIELD, LEVEL_FIELD, TAG_FIELD)
+
+# Message levels from least to most severe
+LEVEL_ORDER = "VDIWEFA"
+
+DAY = 24 * 60 * 60
+# A timestamp this many seconds before the newest one means the device clock
+# was set back (or the year wrapped) rather than the lines being out of order
+CLOCK_JUMP = 5.0
+
+# days before the start of each month, logcat timestamps don't carry a year.
+# Those of a leap year, so that 02-29 has a day of its own and every date
+# formats back to what it was parsed from.
+__month_days = [0, 0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335]
+
+try:
+    intern = sys.intern
+except AttributeError:
+    # Python 2
+    pass
+
+
+def parse_time(month, day, hour, minute, second, millis):
+    """Seconds since the start of the (unknown) year of a logcat timestamp."""
+    month = int(month)
+    days = __month_days[month] if 0 < month < 13 else 0
+    days += int(day)
+    return (((days * 24 + int(hour)) * 60 + int(minute)) * 60 + int(second)) + int(millis) / 1000.0
+
+
+def format_time(time):
+    """The inverse of parse_time, "MM-DD HH:MM:SS.mmm"."""
+    millis = int(round(time * 1000))
+    seconds, millis = divmod(millis, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    month = 1
+    while month < 12 and __month_days[month + 1] < days:
+        month += 1
+    return "%02d-%02d %02d:%02d:%02d.%03d" % (month, days - __month_days[month], hours, minutes, seconds, millis)
+
+
+_CLOCK_PATTERN = re.compile(r"(?:(\d+)-(\d+) +)?(\d+):(\d+)(?::(\d+)(?:\.(\d{1,3}))?)?\Z")
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d*)?) *([smh]?)\Z")
+
+
+def parse_clock(text):
+    """(time, dated, precision) of a time written like logcat does.
+
+    The seconds, milliseconds and date can be left out. Without the date
+    time is the seconds since midnight. precision is the length of the
+    last part given, e.g. 60 for "14:03".
+    """
+    m = _CLOCK_PATTERN.match(text.strip())
+    if m is None:
+        raise ValueError(text)
+    month, day, hour, minute, second, millis = m.groups()
+    precision = 0.001 if millis is not None else 1 if second is not None else 60
+    millis = (millis or "0").ljust(3, "0")
+    if month is None:
+        return parse_time(0, 0, hour, minute, second or 0, millis), False, precision
+    return parse_time(month, day, hour, minute, second or 0, millis), True, precision
+
+
+def parse_duration(text):
+    """Seconds of a duration like "30s", "5m" or "2h", plain numbers are seconds."""
+    m = _DURATION_PATTERN.match(text.strip())
+    if m is None:
+        raise ValueError(text)
+    return float(m.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[m.group(2)]
+
+
+def latest_time(clock, now):
+    """The last time up to now the clock showed the given time of day."""
+    time = now - now % DAY + clock
+    return time - DAY if time > now else time
+
+
+def resolve_time(text, now):
+    """The time written as text, relative to now, the time of the newest line.
+
+    Without a date it's the last time the clock showed it, and "-30s" is 30
+    seconds before now.
+    """
+    if text.strip().startswith("-"):
+        return now - parse_duration(text.strip()[1:])
+    time, dated, precision = parse_clock(text)
+    return time if dated else latest_time(time, now)
+
+
+def parse_line(line):
+    """Parse a logcat line into a record.
+
+    A record is the tuple (line, time, pid, tid, level, tag, offset) where
+    offset is the index in line where the message starts. Lines that can't
+    be parsed get a pid and tid of -1 and NO_LEVEL as the level.
+    """
+    m = THREADTIME_PATTERN.match(line)
+    if m is not None:
+        g = m.groups()
+        return (line, parse_time(*g[:6]), int(g[6]), int(g[7]), g[8], intern(g[9]), m.end())
+    m = TIME_PATTERN.match(line)
+    if m is not None:
+        g = m.groups()
+        return (line, parse_time(*g[:6]), int(g[8]), -1, g[6], intern(g[7]), m.end())
+    return info_record(line)
+
+
+def info_record(line):
+    """A record for a line that isn't a log message, e.g. status text."""
+    return (line, 0.0, -1, -1, NO_LEVEL, "", 0)
+
+
+def _contains(posting, row):
+    i = bisect_left(posting, row)
+    return i < len(posting) and posting[i] == row
+
+
+def _within(ranges, row):
+    i = bisect_right(ranges, (row, float("inf"))) - 1
+    return i >= 0 and row < ranges[i][1]
+
+
+class LineSplitter(object):
+    """Turns the chunks of bytes read from a logcat into records.
+
+    Multi byte characters and lines split between two chunks are kept
+    intact. Every line gets the given prefix.
+    """
+    def __init__(self, prefix=""):
+        self.__decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self.__partial = ""
+        self.prefix = prefix
+
+    def feed(self, chunk):
+        """Records of the complete lines read so far, an empty chunk marks
+        the end of the log."""
+        final = len(chunk) == 0
+        lines = (self.__partial + self.__decoder.decode(chunk, final)).split("\n")
+        self.__partial = "" if final else lines.pop()
+        prefix = self.prefix
+        records = []
+        for line in lines:
+            line = line.strip()
+            if len(line) > 0:
+                records.append(parse_line(prefix + line + "\n"))
+        return records
+
+
+class LogMerger(object):
+    """Interleaves the records of several logs by timestamp.
+
+    Records are held back for up to window seconds, both in log time and in
+    wall clock time, so that lines arriving slightly out of order from
+    different devices still end up sorted. At most max_pending records are
+    held back at once.
+    """
+    def __init__(self, window=0.5, max_pending=10000):
+        self.window = window
+        self.max_pending = max_pending
+        self.__heap = []
+        self.__count = 0
+        self.__newest = 0.0
+        self.__last = {}
+
+    def __len__(self):
+        return len(self.__heap)
+
+    def push(self, source, records, now):
+        heap = self.__heap
+        count = self.__count
+        last = self.__last.get(source, 0.0)
+        for record in records:
+            if record[PID_FIELD] < 0:
+                # Keep lines without a timestamp after the line before them
+                time = last
+            else:
+                time = last = record[TIME_FIELD]
+            # count keeps the order of lines with the same timestamp
+            heappush(heap, (time, count, now, record))
+            count += 1
+        self.__count = count
+        self.__last[source] = last
+        if last > self.__newest:
+            self.__newest = last
+
+    def pop(self, now):
+        """The records that have been held back long enough."""
+        heap = self.__heap
+        window = self.window
+        oldest = self.__newest - window
+        records = []
+        while len(heap) > 0:
+            time, count, arrived, record = heap[0]
+            if time > oldest and now - arrived < window and len(heap) <= self.max_pending:
+                break
+            records.append(heappop(heap)[3])
+        return records
+
+    def flush(self):
+        """All remaining records."""
+        heap = self.__heap
+        records = []
+        while len(heap) > 0:
+            records.append(heappop(heap)[3])
+        return records
+
+
+class LogStore(object):
+    """Column store with one row per line in an ADB view.
+
+    Rows are only ever appended at the end and trimmed from the front, and
+    every row has an absolute id (first + index) which stays the same for as
+    long as the row is retained. Character offsets are kept as absolute
+    positions as well, so trimming doesn't need to rewrite them.
+
+    For each of the INDEXED_FIELDS there's an inverted index mapping a field
+    value to the sorted absolute ids of the rows having that value.
+
+    The timeline is a list of [first row id, times] runs, where times has
+    the newest timestamp seen up to each row so that it can be bisected.
+    A new run starts whenever the device clock jumps back.
+
+    crashes is the CrashIndex of the retained rows.
+    """
+    __slots__ = ("first", "end", "lines", "starts", "times", "pids", "tids", "levels", "tags", "offsets", "index", "timeline", "crashes")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.first = 0
+        self.end = 0
+        self.lines = []
+        self.starts = array("q")
+        self.times = array("d")
+        self.pids = array("i")
+        self.tids = array("i")
+        self.levels = []
+        self.tags = []
+        self.offsets = array("i")
+        self.index = dict((field, {}) for field in INDEXED_FIELDS)
+        self.timeline = []
+        self.crashes = CrashIndex()
+
+    def __len__(self):
+        return len(self.lines)
+
+    @property
+    def size(self):
+        """The number of characters of all retained rows."""
+        return self.end - self.base
+
+    @property
+    def base(self):
+        return self.starts[0] if self.lines else self.end
+
+    def append(self, records):
+        lines = self.lines
+        starts = self.starts
+        times = self.times
+        pids = self.pids
+        tids = self.tids
+        levels = self.levels
+        tags = self.tags
+        offsets = self.offsets
+        pid_index = self.index[PID_FIELD]
+        tid_index = self.index[TID_FIELD]
+        level_index = self.index[LEVEL_FIELD]
+        tag_index = self.index[TAG_FIELD]
+        end = self.end
+        row = self.first + len(lines)
+        timeline = self.timeline
+        if len(timeline) == 0:
+            timeline.append([row, array("d")])
+        clock = timeline[-1][1]
+        latest = clock[-1] if len(clock) > 0 else 0.0
+        for line, time, pid, tid, level, tag, offset in records:
+            if pid >= 0:
+                if time > latest:
+                    latest = time
+                elif time < latest - CLOCK_JUMP:
+                    clock = array("d")
+                    timeline.append([row, clock])
+                    latest = time
+            clock.append(latest)
+            lines.append(line)
+            starts.append(end)
+            end += len(line)
+            times.append(time)
+            pids.append(pid)
+            tids.append(tid)
+            levels.append(level)
+            tags.append(tag)
+            offsets.append(offset)
+            for index, value in ((pid_index, pid), (tid_index, tid), (level_index, level), (tag_index, tag)):
+                posting = index.get(value)
+                if posting is None:
+                    index[value] = array("q", (row,))
+                else:
+                    posting.append(row)
+            row += 1
+        self.end = end
+        self.crashes.add(records, row - len(records))
+
+    def trim(self, count):
+        """Drop the count oldest rows, returns the number of characters removed."""
+        count = min(count, len(self.lines))
+        if count <= 0:
+            return 0
+        base = self.base
+        removed = (self.starts[count] if count < len(self.lines) else self.end) - base
+        for column in (self.lines, self.starts, self.times, self.pids, self.tids, self.levels, self.tags, self.offsets):
+            del column[:count]
+        self.first += count
+        first = self.first
+        timeline = self.timeline
+        while len(timeline) > 1 and timeline[1][0] <= first:
+            del timeline[0]
+        del timeline[0][1][:first - timeline[0][0]]
+        timeline[0][0] = first
+        self.crashes.trim(first)
+        for index in self.index.values():
+            for value, posting in list(index.items()):
+                if posting[-1] < first:
+                    del index[value]
+                elif posting[0] < first:
+                    del posting[:bisect_left(posting, first)]
+        return removed
+
+    def column(self, field):
+        return (self.lines, self.times, self.pids, self.tids, self.levels, self.tags, self.offsets)[field]
+
+    def record(self, row):
+        return (self.lines[row], self.times[row], self.pids[row], self.tids[row],
+                self.levels[row], self.tags[row], self.offsets[row])
+
+    def point(self, row):
+        """Character offset in the view of the start of the given row."""
+        if row >= len(self.lines):
+            return self.end - self.base
+        return self.starts[row] - self.base
+
+    def newest(self):
+        """The latest timestamp, None if there's none. After the clock was
+        set back it's not the one of the last row."""
+        newest = max([clock[-1] for start, clock in self.timeline if len(clock) > 0] or [0.0])
+        return newest if newest > 0 else None
+
+    def rows_between(self, begin=None, end=None):
+        """[begin, end) index ranges, in row order, of the rows logged in the
+        given time window. A bound of None leaves that end open."""
+        ranges = []
+        for start, clock in self.timeline:
+            low = bisect_left(clock, begin) if begin is not None else 0
+            high = bisect_right(clock, end) if end is not None else len(clock)
+            if low < high:
+                ranges.append((start - self.first + low, start - self.first + high))
+        return ranges
+
+    def row_at(self, time):
+        """Index of the first row logged at or after time. Of the runs of the
+        timeline the newest one covering time is used, or otherwise the one
+        coming closest."""
+        first = self.first
+        closest = None
+        for start, clock in reversed(self.timeline):
+            if len(clock) == 0:
+                continue
+            if clock[0] <= time <= clock[-1]:
+                return start - first + bisect_left(clock, time)
+            if time < clock[0]:
+                distance, row = clock[0] - time, start - first
+            else:
+                distance, row = time - clock[-1], start - first + len(clock) - 1
+            if closest is None or distance < closest[0]:
+                closest = (distance, row)
+        return closest[1] if closest is not None else 0
+
+    def rows_with(self, fields):
+        """Indices of the rows where every field in the {field: values} dict
+        has one of the given values, resolved through the inverted indexes."""
+        postings = []
+        for field, values in fields.items():
+            index = self.index[field]
+            found = [index[value] for value in values if value in index]
+            if len(found) == 0:
+                return []
+            postings.append(found[0] if len(found) == 1 else list(merge(*found)))
+        postings.sort(key=len)
+        first = self.first
+        rows = postings[0]
+        if len(postings) > 1:
+            others = postings[1:]
+            rows = [row for row in rows if all(_contains(other, row) for other in others)]
+        return [row - first for row in rows]
+
+    def hidden_spans(self, rows):
+        """Fold spans for everything not in the sorted list of visible rows.
+
+        Each span starts at the newline before the first hidden row and ends
+        before the newline of the last hidden row, so that the fold marker
+        ends up at the end of the preceding visible line.
+        """
+        spans = []
+        prev = -1
+        count = len(self.lines)
+        for row in rows:
+            if row > prev + 1:
+                spans.append(self.span(prev + 1, row))
+            prev = row
+        if prev + 1 < count:
+            spans.append(self.span(prev + 1, count))
+        return spans
+
+    def span(self, begin, end):
+        """The fold span for the rows in [begin, end)."""
+        return (max(0, self.point(begin) - 1), self.point(end) - 1)
+
+
+class TalkerStats(object):
+    """Lines and characters per second logged by each tag, pid and level,
+    over the last window seconds.
+
+    Characters are counted rather than bytes, which is the same for the
+    mostly ASCII logcat output.
+    """
+    FIELDS = (TAG_FIELD, PID_FIELD, LEVEL_FIELD)
+
+    def __init__(self, window=10):
+        self.window = window
+        self.__buckets = []
+        self.__started = None
+        self.__lock = threading.Lock()
+
+    def add(self, records, now):
+        counts = {}
+        fields = self.FIELDS
+        for record in records:
+            if record[PID_FIELD] < 0:
+                continue
+            size = len(record[LINE_FIELD])
+            for field in fields:
+                key = (field, record[field])
+                count = counts.get(key)
+                if count is None:
+                    counts[key] = [1, size]
+                else:
+                    count[0] += 1
+                    count[1] += size
+        second = int(now)
+        with self.__lock:
+            if self.__started is None:
+                self.__started = now
+            buckets = self.__buckets
+            if len(buckets) == 0 or buckets[-1][0] != second:
+                buckets.append((second, {}))
+                while buckets[0][0] <= second - self.window:
+                    del buckets[0]
+            bucket = buckets[-1][1]
+            for key, count in counts.items():
+                total = bucket.get(key)
+                if total is None:
+                    bucket[key] = count
+                else:
+                    total[0] += count[0]
+                    total[1] += count[1]
+
+    def top(self, now):
+        """(field, value, lines per second, characters per second) of every
+        source seen within the window, the busiest first."""
+        totals = {}
+        with self.__lock:
+            if self.__started is None:
+                return []
+            for second, bucket in self.__buckets:
+                if second > now - self.window:
+                    for key, count in bucket.items():
+                        total = totals.get(key)
+                        if total is None:
+                            totals[key] = list(count)
+                        else:
+                            total[0] += count[0]
+                            total[1] += count[1]
+            span = max(1.0, min(self.window, now - self.__started))
+        top = [(field, value, lines / span, size / span) for (field, value), (lines, size) in totals.items()]
+        top.sort(key=lambda talker: talker[3], reverse=True)
+        return top
+
+
+class RepeatCollapser(object):
+    """Counts repeats of a message on its first copy instead of keeping them.
+
+    A line repeats an earlier one if it has the same pid, tag and message,
+    and the earlier one is at most window rows back. counts maps the row of
+    the first copy to the number of times the message was seen, and changed
+    has the rows whose count changed or was dropped since it was last reset.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.counts = {}
+        self.collapsed = 0
+        self.changed = set()
+        self.__recent = {}
+
+    def clear(self):
+        self.changed.update(self.counts)
+        self.counts = {}
+        self.__recent = {}
+
+    def add(self, record, row):
+        """False if record repeats a recent line and was counted on it,
+        otherwise record is new and is going to be the given row."""
+        if record[PID_FIELD] < 0:
+            return True
+        line = record[LINE_FIELD]
+        key = (record[PID_FIELD], record[TAG_FIELD], line[record[OFFSET_FIELD]:])
+        recent = self.__recent
+        seen = recent.get(key)
+        if seen is not None and row - seen <= self.window:
+            self.counts[seen] = self.counts.get(seen, 1) + 1
+            self.collapsed += 1
+            self.changed.add(seen)
+            return False
+        recent[key] = row
+        if len(recent) > 4 * self.window + 1024:
+            window = self.window
+            self.__recent = dict((key, seen) for key, seen in recent.items() if row - seen <= window)
+        return True
+
+    def trim(self, first):
+        """Forget the counts of the rows before first"""
+        trimmed = [row for row in self.counts if row < first]
+        if len(trimmed) > 0:
+            for row in trimmed:
+                del self.counts[row]
+            self.changed.update(trimmed)
+
+
+class CrashEvent(object):
+    """A crash found by CrashIndex, with the absolute ids of its rows."""
+    __slots__ = ("kind", "pid", "tag", "time", "last_time", "title", "process", "detail", "rows")
+
+    def __init__(self, kind, pid, tag, time, title):
+        self.kind = kind
+        self.pid = pid
+        self.tag = tag
+        self.time = time
+        self.last_time = time
+        self.title = title
+        self.process = None
+        self.detail = None
+        self.rows = array("q")
+
+
+class CrashIndex(object):
+    """The Java crashes, ANRs, native crashes and process deaths in a log,
+    found as the lines are added.
+
+    A crash starts at a line like "FATAL EXCEPTION: main" and goes on with
+    the lines its pid logs under the same tag, for as long as they keep
+    coming within the gap of the kind. The stack of a Java crash and the
+    details of an ANR are a single message with one timestamp, a tombstone
+    is logged line by line. A death is a single line.
+    """
+    KINDS = ("java", "anr", "native", "died")
+    # tag: [(kind, pattern of the first line)]
+    STARTS = {
+        "AndroidRuntime": [("java", re.compile(r"FATAL EXCEPTION"))],
+        "ActivityManager": [("anr", re.compile(r"ANR in (\S+)")),
+                            ("died", re.compile(r"Process (\S+) \(pid (\d+)\) has died"))],
+        "DEBUG": [("native", re.compile(r"\*\*\* \*\*\* \*\*\*"))],
+    }
+    GAPS = {"java": 0.1, "anr": 0.1, "native": 1.0}
+    # Details in the lines after the first
+    JAVA_PROCESS = re.compile(r"Process: ([^,\s]+), PID: (\d+)")
+    ANR_PID = re.compile(r"PID: (\d+)")
+    NATIVE_PROCESS = re.compile(r"pid: (\d+), tid: \d+, name: .*>>> (\S+) <<<")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.events = []
+        # (pid, tag): the crash those lines go on with
+        self.__open = {}
+
+    def add(self, records, row):
+        """Look for crashes in the records, where row is the id of the first."""
+        starts = self.STARTS
+        blocks = self.__open
+        for line, time, pid, tid, level, tag, offset in records:
+            if len(blocks) > 0:
+                event = blocks.get((pid, tag))
+                if event is not None:
+                    if time - event.last_time <= self.GAPS[event.kind]:
+                        event.rows.append(row)
+                        event.last_time = time
+                        if event.detail is None:
+                            self.__add_details(event, line[offset:].rstrip("\n"))
+                        row += 1
+                        continue
+                    del blocks[(pid, tag)]
+            patterns = starts.get(tag)
+            if patterns is not None:
+                message = line[offset:].rstrip("\n")
+                for kind, pattern in patterns:
+                    m = pattern.search(message)
+                    if m is not None:
+                        event = CrashEvent(kind, pid, tag, time, message)
+                        event.rows.append(row)
+                        if kind == "died":
+                            event.process = m.group(1)
+                            event.pid = int(m.group(2))
+                        else:
+                            if kind == "anr":
+                                event.process = m.group(1)
+                            blocks[(pid, tag)] = event
+                        self.events.append(event)
+                        break
+            row += 1
+        if len(blocks) > 0 and len(records) > 0:
+            latest = records[-1][TIME_FIELD]
+            for key, event in list(blocks.items()):
+                if latest - event.last_time > self.GAPS[event.kind]:
+                    del blocks[key]
+
+    def __add_details(self, event, message):
+        """Take the process and the exception or signal from a line of the
+        crash"""
+        if event.kind == "java":
+            m = self.JAVA_PROCESS.match(message)
+            if m is not None:
+                event.process = m.group(1)
+                event.pid = int(m.group(2))
+            elif message.strip():
+                event.detail = message
+        elif event.kind == "anr":
+            m = self.ANR_PID.match(message)
+            if m is not None:
+                event.pid = int(m.group(1))
+            elif message.startswith("Reason: "):
+                event.detail = message[len("Reason: "):]
+        elif event.kind == "native":
+            m = self.NATIVE_PROCESS.match(message)
+            if m is not None:
+                event.process = m.group(2)
+                event.pid = int(m.group(1))
+            elif message.startswith("signal "):
+                event.detail = message
+
+    def trim(self, first):
+        """Forget the crashes that ended before the row first"""
+        events = self.events
+        count = 0
+        while count < len(events) and events[count].rows[-1] < first:
+            count += 1
+        if count > 0:
+            del events[:count]
+            self.__open = dict((key, event) for key, event in self.__open.items() if event.rows[-1] >= first)
+
+    def rows(self, kinds, first):
+        """Sorted indices from first of the rows of the crashes of the given
+        kinds."""
+        rows = merge(*[event.rows for event in self.events if event.kind in kinds])
+        return [row - first for row in rows if row >= first]
+
+
+# Filters are a list of terms that all have to match a line, written as e.g.
+#
+#   tag:ActivityManager,PackageManager pid:1234 level>=W -has:"GC freed"
+#
+# Anything that isn't made up of such terms is a regular expression. has:
+# and re: match anywhere in the line, msg: only in the message. time: and
+# last: limit the lines to a time window, e.g. time:14:03..14:05 or last:30s.
+# crash:any keeps the lines of crashes, see CrashIndex.
+_QUOTED = r'"(?:[^"\\]|\\.)*"'
+_TERM_PATTERN = re.compile(r'(-?)(tag|pid|tid|level|has|re|msg|time|last|crash)(:|>=)((?:%s|[^\s"])*)(?:\s+|\Z)' % _QUOTED)
+_VALUE_PATTERN = re.compile(r'%s|[^,"]+' % _QUOTED)
+_QUOTED_PATTERN = re.compile(_QUOTED + r"\Z")
+_FIELD_NAMES = {PID_FIELD: "pid", TID_FIELD: "tid", LEVEL_FIELD: "level", TAG_FIELD: "tag"}
+_NAME_FIELDS = dict((name, field) for field, name in _FIELD_NAMES.items())
+
+
+def _quote(value, separators=""):
+    if len(value) == 0 or re.search(r'[\s"%s]' % separators, value) is not None:
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _unquote(value):
+    if _QUOTED_PATTERN.match(value) is not None:
+        return json.loads(value)
+    return value
+
+
+class FieldTerm(object):
+    """The field of a record has one of the given values."""
+    cost = 0
+    text_only = False
+
+    def __init__(self, field, values):
+        self.field = field
+        self.values = frozenset(values)
+
+    def matches(self, record):
+        return record[self.field] in self.values
+
+    def row_test(self, store):
+        column = store.column(self.field)
+        values = self.values
+        return lambda row: column[row] in values
+
+    def __str__(self):
+        return "%s:%s" % (_FIELD_NAMES[self.field], ",".join(_quote(str(v), ",") for v in sorted(self.values)))
+
+
+class LevelTerm(FieldTerm):
+    """The level of a record is at least the given one."""
+    def __init__(self, level):
+        FieldTerm.__init__(self, LEVEL_FIELD, LEVEL_ORDER[LEVEL_ORDER.index(level):])
+        self.level = level
+
+    def __str__(self):
+        return "level>=%s" % self.level
+
+
+class ContainsTerm(object):
+    """The line contains the given text."""
+    cost = 1
+    text_only = True
+
+    def __init__(self, text):
+        self.text = text
+        self.hint = re.escape(text)
+
+    def matches(self, record):
+        return self.text in record[LINE_FIELD]
+
+    def row_test(self, store):
+        lines = store.lines
+        text = self.text
+        return lambda row: text in lines[row]
+
+    def __str__(self):
+        return "has:%s" % _quote(self.text)
+
+
+class RegexTerm(object):
+    """The line matches the given regular expression."""
+    cost = 2
+    text_only = True
+
+    def __init__(self, pattern):
+        self.regex = re.compile(pattern)
+        self.hint = pattern
+
+    def matches(self, record):
+        return self.regex.search(record[LINE_FIELD]) is not None
+
+    def row_test(self, store):
+        lines = store.lines
+        search = self.regex.search
+        return lambda row: search(lines[row]) is not None
+
+    def __str__(self):
+        return "re:%s" % _quote(self.hint)
+
+
+class MessageTerm(object):
+    """The message matches the given regular expression."""
+    cost = 2
+    text_only = False
+
+    def __init__(self, pattern):
+        self.regex = re.compile(pattern)
+        self.pattern = pattern
+
+    def matches(self, record):
+        return self.regex.search(record[LINE_FIELD][record[OFFSET_FIELD]:]) is not None
+
+    def row_test(self, store):
+        lines = store.lines
+        offsets = store.offsets
+        search = self.regex.search
+        return lambda row: search(lines[row][offsets[row]:]) is not None
+
+    def __str__(self):
+        return "msg:%s" % _quote(self.pattern)
+
+
+class TimeTerm(object):
+    """The line was logged in a time window.
+
+    time:BEGIN..END takes times as logcat prints them, where either end can
+    be left open and END includes everything up to its precision, e.g.
+    time:"02-09 14:03:12"..14:05 ends at 14:05:59.999. A single time is the
+    window of its precision. last:30s is the last 30 seconds.
+
+    Times without a date and last: are relative to now, the latest line,
+    and are resolved by anchored(). Until then times without a date only
+    compare the time of day and last: matches every line.
+    """
+    cost = 0
+    text_only = False
+
+    def __init__(self, name, value, now=None):
+        self.name = name
+        self.value = value
+        self.__now = now
+        self.begin = None
+        self.end = None
+        # (begin, end) times of day for times without a date and a now
+        self.daily = None
+        if name == "last":
+            duration = parse_duration(value)
+            if now is not None:
+                self.begin = now - duration
+        else:
+            self.__window(value, now)
+        self.__in_window = self.__test()
+
+    def __window(self, value, now):
+        low, separator, high = value.partition("..")
+        if not separator:
+            high = low
+        begin = parse_clock(low) if low.strip() else None
+        end = parse_clock(high) if high.strip() else None
+        if begin is not None:
+            time, dated, precision = begin
+            if dated:
+                self.begin = time
+            elif now is not None:
+                self.begin = latest_time(time, now)
+        if end is not None:
+            time, dated, precision = end
+            time += precision - 0.001
+            if dated:
+                self.end = time
+            elif now is not None:
+                # The first time after the beginning the clock shows it
+                base = self.begin if self.begin is not None else now
+                self.end = base - base % DAY + time
+                if self.begin is not None and self.end < self.begin:
+                    self.end += DAY
+        if now is None and any(bound is not None and not bound[1] for bound in (begin, end)):
+            self.daily = (begin[0] % DAY if begin is not None else 0.0,
+                          (end[0] + end[2] - 0.001) % DAY if end is not None else DAY)
+
+    @property
+    def ranged(self):
+        """True if the window is between begin and end."""
+        return self.daily is None
+
+    def anchored(self, now):
+        return TimeTerm(self.name, self.value, now)
+
+    def __reduce__(self):
+        # The window test is a closure, which can't be pickled
+        return (TimeTerm, (self.name, self.value, self.__now))
+
+    def __test(self):
+        if self.daily is not None:
+            low, high = self.daily
+            if low <= high:
+                return lambda time: low <= time % DAY <= high
+            return lambda time: time % DAY >= low or time % DAY <= high
+        begin = self.begin if self.begin is not None else float("-inf")
+        end = self.end if self.end is not None else float("inf")
+        return lambda time: begin <= time <= end
+
+    def matches(self, record):
+        # Lines that aren't log messages don't have a time
+        return record[PID_FIELD] < 0 or self.__in_window(record[TIME_FIELD])
+
+    def row_test(self, store):
+        times = store.times
+        pids = store.pids
+        test = self.__in_window
+        return lambda row: pids[row] < 0 or test(times[row])
+
+    def __str__(self):
+        return "%s:%s" % (self.name, _quote(self.value))
+
+
+class CrashTerm(object):
+    """The line is part of a crash of one of the given kinds.
+
+    That can only be told from the LogStore the line is in, so LogFilter
+    doesn't check it in matches() but in select() and context_test().
+    """
+    cost = 0
+    text_only = False
+
+    def __init__(self, kinds=CrashIndex.KINDS):
+        if any(kind not in CrashIndex.KINDS for kind in kinds):
+            raise ValueError(kinds)
+        self.kinds = frozenset(kinds)
+
+    def matches(self, record):
+        return True
+
+    def row_test(self, store):
+        rows = set(store.crashes.rows(self.kinds, store.first))
+        return lambda row: row in rows
+
+    def __str__(self):
+        if len(self.kinds) == len(CrashIndex.KINDS):
+            return "crash:any"
+        return "crash:%s" % ",".join(kind for kind in CrashIndex.KINDS if kind in self.kinds)
+
+
+def _contextual(term):
+    return isinstance(term, CrashTerm) or (isinstance(term, NotTerm) and isinstance(term.term, CrashTerm))
+
+
+class NotTerm(object):
+    """The given term doesn't match."""
+    def __init__(self, term):
+        self.term = term
+        self.cost = term.cost
+        self.text_only = term.text_only
+
+    def matches(self, record):
+        return not self.term.matches(record)
+
+    def row_test(self, store):
+        test = self.term.row_test(store)
+        return lambda row: not test(row)
+
+    def __str__(self):
+        return "-%s" % self.term
+
+
+def _parse_term(negate, name, op, value):
+    if op == ">=":
+        if name != "level" or len(value) != 1 or value not in LEVEL_ORDER:
+            raise ValueError(value)
+        term = LevelTerm(value)
+    elif name == "has":
+        term = ContainsTerm(_unquote(value))
+    elif name == "re":
+        term = RegexTerm(_unquote(value))
+    elif name == "msg":
+        term = MessageTerm(_unquote(value))
+    elif name == "crash":
+        kinds = _VALUE_PATTERN.findall(value)
+        if len(kinds) == 0:
+            raise ValueError(value)
+        term = CrashTerm() if kinds == ["any"] else CrashTerm(kinds)
+    elif name in ("time", "last"):
+        if _QUOTED_PATTERN.match(value) is None:
+            # Either end of the window can be quoted on its own
+            value = "..".join(_unquote(end) for end in value.split(".."))
+        term = TimeTerm(name, _unquote(value))
+    else:
+        field = _NAME_FIELDS[name]
+        values = [_unquote(v) for v in _VALUE_PATTERN.findall(value)]
+        if len(values) == 0:
+            # "tag:" is most likely the start of a filter still being typed,
+            # so it's searched for as text rather than matching nothing
+            raise ValueError(value)
+        if field in (PID_FIELD, TID_FIELD):
+            values = [int(v) for v in values]
+        term = FieldTerm(field, values)
+    return NotTerm(term) if negate else term
+
+
+def _parse_terms(text):
+    """The terms of a filter, or None if it's a regular expression."""
+    pos = len(text) - len(text.lstrip())
+    terms = []
+    try:
+        while pos < len(text):
+            m = _TERM_PATTERN.match(text, pos)
+            if m is None:
+                return None
+            terms.append(_parse_term(*m.groups()))
+            pos = m.end()
+    except ValueError:
+        return None
+    return terms or None
+
+
+def parse_filter(text):
+    """The LogFilter written as text, see LogFilter.pattern."""
+    if text.strip() in ("", "."):
+        return LogFilter()
+    terms = _parse_terms(text)
+    if terms is None:
+        terms = [RegexTerm(text)]
+    return LogFilter(terms)
+
+
+class LogFilter(object):
+    """The lines where all of the terms match.
+
+    The terms are checked cheapest first, so that a field comparison can
+    rule out a line before any regex runs on it, and select() resolves the
+    field terms through the LogStore indexes before checking anything else.
+    """
+    def __init__(self, terms=()):
+        flat = []
+        for term in terms:
+            if isinstance(term, LogFilter):
+                flat.extend(term.terms)
+            else:
+                flat.append(term)
+        self.terms = tuple(flat)
+        self.__checks = sorted([term for term in self.terms if not _contextual(term)], key=lambda term: term.cost)
+        self.__context = [term for term in self.terms if _contextual(term)]
+        # What the times relative to now were resolved with
+        self.now = None
+
+    @property
+    def matches_all(self):
+        return len(self.terms) == 0
+
+    @property
+    def indexed(self):
+        """True if select() only needs the LogStore indexes."""
+        return all(isinstance(term, (FieldTerm, CrashTerm)) or (isinstance(term, TimeTerm) and term.ranged) for term in self.terms)
+
+    @property
+    def contextual(self):
+        """True if some terms can't be checked by matches(), which then only
+        tells whether the others match, see context_test()."""
+        return len(self.__context) > 0
+
+    @property
+    def text_only(self):
+        """True if only the text of a line is needed to match it."""
+        return all(term.text_only for term in self.terms)
+
+    @property
+    def pattern(self):
+        """The filter as text, which parse_filter turns back into the same
+        filter. A lone regex is written as is."""
+        terms = self.terms
+        if len(terms) == 0:
+            return "."
+        if len(terms) == 1 and isinstance(terms[0], RegexTerm) and _parse_terms(terms[0].hint) is None:
+            return terms[0].hint
+        return " ".join(str(term) for term in terms)
+
+    def __str__(self):
+        return self.pattern
+
+    @property
+    def hint(self):
+        """A regex every matching line matches, or None if there isn't one."""
+        for kind in (ContainsTerm, RegexTerm):
+            for term in self.terms:
+                if type(term) is kind:
+                    return term.hint
+        return None
+
+    @property
+    def line_hint(self):
+        """A regex matching the start of every line the pid, tid, level and
+        tag terms match, from the layout of logcat -v threadtime and -v time
+        lines. None without such terms, or if they match lines that aren't
+        log messages too."""
+        values = {}
+        for term in self.terms:
+            if isinstance(term, FieldTerm):
+                found = values.get(term.field)
+                values[term.field] = term.values if found is None else found & term.values
+        if len(values) == 0 or -1 in values.get(PID_FIELD, ()) or \
+                NO_LEVEL in values.get(LEVEL_FIELD, ()) or "" in values.get(TAG_FIELD, ()):
+            return None
+        def one_of(field, default):
+            if field not in values:
+                return default
+            if len(values[field]) == 0:
+                return "(?!)"
+            return "(?:%s)" % "|".join(re.escape(str(value)) for value in sorted(values[field], key=str))
+        pid = one_of(PID_FIELD, r"\d+")
+        level = one_of(LEVEL_FIELD, r"\w")
+        stamp = DEVICE_PREFIX + r"\d+-\d+ \d+:\d+:\d+\.\d+"
+        layouts = [stamp + r" +%s +%s %s %s *:" % (pid, one_of(TID_FIELD, r"\d+"), level, one_of(TAG_FIELD, r"[^:]*?"))]
+        if -1 in values.get(TID_FIELD, (-1,)):
+            # -v time lines have no tid
+            layouts.append(stamp + r" %s/%s *\( *%s\):" % (level, one_of(TAG_FIELD, r"[^(]*?"), pid))
+        return "^(?:%s)" % "|".join(layouts)
+
+    @property
+    def exact(self):
+        """True if the lines matching the hint are exactly the matching lines."""
+        return len(self.terms) == 1 and type(self.terms[0]) in (ContainsTerm, RegexTerm)
+
+    def matches(self, record):
+        for term in self.__checks:
+            if not term.matches(record):
+                return False
+        return True
+
+    def context_test(self, store):
+        """Tells whether the terms matches() leaves out match a row of the
+        LogStore."""
+        tests = [term.row_test(store) for term in self.__context]
+        return lambda row: all(test(row) for test in tests)
+
+    def select(self, store):
+        """Indices of the rows in the LogStore that match."""
+        fields = {}
+        checks = []
+        window = None
+        crashes = None
+        for term in self.__context:
+            if isinstance(term, CrashTerm):
+                rows = store.crashes.rows(term.kinds, store.first)
+                crashes = rows if crashes is None else [row for row in crashes if _contains(rows, row)]
+            else:
+                checks.append(term.row_test(store))
+        for term in self.__checks:
+            if isinstance(term, FieldTerm):
+                values = fields.get(term.field)
+                fields[term.field] = term.values if values is None else values & term.values
+            elif isinstance(term, TimeTerm) and term.ranged:
+                begin, end = window or (None, None)
+                if term.begin is not None:
+                    begin = term.begin if begin is None else max(begin, term.begin)
+                if term.end is not None:
+                    end = term.end if end is None else min(end, term.end)
+                window = (begin, end)
+            else:
+                checks.append(term.row_test(store))
+        rows = store.rows_with(fields) if fields else range(len(store))
+        if window is not None:
+            # The time window is a few contiguous ranges of rows, and lines
+            # that aren't log messages are in every window
+            ranges = store.rows_between(*window)
+            info = dict(fields)
+            info[PID_FIELD] = fields.get(PID_FIELD, frozenset((-1,))) & frozenset((-1,))
+            info = [row for row in store.rows_with(info) if not _within(ranges, row)]
+            if fields:
+                rows = [row for low, high in ranges for row in rows[bisect_left(rows, low):bisect_left(rows, high)]]
+            else:
+                rows = [row for low, high in ranges for row in range(low, high)]
+            if len(info) > 0:
+                rows = list(merge(rows, info))
+        if crashes is not None:
+            # Few enough to look up in the rows of the other terms
+            rows = [row for row in crashes if _contains(rows, row)] if fields or window is not None else crashes
+        if len(checks) == 1:
+            test = checks[0]
+            return [row for row in rows if test(row)]
+        if len(checks) > 1:
+            return [row for row in rows if all(test(row) for test in checks)]
+        return list(rows)
+
+    def with_terms(self, *terms):
+        return LogFilter(self.terms + terms)
+
+    def anchored(self, now):
+        """This filter with the times relative to now resolved, see TimeTerm."""
+        if now is None:
+            return self
+        terms = []
+        for term in self.terms:
+            if isinstance(term, TimeTerm):
+                term = term.anchored(now)
+            elif isinstance(term, NotTerm) and isinstance(term.term, TimeTerm):
+                term = NotTerm(term.term.anchored(now))
+            terms.append(term)
+        filter = LogFilter(terms)
+        filter.now = now
+        return filter
+
+    def with_field(self, field, values):
+        """This filter with any terms on the field replaced by the given values."""
+        terms = [term for term in self.terms if not (isinstance(term, FieldTerm) and term.field == field)]
+        terms.append(FieldTerm(field, values))
+        return LogFilter(terms)
+
+
+# logcat -e takes an ECMAScript regex, which has no inline flags, named
+# groups, lookbehinds or conditionals
+_DEVICE_REGEX = re.compile(r"\(\?[^:=!]|\\[AZ]")
+# Tags that can be given in a filterspec
+_SPEC_TAG = re.compile(r"[^\s:*]+\Z")
+
+
+def logcat_args(filter):
+    """Arguments making logcat leave out lines the filter doesn't match.
+
+    The lines logcat prints with them are a superset of those matching
+    the filter, which still has to be applied. --pid takes a single pid,
+    -e matches the message like msg: does, and tags and levels become
+    filterspecs, which logcat expects after the other arguments.
+    """
+    options = []
+    tags = None
+    silenced = set()
+    level = 0
+    for term in filter.terms:
+        if isinstance(term, LevelTerm) or (isinstance(term, FieldTerm) and term.field == LEVEL_FIELD):
+            ranks = [LEVEL_ORDER.index(value) for value in term.values if value in LEVEL_ORDER]
+            if len(ranks) > 0:
+                level = max(level, min(ranks))
+        elif isinstance(term, FieldTerm) and term.field == TAG_FIELD:
+            tags = term.values if tags is None else tags & term.values
+        elif isinstance(term, FieldTerm) and term.field == PID_FIELD:
+            if len(term.values) == 1 and "--pid" not in " ".join(options):
+                options.append("--pid=%d" % next(iter(term.values)))
+        elif isinstance(term, MessageTerm):
+            if _DEVICE_REGEX.search(term.pattern) is None and "-e" not in options:
+                options.extend(["-e", term.pattern])
+        elif isinstance(term, NotTerm) and type(term.term) is FieldTerm and term.term.field == TAG_FIELD:
+            silenced.update(term.term.values)
+    specs = []
+    if tags is not None and len(tags) > 0 and all(_SPEC_TAG.match(tag) for tag in tags):
+        specs = ["%s:%s" % (tag, LEVEL_ORDER[level]) for tag in sorted(tags - silenced)] + ["*:S"]
+    else:
+        silenced = [tag for tag in sorted(silenced) if _SPEC_TAG.match(tag)]
+        if len(silenced) > 0 or level > 0:
+            specs = ["%s:S" % tag for tag in silenced] + ["*:%s" % LEVEL_ORDER[level]]
+    return options + specs
+
+
+class LogResume(object):
+    """Leaves out the lines a restarted logcat repeats.
+
+    A logcat restarted with -T starts with the lines logged at the given
+    time, and one started without it with everything still in the
+    device's buffer. Every record read is passed to seen(), and after
+    resume() the records filter() is given are left out until they are
+    newer than the last one seen.
+    """
+    def __init__(self):
+        self.time = None
+        self.__lines = set()
+        self.__resuming = False
+
+    def seen(self, records):
+        for record in records:
+            if record[PID_FIELD] < 0:
+                continue
+            time = record[TIME_FIELD]
+            if self.time is None or time > self.time:
+                self.time = time
+                self.__lines = set((record[LINE_FIELD],))
+            elif time == self.time:
+                self.__lines.add(record[LINE_FIELD])
+
+    def resume(self):
+        self.__resuming = self.time is not None
+
+    def filter(self, records):
+        if not self.__resuming:
+            return records
+        last = self.time
+        lines = self.__lines
+        kept = []
+        for i, record in enumerate(records):
+            if record[PID_FIELD] >= 0:
+                time = record[TIME_FIELD]
+                if time > last:
+                    self.__resuming = False
+                    kept.extend(records[i:])
+                    break
+                if time < last or record[LINE_FIELD] in lines:
+                    continue
+            kept.append(record)
+        return kept
+
+
+def filter_lines(filter, lines, first=0):
+    """The ids of the lines matching the filter, where first is the id of
+    lines[0]."""
+    matches = filter.matches
+    if filter.text_only:
+        return [row for row, line in enumerate(lines, first) if matches((line,))]
+    return [row for row, line in enumerate(lines, first) if matches(parse_line(line))]
+
+
+def filter_shared(name, begin, end, first, filter):
+    """filter_lines for the lines in [begin, end) of the shared memory block
+    of UTF-8 text with the given name, run by worker processes so that the
+    lines don't have to be sent to them. The filter is pickled rather than
+    sent as its pattern, as not every filter is parsed back from that."""
+    from multiprocessing import shared_memory
+    try:
+        block = shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Before Python 3.13, the creator removes it
+        block = shared_memory.SharedMemory(name)
+    try:
+        text = bytes(block.buf[begin:end]).decode("utf-8")
+    finally:
+        block.close()
+    lines = [line + "\n" for line in text.split("\n")]
+    lines.pop()
+    return filter_lines(filter, lines, first)
+
+
+EXPORT_FORMATS = ("raw", "jsonl", "csv")
+# Records formatted and written per write() call
+EXPORT_CHUNK = 8192
+
+_JSONL_RECORD = '{"time": "%s", "pid": %d, "tid": %s, "level": %s, "tag": %s, "message": %s}\n'
+_JSONL_INFO = '{"time": null, "pid": null, "tid": null, "level": null, "tag": null, "message": %s}\n'
+
+_CSV_RECORD = '%s,%d,%s,%s,%s,%s\r\n'
+_CSV_INFO = ',,,,,%s\r\n'
+_CSV_SPECIAL = re.compile(r'[",\r\n]')
+
+
+def _csv_field(text):
+    """The text quoted the way the csv module does it by default."""
+    if _CSV_SPECIAL.search(text) is None:
+        return text
+    return '"%s"' % text.replace('"', '""')
+
+
+def _time_formatter():
+    """format_time, remembering the formatted seconds as most lines share
+    them with the line before."""
+    seconds = {}
+    def format(time):
+        second, millis = divmod(int(round(time * 1000)), 1000)
+        text = seconds.get(second)
+        if text is None:
+            text = seconds[second] = format_time(second)[:-4]
+        return "%s.%03d" % (text, millis)
+    return format
+
+
+def _export_text(records, format):
+    if format == "raw":
+        return "".join(record[LINE_FIELD] for record in records)
+    clock = _time_formatter()
+    if format == "jsonl":
+        string = json.encoder.encode_basestring
+        return "".join(_JSONL_INFO % string(line.rstrip("\n")) if pid < 0 else
+                       _JSONL_RECORD % (clock(time), pid, tid if tid >= 0 else "null",
+                                        "null" if level == NO_LEVEL else string(level), string(tag), string(line[offset:].rstrip("\n")))
+                       for line, time, pid, tid, level, tag, offset in records)
+    # The time, pid, tid and level never need quoting
+    return "".join(_CSV_INFO % _csv_field(line.rstrip("\n")) if pid < 0 else
+                   _CSV_RECORD % (clock(time), pid, tid if tid >= 0 else "", level.strip(), _csv_field(tag), _csv_field(line[offset:].rstrip("\n")))
+                   for line, time, pid, tid, level, tag, offset in records)
+
+
+def export_records(out, records, format="raw"):
+    """Write records to the binary file out as UTF-8 and return how many
+    there were. raw writes the lines as they are, jsonl and csv the time,
+    pid, tid, level, tag and message of each. records may be any iterable,
+    it's consumed EXPORT_CHUNK records at a time."""
+    if format not in EXPORT_FORMATS:
+        raise ValueError("unknown export format %r" % format)
+    if format == "csv":
+        out.write(b"time,pid,tid,level,tag,message\r\n")
+    records = iter(records)
+    count = 0
+    while True:
+        chunk = list(islice(records, EXPORT_CHUNK))
+        if len(chunk) == 0:
+            return count
+        out.write(_export_text(chunk, format).encode("utf-8"))
+        count += len(chunk)
+
+
+class SessionArchive(object):
+    """Streams every line of a session to disk.
+
+    Lines are written in gzip compressed segments of segment_lines lines
+    each, and for every segment the archive keeps its row range, time range
+    and the (row, time) of every mark_every:th line. The segments are listed
+    in index.jsonl in the archive's directory, one JSON object per line.
+
+    append() only buffers the lines, the segments are compressed and written
+    by a thread of the archive's own so that it never holds up the caller.
+    """
+    def __init__(self, directory, segment_lines=50000, mark_every=1000):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.segment_lines = segment_lines
+        self.mark_every = mark_every
+        self.rows = 0
+        self.__segments = []
+        self.__lines = []
+        self.__marks = []
+        self.__first_time = None
+        self.__last_time = 0.0
+        self.__lock = threading.Lock()
+        # (segment, lines) of the finished segments not on disk yet
+        self.__unwritten = []
+        self.__closed = False
+        self.__changed = threading.Condition(self.__lock)
+        writer = threading.Thread(target=self.__write_segments)
+        writer.daemon = True
+        writer.start()
+
+    def append(self, records):
+        with self.__lock:
+            for record in records:
+                if record[PID_FIELD] >= 0:
+                    self.__last_time = record[TIME_FIELD]
+                    if self.__first_time is None:
+                        self.__first_time = self.__last_time
+                if self.rows % self.mark_every == 0:
+                    self.__marks.append((self.rows, self.__last_time))
+                self.__lines.append(record[LINE_FIELD])
+                self.rows += 1
+                if len(self.__lines) >= self.segment_lines:
+                    self.__end_segment()
+
+    def close(self):
+        """Ends the last segment, which is then written like the others, see
+        flush()."""
+        with self.__lock:
+            if len(self.__lines) > 0:
+                self.__end_segment()
+            self.__closed = True
+            self.__changed.notify_all()
+
+    def flush(self):
+        """Waits until every finished segment is on disk."""
+        with self.__lock:
+            while len(self.__unwritten) > 0:
+                self.__changed.wait()
+
+    def segments(self):
+        """Dicts with the number, first_row, rows, first_time and last_time
+        of every segment, including the one still being filled."""
+        with self.__lock:
+            segments = list(self.__segments)
+            if len(self.__lines) > 0:
+                segments.append(self.__current())
+        return segments
+
+    def read(self, number):
+        """The lines of a segment."""
+        with self.__lock:
+            if number == len(self.__segments):
+                return list(self.__lines)
+            for segment, lines in self.__unwritten:
+                if segment["number"] == number:
+                    return list(lines)
+        with gzip.open(self.__path(number), "rb") as f:
+            return f.read().decode("utf-8").splitlines(True)
+
+    def find_time(self, time):
+        """The row of the first mark at or after the given time, or None. If
+        the device clock jumped backwards this finds the first such mark."""
+        for segment in self.segments():
+            if segment["last_time"] < time:
+                continue
+            for row, mark in segment["marks"]:
+                if mark >= time:
+                    return row
+            return segment["first_row"] + segment["rows"] - 1
+        return None
+
+    def segment_of(self, row):
+        """The number of the segment holding the given row."""
+        return row // self.segment_lines
+
+    def search(self, regex):
+        """Yields (row, line) for every archived line matching the regex."""
+        for segment in self.segments():
+            row = segment["first_row"]
+            search = regex.search
+            for line in self.read(segment["number"]):
+                if search(line) is not None:
+                    yield row, line
+                row += 1
+
+    def __path(self, number):
+        return os.path.join(self.directory, "segment-%06d.gz" % number)
+
+    def __current(self):
+        return {
+            "number": len(self.__segments),
+            "first_row": self.rows - len(self.__lines),
+            "rows": len(self.__lines),
+            "first_time": self.__first_time or 0.0,
+            "last_time": self.__last_time,
+            "marks": list(self.__marks)
+        }
+
+    def __end_segment(self):
+        segment = self.__current()
+        self.__segments.append(segment)
+        self.__unwritten.append((segment, self.__lines))
+        self.__lines = []
+        self.__marks = []
+        self.__first_time = None
+        self.__changed.notify_all()
+
+    def __write_segments(self):
+        while True:
+            with self.__lock:
+                while len(self.__unwritten) == 0 and not self.__closed:
+                    self.__changed.wait()
+                if len(self.__unwritten) == 0:
+                    return
+                segment, lines = self.__unwritten[0]
+            try:
+                with gzip.open(self.__path(segment["number"]), "wb") as f:
+                    f.write("".join(lines).encode("utf-8"))
+                with open(os.path.join(self.directory, "index.jsonl"), "a") as f:
+                    f.write(json.dumps(segment) + "\n")
+            except (IOError, OSError):
+                traceback.print_exc()
+            with self.__lock:
+                del self.__unwritten[0]
+                self.__changed.notify_all()
+
+
+class LogFile(object):
+    """A saved log opened with mmap, so that it doesn't need to fit in memory.
+
+    index() records the offset of every MARK_LINES:th line, which is enough
+    to find any line by number with one regex match. It is meant to run on a
+    background thread, and the file can be read and scanned while it does.
+    """
+    MARK_LINES = 1024
+    __skip = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.__file = open(path, "rb")
+        self.size = os.fstat(self.__file.fileno()).st_size
+        # mmap can't map an empty file
+        self.__data = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ) if self.size > 0 else b""
+        self.marks = array("q", (0,))
+        self.lines = None
+
+    def close(self):
+        if self.size > 0:
+            self.__data.close()
+        self.__file.close()
+
+    def index(self, cancelled=lambda: False):
+        """Build the line index, sets lines to the line count when done."""
+        data = self.__data
+        block = self.__skipper(self.MARK_LINES)
+        marks = self.marks
+        pos = marks[-1]
+        while not cancelled():
+            m = block.match(data, pos)
+            if m is None:
+                break
+            pos = m.end()
+            marks.append(pos)
+        else:
+            return
+        tail = data[pos:]
+        self.lines = (len(marks) - 1) * self.MARK_LINES + tail.count(b"\n") + (0 if tail.endswith(b"\n") or len(tail) == 0 else 1)
+
+    def offset_of(self, line):
+        """The offset of the given line, or None if the index doesn't reach
+        it yet."""
+        mark, skip = divmod(line, self.MARK_LINES)
+        if mark >= len(self.marks):
+            return None
+        return self.skip(self.marks[mark], skip)
+
+    def skip(self, offset, count):
+        """The offset count lines after the given one, or the end of the file."""
+        if count == 0:
+            return offset
+        m = self.__skipper(count).match(self.__data, offset)
+        return m.end() if m is not None else self.size
+
+    def line_end(self, offset):
+        end = self.__data.find(b"\n", offset)
+        return self.size if end == -1 else end + 1
+
+    def read(self, begin, end):
+        return self.__data[begin:end].decode("utf-8", "replace")
+
+    def read_lines(self, offsets):
+        """The text of the lines starting at the given offsets."""
+        data = self.__data
+        find = data.find
+        chunks = []
+        for offset in offsets:
+            end = find(b"\n", offset)
+            chunks.append(data[offset:self.size if end == -1 else end + 1])
+        text = b"".join(chunks).decode("utf-8", "replace")
+        if len(text) > 0 and not text.endswith("\n"):
+            text += "\n"
+        return text
+
+    def scan(self, regex, begin, end):
+        """Offsets of the lines in [begin, end) matching a bytes regex
+        compiled with re.MULTILINE, end should be at the start of a line.
+
+        The regex searches the mapped data directly so that lines that can't
+        match are skipped in C, and only candidate lines are checked on
+        their own.
+        """
+        data = self.__data
+        search = regex.search
+        find = data.find
+        rfind = data.rfind
+        offsets = []
+        pos = begin
+        while pos < end:
+            m = search(data, pos, end)
+            if m is None:
+                break
+            start = rfind(b"\n", pos, m.start())
+            start = pos if start == -1 else start + 1
+            line_end = find(b"\n", m.start(), end)
+            line_end = end if line_end == -1 else line_end + 1
+            if m.end() <= line_end or search(data[start:line_end]) is not None:
+                offsets.append(start)
+            pos = line_end
+        return offsets
+
+    def __skipper(self, count):
+        regex = LogFile.__skip.get(count)
+        if regex is None:
+            regex = re.compile(b"(?:[^\n]*\n){" + str(count).encode("ascii") + b"}")
+            LogFile.__skip[count] = regex
+        return regex
@@ -0,0 +1,172 @@
+"""
+Copyright (c) 2012 Fredrik Ehnbom
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+   1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+
+   2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+
+   3. This notice may not be removed or altered from any source
+   distribution.
+"""
+# The one background thread doing the I/O of every ADB view. It waits for
+# the logcats to have something to read and runs timers, and one-shot adb
+# commands, which are blocking calls, are handed to a few worker threads
+# with their results coming back to the loop. Like adblog.py this must not
+# import sublime.
+import time
+import socket
+import select
+import threading
+import traceback
+from heapq import heappush, heappop
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _socketpair():
+    """socket.socketpair(), which Windows only has from Python 3.5"""
+    try:
+        return socket.socketpair()
+    except (AttributeError, OSError):
+        pass
+    listener = socket.socket()
+    try:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        a = socket.create_connection(listener.getsockname())
+        b, _ = listener.accept()
+    finally:
+        listener.close()
+    return a, b
+
+
+class IoLoop(object):
+    """Runs callbacks one at a time on a single background thread.
+
+    add_reader(fd, callback) calls callback() whenever fd has something to
+    be read, call_soon and call_later run a function on the loop, and
+    run_command runs a blocking function on one of max_workers threads and
+    calls done(result, error) on the loop once it returns, where error is
+    the formatted exception or None. All of them may be called from any
+    thread.
+    """
+    def __init__(self, max_workers=4):
+        self.__lock = threading.Lock()
+        self.__readers = {}
+        # (when, sequence, function, args)
+        self.__timers = []
+        self.__sequence = 0
+        self.__stopped = False
+        self.__wake_read, self.__wake_write = _socketpair()
+        self.__wake_read.setblocking(False)
+        self.__wake_write.setblocking(False)
+        self.__workers = ThreadPoolExecutor(max_workers=max_workers)
+        self.__thread = threading.Thread(target=self.__run, name="ADBView I/O")
+        # Never keep the editor, or a script using the plugin, from exiting
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def add_reader(self, fd, callback):
+        with self.__lock:
+            self.__readers[fd] = callback
+        self.__wake()
+
+    def remove_reader(self, fd):
+        with self.__lock:
+            self.__readers.pop(fd, None)
+
+    def call_soon(self, function, *args):
+        self.call_later(0, function, *args)
+
+    def call_later(self, delay, function, *args):
+        with self.__lock:
+            self.__sequence += 1
+            heappush(self.__timers, (time.time() + delay, self.__sequence, function, args))
+        self.__wake()
+
+    def run_command(self, done, function, *args):
+        def finished(future):
+            try:
+                result, error = future.result(), None
+            except Exception:
+                result, error = None, traceback.format_exc()
+            self.call_soon(done, result, error)
+        self.__workers.submit(function, *args).add_done_callback(finished)
+
+    @property
+    def on_loop(self):
+        return threading.current_thread() is self.__thread
+
+    def stop(self):
+        with self.__lock:
+            self.__stopped = True
+        self.__wake()
+        self.__workers.shutdown(wait=False)
+
+    def __wake(self):
+        if not self.on_loop:
+            try:
+                self.__wake_write.send(b"x")
+            except socket.error:
+                # Full, so it's awake already
+                pass
+
+    def __call(self, function, *args):
+        try:
+            function(*args)
+        except Exception:
+            traceback.print_exc()
+
+    def __run(self):
+        wake = self.__wake_read.fileno()
+        while True:
+            with self.__lock:
+                if self.__stopped:
+                    break
+                timeout = None
+                if len(self.__timers) > 0:
+                    timeout = max(0, self.__timers[0][0] - time.time())
+                fds = list(self.__readers.keys())
+            try:
+                ready, _, _ = select.select(fds + [wake], [], [], timeout)
+            except (OSError, ValueError, select.error):
+                # Something closed a file that's still being read, let its
+                # reader find out
+                ready = [fd for fd in fds if not self.__valid(fd)]
+            if wake in ready:
+                try:
+                    while self.__wake_read.recv(4096):
+                        pass
+                except socket.error:
+                    pass
+            for fd in ready:
+                callback = self.__readers.get(fd)
+                if callback is not None:
+                    self.__call(callback)
+            now = time.time()
+            due = []
+            with self.__lock:
+                while len(self.__timers) > 0 and self.__timers[0][0] <= now:
+                    due.append(heappop(self.__timers))
+            for when, sequence, function, args in due:
+                self.__call(function, *args)
+        self.__wake_read.close()
+        self.__wake_write.close()
+
+    def __valid(self, fd):
+        try:
+            select.select([fd], [], [], 0)
+            return True
+        except (OSError, ValueError, select.error):
+            return False
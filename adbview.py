@@ -27,23 +27,47 @@ import os
 import sys
 import time
 import re
+import json
 import threading
 import traceback
 import telnetlib
+import socket
+import site
+import multiprocessing
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    from .adblog import LogStore, LineSplitter, LogMerger, SessionArchive, LogFile, RepeatCollapser, TalkerStats, LogResume, parse_line, info_record, format_time, resolve_time, OFFSET_FIELD
+    from .adblog import LogFilter, FieldTerm, ContainsTerm, NotTerm, TimeTerm, CrashTerm, parse_filter, logcat_args, filter_lines, filter_shared, export_records, EXPORT_FORMATS, PID_FIELD, TIME_FIELD
+    from .adbclient import AdbClient, AdbStream, AdbError
+    from .adbloop import IoLoop
+except (ValueError, SystemError, ImportError):
+    # Sublime Text 2 doesn't load plugins as packages
+    from adblog import LogStore, LineSplitter, LogMerger, SessionArchive, LogFile, RepeatCollapser, TalkerStats, LogResume, parse_line, info_record, format_time, resolve_time, OFFSET_FIELD
+    from adblog import LogFilter, FieldTerm, ContainsTerm, NotTerm, TimeTerm, CrashTerm, parse_filter, logcat_args, filter_lines, filter_shared, export_records, EXPORT_FORMATS, PID_FIELD, TIME_FIELD
+    from adbclient import AdbClient, AdbStream, AdbError
+    from adbloop import IoLoop
 
 
 process_shell = (os.name == 'nt')
                 #  (time)                    (pid)     (thread)  (level)  (tag)
-FILTER_GROUPS = [r"(^\d+\-\d+ [\d\:\.]*)", r"(\d+)", r"(\d+)", r"(\w)", r"([^\:]*:)"]
-GROUPS_SEPARATOR = ' +'
-FILTER_PATTERN = GROUPS_SEPARATOR.join(FILTER_GROUPS)
-
 TIME_GROUP   = 0
 PID_GROUP    = 1
 THREAD_GROUP = 2
 LEVEL_GROUP  = 3
 TAG_GROUP    = 4
 
+# How much to read from the adb pipe at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+# The pid of ADBView's own info lines, which no filter hides
+INFO_PIDS = frozenset((-1,))
+
+# Shown after a line that was repeated, see adb_collapse_repeats
+REPEAT_HTML = '<span style="color: color(var(--foreground) alpha(0.6))">&nbsp;&times;%d</span>'
+
 
 ################################################################################
 #                             Utility functions                                #
@@ -59,8 +83,29 @@ __adb_settings_defaults = {
     "adb_auto_scroll": True,
     "adb_launch_single": True,
     "adb_snap_lines": 5,
-    "adb_strip_filtered": False,
-    "adb_app_package": False
+    "adb_strip_filtered_lines": False,
+    "adb_app_package": False,
+    "adb_app_pid_poll_interval": 10,
+    "adb_updates_per_second": 20,
+    "adb_max_pending_lines": 200000,
+    "adb_trim_slack": 0.1,
+    "adb_device_probe_timeout": 5,
+    "adb_device_cache_ttl": 300,
+    "adb_native_client": True,
+    "adb_server_port": 5037,
+    "adb_merge_window": 0.5,
+    "adb_archive_dir": "",
+    "adb_archive_segment_lines": 50000,
+    "adb_file_window_lines": 5000,
+    "adb_filter_python": "",
+    "adb_filter_workers": 0,
+    "adb_show_stats": True,
+    "adb_collapse_repeats": False,
+    "adb_collapse_window": 100,
+    "adb_talker_window": 10,
+    "adb_filter_pushdown": False,
+    "adb_reconnect": True,
+    "adb_reconnect_attempts": 10
 }
 
 def __decode_wrap(dec):
@@ -140,9 +185,13 @@ except NameError:
     # Python 3 doesn't have the unicode type
     __filter_types = (str)
 
-def apply_filter(view, filter):
+def as_filter(filter):
     if isinstance(filter, __filter_types):
-        filter = re.compile(filter)
+        return parse_filter(filter)
+    return filter
+
+def apply_filter(view, filter):
+    filter = as_filter(filter)
     currRegion = None
     if is_adb_syntax(view):
         view.run_command("unfold_all")
@@ -153,7 +202,7 @@ def apply_filter(view, filter):
         while line < endline:
             region = view.full_line(view.text_point(line, 0))
             data = view.substr(region)
-            if filter.search(data) == None:
+            if not filter.matches(parse_line(data)):
                 if currRegion == None:
                     currRegion = region
                 else:
@@ -187,10 +236,27 @@ def get_adb_view(view):
             return adb_view
     return None
 
+file_views = []
+def get_file_view(view):
+    id = view.id()
+    for file_view in file_views:
+        if file_view.view.id() == id:
+            return file_view
+    return None
+
+def get_filter(view):
+    log_view = get_adb_view(view) or get_file_view(view)
+    if log_view:
+        return log_view.filter
+    return parse_filter(get_setting("adb_filter"))
+
 def set_filter(view, filter):
     adb_view = get_adb_view(view)
+    file_view = get_file_view(view)
     if adb_view:
         adb_view.set_filter(filter)
+    elif file_view:
+        file_view.set_filter(filter)
     else:
         apply_filter(view, filter)
     
@@ -199,40 +265,835 @@ def set_filter_by_group(view, group, value):
     if adb_view:
         adb_view.set_filter_by_group(group, value)
     else:
-        group_copy = FILTER_GROUPS.copy()
-        group_copy[group] = str(groups[group])
-        filter = GROUPS_SEPARATOR.join(group_copy)
-        apply_filter(view, filter)
+        set_filter(view, LogFilter((FieldTerm(group + 1, (value,)),)))
+
+def get_line_record(view):
+    """The parsed record of the line under the first cursor, or None if the
+    line isn't a log message"""
+    point = view.sel()[0].a
+    adb_view = get_adb_view(view)
+    if adb_view:
+        record = adb_view.record_at(point)
+    else:
+        record = parse_line(view.substr(view.line(point)))
+    if record is None or record[PID_GROUP+1] < 0:
+        return None
+    return record
+
+def get_adb_client():
+    """A client talking directly to the adb server, or None if disabled"""
+    if not get_setting("adb_native_client"):
+        return None
+    return AdbClient(port=get_setting("adb_server_port"))
+
+def run_adb(device, args, timeout=None):
+    """Run the adb command for the given device and return its output"""
+    cmd = [get_setting("adb_command")]
+    if device:
+        cmd += ["-s", device]
+    cmd += args
+    proc = subprocess.Popen(cmd, shell=process_shell, stdout=subprocess.PIPE)
+    try:
+        out, err = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise
+    return decode(out)
+
+# The functions below go through the adb server's socket when possible, and
+# fall back to running adb when the server isn't running (adb starts it) or
+# refuses the request, e.g. for a device that is offline.
+
+def adb_shell(device, command, timeout=None):
+    client = get_adb_client()
+    if client is not None:
+        try:
+            return decode(client.shell(device, command, timeout))
+        except socket.timeout:
+            raise
+        except (socket.error, AdbError):
+            pass
+    return run_adb(device, ["shell", command], timeout)
+
+def adb_devices():
+    """Serials of the attached devices"""
+    client = get_adb_client()
+    if client is not None:
+        try:
+            return [serial for serial, state in client.devices() if state == "device"]
+        except socket.timeout:
+            raise
+        except (socket.error, AdbError):
+            pass
+    devices = []
+    for line in run_adb("", ["devices"]).split("\n"):
+        line = line.strip()
+        if line.endswith("device"):
+            devices.append(re.sub(r"[ \t]*device$", "", line))
+    return devices
+
+def adb_jdwp(device):
+    """Pids of the debuggable processes on the device"""
+    client = get_adb_client()
+    if client is not None:
+        try:
+            return client.jdwp(device)
+        except socket.timeout:
+            raise
+        except (socket.error, AdbError):
+            pass
+    return [int(pid) for pid in re.findall(r'\d+', run_adb(device, ["jdwp"]))]
+
+def adb_wait_for_device(device, timeout):
+    """Wait for the device to come online, returns False if it didn't within
+    timeout seconds"""
+    client = get_adb_client()
+    if client is not None:
+        try:
+            client.wait_for_device(device, timeout)
+            return True
+        except socket.timeout:
+            return False
+        except (socket.error, AdbError):
+            pass
+    try:
+        run_adb(device, ["wait-for-device"], timeout)
+        return True
+    except subprocess.TimeoutExpired:
+        return False
+
+__io_loop = {}
+__io_loop_lock = threading.Lock()
+
+def get_io_loop():
+    """The IoLoop reading every logcat, started on first use"""
+    with __io_loop_lock:
+        if "loop" not in __io_loop:
+            __io_loop["loop"] = IoLoop()
+        return __io_loop["loop"]
+
+def shutdown_io_loop():
+    with __io_loop_lock:
+        loop = __io_loop.pop("loop", None)
+    if loop is not None:
+        loop.stop()
+
+def adb_async(done, function, *args):
+    """Run function(*args), e.g. adb_devices, without blocking the UI and
+    call done(result, error) on the UI thread, see IoLoop.run_command"""
+    def finished(result, error):
+        sublime.set_timeout(lambda: done(result, error), 0)
+    get_io_loop().run_command(finished, function, *args)
+
+class LogcatProcess(object):
+    """A logcat running in an adb process, used like adbclient.AdbStream"""
+    def __init__(self, cmd):
+        info = None
+        if os.name == 'nt':
+            info = subprocess.STARTUPINFO()
+            info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        self.__process = subprocess.Popen(cmd, startupinfo=info, stdout=subprocess.PIPE)
+        self.__fd = self.__process.stdout.fileno()
+
+    def read(self, size):
+        return os.read(self.__fd, size)
+
+    def fileno(self):
+        return self.__fd
+
+    def close(self):
+        process = self.__process
+        if process.poll() == None:
+            process.kill()
+        process.stdout.close()
+        # kill() doesn't wait for the process to go, it's reaped off the loop
+        get_io_loop().run_command(lambda result, error: None, process.wait)
+
+    @property
+    def running(self):
+        return self.__process.poll() == None
+
+def open_logcat(cmd):
+    """Start the logcat given by cmd, [adb, (-s, device,) logcat, args...]"""
+    client = get_adb_client()
+    if client is not None and cmd[0] == get_setting("adb_command"):
+        args = cmd[1:]
+        device = ""
+        if args[:1] == ["-s"]:
+            device = args[1]
+            args = args[2:]
+        if args[:1] == ["logcat"]:
+            try:
+                return client.stream(device, args)
+            except (socket.error, AdbError):
+                pass
+    return LogcatProcess(cmd)
+
+def open_logcats(sources):
+    """(device, logcat) for every (device, cmd) in sources, see open_logcat"""
+    logcats = []
+    try:
+        for device, cmd in sources:
+            print("running: %s" % cmd)
+            logcats.append((device, open_logcat(cmd)))
+    except:
+        for device, logcat in logcats:
+            logcat.close()
+        raise
+    return logcats
+
+class LogcatReader(object):
+    """Reads logcats on the I/O loop and hands the parsed records to
+    sink(records), calling closed() once all of them have ended. Both are
+    called on the loop.
+
+    sources is a list of (device, cmd). With more than one, the lines of all
+    devices are interleaved by timestamp and prefixed with "[device] ".
+    """
+    def __init__(self, sources, sink, closed):
+        self.__sources = sources
+        self.__sink = sink
+        self.__closed = closed
+        self.__logcats = []
+        self.__open = 0
+        self.__merger = None
+        self.__fds = []
+        self.__starting = False
+        self.__closing = False
+        self.__loop = get_io_loop()
+        # Bytes read and the time spent decoding and parsing them
+        self.bytes_read = 0
+        self.parse_seconds = 0.0
+
+    def start(self):
+        """Start the logcats. Starting adb or asking the adb server for a
+        logcat can take a while, so it's done by the loop's workers and the
+        logcats are read once they're up."""
+        self.__starting = True
+        self.__loop.run_command(self.__started, open_logcats, self.__sources)
+
+    def __started(self, logcats, error):
+        self.__starting = False
+        if error is not None:
+            print(error)
+            self.__ended()
+            return
+        self.__logcats = logcats
+        if self.__closing:
+            for device, logcat in logcats:
+                logcat.close()
+            self.__ended()
+            return
+        self.__open = len(self.__logcats)
+        if len(self.__logcats) > 1:
+            self.__window = get_setting("adb_merge_window")
+            self.__merger = LogMerger(self.__window)
+            self.__loop.call_later(self.__window, self.__merge_timer)
+        for device, logcat in self.__logcats:
+            splitter = LineSplitter("[%s] " % device if self.__merger is not None else "")
+            if os.name != 'nt' or isinstance(logcat, AdbStream):
+                fd = logcat.fileno()
+                self.__fds.append(fd)
+                self.__loop.add_reader(fd, lambda fd=fd, device=device, logcat=logcat, splitter=splitter: self.__readable(fd, device, logcat, splitter))
+            else:
+                # select() only works on sockets on Windows
+                threading.Thread(target=self.__pump, args=(device, logcat, splitter)).start()
+
+    def close(self):
+        self.__loop.call_soon(self.__close)
+
+    def __close(self):
+        self.__closing = True
+        if self.__starting:
+            # Closed by __started
+            return
+        for fd in self.__fds:
+            self.__loop.remove_reader(fd)
+        for device, logcat in self.__logcats:
+            logcat.close()
+        if len(self.__fds) > 0:
+            # Nothing more is read from them
+            self.__fds = []
+            self.__open = 0
+            self.__ended()
+
+    @property
+    def running(self):
+        return self.__starting or any(logcat.running for device, logcat in self.__logcats)
+
+    def __read(self, logcat, splitter):
+        """The records read and whether the logcat has ended"""
+        try:
+            chunk = logcat.read(READ_CHUNK_SIZE)
+        except (OSError, socket.error):
+            traceback.print_exc()
+            chunk = b""
+        begin = time.time()
+        records = splitter.feed(chunk)
+        self.parse_seconds += time.time() - begin
+        self.bytes_read += len(chunk)
+        return records, len(chunk) == 0
+
+    def __readable(self, fd, device, logcat, splitter):
+        # Whatever is available in one large chunk, with all the complete
+        # lines in it handed over at once
+        records, final = self.__read(logcat, splitter)
+        if final:
+            self.__loop.remove_reader(fd)
+            self.__fds.remove(fd)
+        self.__add(device, records, final)
+
+    def __pump(self, device, logcat, splitter):
+        final = False
+        while not final:
+            records, final = self.__read(logcat, splitter)
+            self.__loop.call_soon(self.__add, device, records, final)
+
+    def __add(self, device, records, final):
+        if self.__open == 0:
+            return
+        if final:
+            self.__open -= 1
+        merger = self.__merger
+        if merger is not None:
+            now = time.time()
+            merger.push(device, records, now)
+            records = merger.pop(now) if self.__open > 0 else merger.flush()
+        if len(records) > 0:
+            self.__sink(records)
+        if self.__open == 0:
+            self.__ended()
+
+    def __merge_timer(self):
+        # Hands over the lines held back for longer than the window when no
+        # new ones come in
+        if self.__open == 0:
+            return
+        records = self.__merger.pop(time.time())
+        if len(records) > 0:
+            self.__sink(records)
+        self.__loop.call_later(self.__window, self.__merge_timer)
+
+    def __ended(self):
+        if self.__merger is not None:
+            records = self.__merger.flush()
+            if len(records) > 0:
+                self.__sink(records)
+        self.__closed()
+
+# The running LogcatFeeds by the logcat they read
+logcat_feeds = {}
+logcat_feeds_lock = threading.Lock()
+
+class LogcatFeed(object):
+    """A LogcatReader shared by all views following the same logcat.
+
+    Every line is read and parsed once and handed to each subscriber. The
+    last backlog_lines of them are kept so that a view subscribing later
+    starts with the same history a logcat of its own would have given it.
+    The logcat is stopped when the last subscriber leaves.
+    """
+    def __init__(self, key, sources, backlog_lines):
+        self.key = key
+        self.__lock = threading.Lock()
+        self.__subscriptions = []
+        self.__backlog = deque(maxlen=backlog_lines)
+        self.__ended = False
+        self.reader = LogcatReader(sources, self.__sink, self.__closed)
+
+    @property
+    def running(self):
+        return not self.__ended
+
+    def start(self):
+        """Start the logcat, which the feed doesn't do by itself so that it
+        can be registered first"""
+        try:
+            self.reader.start()
+        except:
+            self.__closed()
+            raise
+
+    def subscribe(self, sink, closed):
+        subscription = LogcatSubscription(self, sink, closed)
+        with self.__lock:
+            ended = self.__ended
+            subscription.shared = len(self.__subscriptions) > 0
+            if not ended:
+                self.__subscriptions.append(subscription)
+            if len(self.__backlog) > 0:
+                # Before any new lines, which can't come in while the lock
+                # is held
+                sink(list(self.__backlog))
+        if ended:
+            subscription.open = False
+            sublime.set_timeout(closed, 0)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.__lock:
+            if not subscription.open:
+                return
+            subscription.open = False
+            self.__subscriptions.remove(subscription)
+            last = len(self.__subscriptions) == 0
+            if last:
+                self.__ended = True
+        if last:
+            self.__forget()
+            self.reader.close()
+        subscription.closed()
+
+    def __forget(self):
+        with logcat_feeds_lock:
+            if logcat_feeds.get(self.key) is self:
+                del logcat_feeds[self.key]
+
+    def __sink(self, records):
+        with self.__lock:
+            self.__backlog.extend(records)
+            for subscription in self.__subscriptions:
+                subscription.sink(records)
+
+    def __closed(self):
+        with self.__lock:
+            self.__ended = True
+            subscriptions = self.__subscriptions
+            self.__subscriptions = []
+            for subscription in subscriptions:
+                subscription.open = False
+        self.__forget()
+        for subscription in subscriptions:
+            subscription.closed()
+
+class LogcatSubscription(object):
+    """A view's place in a LogcatFeed, used like a LogcatReader of its own.
+    shared tells whether the logcat was already running for another view."""
+    def __init__(self, feed, sink, closed):
+        self.feed = feed
+        self.sink = sink
+        self.closed = closed
+        self.open = True
+        self.shared = False
+        self.__bytes_read = feed.reader.bytes_read
+        self.__parse_seconds = feed.reader.parse_seconds
+
+    def close(self):
+        self.feed.unsubscribe(self)
+
+    @property
+    def running(self):
+        return self.open and self.feed.reader.running
+
+    @property
+    def bytes_read(self):
+        return self.feed.reader.bytes_read - self.__bytes_read
+
+    @property
+    def parse_seconds(self):
+        return self.feed.reader.parse_seconds - self.__parse_seconds
+
+def subscribe_logcat(sources, args, since, sink, closed):
+    """Hand the records of the logcat of sources, see LogcatReader, to
+    sink(records) and call closed() once it ends or the subscription is
+    closed. args are added to the command of a single device, and since
+    is the time to start from (logcat -T) if the logcat isn't running yet."""
+    start = sources
+    if len(sources) == 1:
+        device, cmd = sources[0]
+        sources = [(device, cmd + args)]
+        if since is not None:
+            start = [(device, cmd + ["-T", since] + args)]
+        else:
+            start = sources
+    key = feed_key(sources)
+    fresh = False
+    with logcat_feeds_lock:
+        feed = logcat_feeds.get(key)
+        if feed is None or not feed.running:
+            feed = logcat_feeds[key] = LogcatFeed(key, start, get_setting("adb_maxlines"))
+            fresh = True
+    if fresh:
+        # Outside the lock, views subscribing meanwhile share it
+        feed.start()
+    return feed.subscribe(sink, closed)
+
+def feed_key(sources):
+    """What tells logcats apart: the device and the logcat arguments of each
+    source, whether or not the command names the device with -s"""
+    key = []
+    for device, cmd in sources:
+        args = cmd[1:]
+        if args[:1] == ["-s"]:
+            args = args[2:]
+        key.append((device, tuple(args)))
+    return tuple(key)
+
+__device_cache = {}
+__device_cache_lock = threading.Lock()
+
+def probe_device(device, timeout):
+    """The "product version - serial" description of a device"""
+    out = adb_shell(device, "getprop ro.product.model; getprop ro.build.version.release", timeout)
+    props = [line.strip() for line in out.split("\n")] + ["", ""]
+    product = props[0] or "Unknown"
+    version = props[1] or "x.x.x"
+    if device.startswith("emulator"):
+        port = int(device.rsplit("-")[-1])
+        t = telnetlib.Telnet("localhost", port, timeout)
+        try:
+            t.read_until(b"OK", timeout)
+            t.write(b"avd name\n")
+            product = t.read_until(b"OK", timeout).decode("utf-8")
+        finally:
+            t.close()
+        product = product.replace("OK", "").strip()
+    return "%s %s - %s" % (product, version, device)
+
+def describe_devices(devices):
+    """Descriptions of the given devices for the launch menu.
+
+    Devices that haven't been seen within the last adb_device_cache_ttl
+    seconds are probed concurrently, each with a timeout of
+    adb_device_probe_timeout seconds.
+    """
+    timeout = get_setting("adb_device_probe_timeout")
+    now = time.time()
+    descriptions = {}
+    with __device_cache_lock:
+        for device in devices:
+            cached = __device_cache.get(device)
+            if cached is not None and cached[0] > now:
+                descriptions[device] = cached[1]
+    missing = [device for device in devices if device not in descriptions]
+    if len(missing) > 0:
+        expires = now + get_setting("adb_device_cache_ttl")
+        with ThreadPoolExecutor(max_workers=min(8, len(missing))) as pool:
+            futures = [(device, pool.submit(probe_device, device, timeout)) for device in missing]
+            for device, future in futures:
+                try:
+                    descriptions[device] = future.result()
+                    with __device_cache_lock:
+                        __device_cache[device] = (expires, descriptions[device])
+                except:
+                    traceback.print_exc()
+                    descriptions[device] = "Unknown x.x.x - %s" % device
+    return [descriptions[device] for device in devices]
+
+################################################################################
+#                 Refiltering large buffers on all cores                       #
+################################################################################
+# Number of lines filtered at a time when refiltering a large buffer
+REFILTER_CHUNK = 20000
+
+__filter_pool = {}
+__filter_pool_lock = threading.Lock()
+
+def get_filter_pool():
+    """The process pool large buffers are refiltered on, or None if they're
+    to be refiltered on a background thread.
+
+    The plugin host can't be started as a worker process, so this needs
+    adb_filter_python to point at a Python 3.8+ interpreter.
+    """
+    python = get_setting("adb_filter_python")
+    if not python:
+        return None
+    with __filter_pool_lock:
+        if __filter_pool.get("python") != python:
+            shutdown_filter_pool()
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(python)
+            # The workers need to import filter_shared the same way it was
+            # imported here, either as adblog or from the package
+            path = os.path.dirname(os.path.abspath(sys.modules[filter_shared.__module__].__file__))
+            if "." in filter_shared.__module__:
+                path = os.path.dirname(path)
+            workers = get_setting("adb_filter_workers") or None
+            __filter_pool["pool"] = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                        initializer=site.addsitedir, initargs=(path,))
+            __filter_pool["python"] = python
+        return __filter_pool["pool"]
+
+def shutdown_filter_pool():
+    pool = __filter_pool.pop("pool", None)
+    __filter_pool.pop("python", None)
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+def filter_in_pool(pool, filter, first, lines, chunks):
+    """Yields filter_lines of each (begin, end) chunk of lines in turn.
+
+    The lines are copied to shared memory once, and the workers are only
+    sent where their chunk is in it.
+    """
+    from multiprocessing import shared_memory
+    data = ["".join(lines[begin:end]).encode("utf-8") for begin, end in chunks]
+    block = shared_memory.SharedMemory(create=True, size=max(1, sum(len(chunk) for chunk in data)))
+    futures = []
+    try:
+        pos = 0
+        for (begin, end), chunk in zip(chunks, data):
+            block.buf[pos:pos + len(chunk)] = chunk
+            futures.append(pool.submit(filter_shared, block.name, pos, pos + len(chunk), first + begin, filter))
+            pos += len(chunk)
+        del data
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        block.close()
+        block.unlink()
+
+def discard_filter_pool(pool):
+    """Stop using a pool that failed, a new one is started next time"""
+    with __filter_pool_lock:
+        if __filter_pool.get("pool") is pool:
+            shutdown_filter_pool()
+
+def plugin_unloaded():
+    shutdown_filter_pool()
+    shutdown_io_loop()
 
 def clear_logcat():
-    adb = get_setting("adb_command")
-    cmd_clear = [adb, "logcat", "-c"]
-    proc_clear = subprocess.Popen(cmd_clear, shell=process_shell)
+    try:
+        adb_shell("", "logcat -c")
+    except:
+        traceback.print_exc()
+
+
+################################################################################
+#                  Counters of the work done for an ADBView                    #
+################################################################################
+class ViewStats(object):
+    """Where the time goes in an ADBView, to tell whether it falls behind in
+    reading the logcat, in queuing the lines or in updating the view."""
+    def __init__(self):
+        self.started = time.time()
+        self.received = 0
+        self.dropped = 0
+        self.muted = 0
+        self.collapsed = 0
+        self.trimmed = 0
+        self.restarts = 0
+        self.queue_depth = 0
+        self.queue_max = 0
+        self.updates = 0
+        self.batch_last = 0
+        self.batch_max = 0
+        self.process_seconds = 0.0
+        self.process_max = 0.0
+        self.filter_seconds = 0.0
+        self.refilters = 0
+        self.refilter_last = 0.0
+        self.rate = 0.0
+        self.__rate_received = 0
+        self.__rate_time = self.started
+
+    def add_batch(self, size, seconds):
+        self.updates += 1
+        self.batch_last = size
+        self.batch_max = max(self.batch_max, size)
+        self.process_seconds += seconds
+        self.process_max = max(self.process_max, seconds)
+
+    def update_rate(self):
+        """Update the ingest rate to that since the last call"""
+        now = time.time()
+        received = self.received
+        if now > self.__rate_time:
+            self.rate = (received - self.__rate_received) / (now - self.__rate_time)
+        self.__rate_received = received
+        self.__rate_time = now
+
+    def summary(self):
+        mean = self.process_seconds / self.updates if self.updates else 0.0
+        return "ADB: %d lines/s, queue %d, batch %d, %.1f ms/update, %d trimmed, %d dropped" % (
+            self.rate, self.queue_depth, self.batch_last, mean * 1000, self.trimmed, self.dropped)
+
+    def as_dict(self):
+        stats = dict((key, value) for key, value in self.__dict__.items() if not key.startswith("_"))
+        stats["uptime"] = time.time() - self.started
+        stats["process_mean"] = self.process_seconds / self.updates if self.updates else 0.0
+        return stats
+
+
+################################################################################
+#                    Tracking the process ids of an app                        #
+################################################################################
+class AppPidTracker(object):
+    """Keeps track of the process ids of the app given by adb_app_package.
+
+    The pids are resolved once with pgrep and then followed through the
+    ActivityManager messages in the log itself. pgrep is run again at most
+    once every adb_app_pid_poll_interval seconds, so that pids whose death
+    wasn't logged are dropped. The caller runs pgrep, so that it doesn't
+    block.
+    """
+    # "Start proc 1234:com.example/u0a12 for activity ..." and the older
+    # "Start proc com.example for activity ...: pid=1234 uid=..."
+    START_PATTERN = re.compile(r"Start proc (?:(\d+):)?([^\s/]+)\S*.*?(?:pid=(\d+)|$)")
+    DIED_PATTERN = re.compile(r"Process (\S+) \(pid (\d+)\) has died")
+    KILL_PATTERN = re.compile(r"Killing (\d+):([^\s/]+)")
+
+    def __init__(self, package, device="", poll_interval=10):
+        self.package = package
+        self.device = device
+        self.poll_interval = poll_interval
+        # The pids whose log is shown: those of a process that died stay until
+        # the next poll, after which the pid may belong to another process
+        self.pids = set()
+        self.alive = set()
+        # Whether the output of poll_command has come in at least once
+        self.polled = False
+        self.__polling = False
+        self.__last_poll = None
+        # The pids found in the log while a poll is running, which its output
+        # may be too old to have
+        self.__started = set()
+
+    def feed(self, records):
+        """Look for the app's processes starting or dying, returns True if a
+        new pid was found"""
+        changed = False
+        package = self.package
+        for record in records:
+            if record[TAG_GROUP+1] != "ActivityManager":
+                continue
+            message = record[0][record[OFFSET_FIELD]:]
+            m = self.START_PATTERN.search(message)
+            if m is not None:
+                pid = m.group(1) or m.group(3)
+                if pid and package in m.group(2):
+                    changed |= self.__add(int(pid))
+                continue
+            m = self.DIED_PATTERN.search(message)
+            if m is not None:
+                if package in m.group(1):
+                    self.alive.discard(int(m.group(2)))
+                continue
+            m = self.KILL_PATTERN.search(message)
+            if m is not None and package in m.group(2):
+                self.alive.discard(int(m.group(1)))
+        return changed
+
+    def poll_due(self):
+        """Whether to ask the device for the app's pids with poll_command,
+        which is at most once per poll_interval. Returns True at most once
+        until found() is called."""
+        now = time.time()
+        if self.__polling or (self.__last_poll is not None and now - self.__last_poll < self.poll_interval):
+            return False
+        self.__last_poll = now
+        self.__polling = True
+        self.__started.clear()
+        return True
+
+    @property
+    def poll_command(self):
+        return "pgrep -f %s" % self.package
+
+    def found(self, out):
+        """Take the pids in the output of poll_command as the running
+        processes of the app, dropping the others. out is None when the poll
+        failed. Returns True if the pids changed."""
+        self.__polling = False
+        self.polled = True
+        if out is None:
+            return False
+        alive = set(int(pid) for pid in re.findall(r"\d+", out))
+        alive |= self.__started & self.alive
+        changed = alive != self.pids
+        self.pids = set(alive)
+        self.alive = alive
+        return changed
+
+    def __add(self, pid):
+        if self.__polling:
+            self.__started.add(pid)
+        self.alive.add(pid)
+        if pid in self.pids:
+            return False
+        self.pids.add(pid)
+        return True
 
 
 ################################################################################
 #                ADBView class dealing with ADB Logcat views                   #
 ################################################################################
 class ADBView(object):
-    def __init__(self, cmd, name="", device="", info=""):
+    def __init__(self, cmd, name="", device="", info="", merge=None):
+        """cmd is the adb logcat command to run for the device. For a view
+        merging the logs of several devices, merge is instead a list of
+        (device, cmd)."""
         self.__name = "ADB: %s" % name
         self.__device = device
         self.__view = None
-        self.__last_fold = None
+        # Absolute id of the first row of the hidden lines at the end of the
+        # view, which the next batch might extend
+        self.__fold_start = None
         self.__timer = None
+        self.__sources = merge or [(device, cmd)]
         self.__lines = []
-        self.__app_pid = -1
+        self.__ready = []
+        # Whether the UI thread has a batch of lines it's not done with yet
+        self.__ui_busy = False
+        self.__update_scheduled = False
+        self.__last_update = 0
+        self.__dropped = 0
+        self.__stats = ViewStats()
+        self.__talkers = TalkerStats(get_setting("adb_talker_window"))
+        # {field: values} of the sources whose lines are dropped
+        self.__muted = {}
+        self.__update_interval = 1.0 / max(1, get_setting("adb_updates_per_second"))
+        self.__max_pending = get_setting("adb_max_pending_lines")
+        self.__store = LogStore()
+        self.__archive = None
+        archive_dir = get_setting("adb_archive_dir")
+        if archive_dir:
+            session = "%s-%s" % (time.strftime("%Y%m%d-%H%M%S"), re.sub(r"[^\w.-]", "_", device or "merged"))
+            self.__archive = SessionArchive(os.path.join(os.path.expanduser(archive_dir), session),
+                                            get_setting("adb_archive_segment_lines"))
         self.__app_package = get_setting('adb_app_package')
-        self.__cond = threading.Condition()
+        self.__app_tracker = None
+        if self.__app_package:
+            self.__app_tracker = AppPidTracker(self.__app_package, device, get_setting("adb_app_pid_poll_interval"))
+        self.__lock = threading.Lock()
         self.__maxlines = get_setting("adb_maxlines")
-        self.__filter = re.compile(get_setting("adb_filter"))
-        self.__filter_groups = FILTER_GROUPS.copy()
+        # Trimming only starts once the view is this many lines past
+        # adb_maxlines, so that it's done in large blocks rather than a few
+        # lines with every update
+        self.__trim_threshold = self.__maxlines + int(self.__maxlines * get_setting("adb_trim_slack"))
+        self.__filter = parse_filter(get_setting("adb_filter"))
+        # Bumped whenever a refilter running in the background is outdated
+        self.__generation = 0
+        self.__refilter_end = None
         self.__do_scroll = get_setting("adb_auto_scroll")
         self.__manual_scroll = False
         self.__snapLines = get_setting("adb_snap_lines")
         self.__strip_filterd_lines = get_setting("adb_strip_filtered_lines")
         self.__cmd = cmd
         self.__closing = False
+        self.__stopped = False
+        # Filter arguments added to the logcat command, which is restarted
+        # whenever they change. The merged logcats and the app's pids change
+        # too often for that.
+        self.__pushdown = merge is None and not self.__app_package and get_setting("adb_filter_pushdown")
+        self.__pushed = logcat_args(self.__filter) if self.__pushdown else []
+        # Whether logcat is new enough for -T, --pid and -e
+        self.__new_logcat = True
+        self.__resume = LogResume()
+        # Start a new logcat when the device goes away and comes back
+        self.__reconnect = merge is None and get_setting("adb_reconnect")
+        self.__attempts = 0
+        # Readers replaced by a restart are told apart by their number
+        self.__reader_number = 0
+        self.__reader = None
+        self.__reader_trial = False
+        self.__bytes_read = 0
+        self.__parse_seconds = 0.0
         self.__view = sublime.active_window().new_file()
         self.__view.set_name(self.__name)
         self.__view.set_scratch(True)
@@ -241,74 +1102,370 @@ class ADBView(object):
         # "scroll_past_end" affects our auto scrolling feature, and it is default to 
         # True on all platforms except macOS.
         self.__view.settings().set("scroll_past_end", False)
+
+        self.__collapser = None
+        self.__repeats = None
+        if get_setting("adb_collapse_repeats"):
+            self.__collapser = RepeatCollapser(get_setting("adb_collapse_window"))
+            if hasattr(sublime, "PhantomSet"):
+                # Phantoms leave the text, and with it the offsets in the
+                # store, as it is. Sublime Text 2 doesn't have them, there
+                # the repeats are only left out. The phantom ids by row, so
+                # that only those of changed counts are redrawn.
+                self.__repeats = {}
         
         if self.__app_package:
             self.add_text("Filtering log by package name '%s', disable option 'adb_app_package' to see full log" % self.__app_package)
         
         self.add_text('Loading...')
-        self.update_app_pid()
         
         if info:
             self.add_text(info)
+        if len(self.__pushed) > 0:
+            self.add_text("[ADBView] Filtering on the device: %s" % " ".join(self.__pushed))
         
-        print("running: %s" % cmd)
-        info = None
-        if os.name == 'nt':
-            info = subprocess.STARTUPINFO()
-            info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        self.__adb_process = subprocess.Popen(cmd, startupinfo=info, stdout=subprocess.PIPE)
-        threading.Thread(target=self.__output_thread, args=(self.__adb_process.stdout,)).start()
-        threading.Thread(target=self.__process_thread).start()
+        self.__start_reader()
+        if self.__app_tracker is not None:
+            get_io_loop().call_soon(self.update_app_pid)
+        if get_setting("adb_show_stats"):
+            sublime.set_timeout(self.__update_stats, 1000)
 
     def close(self):
-        if self.__adb_process != None and self.__adb_process.poll() == None:
-            self.__adb_process.kill()
+        self.__generation += 1
+        self.__stopped = True
+        self.__reader.close()
+        # Don't hold on to lines for a view that's gone
+        with self.__lock:
+            self.__ui_busy = False
 
     def set_filter_by_group(self, group, value, folding=True, reset_filter=True):
-        if reset_filter:
-            self.__filter_groups = FILTER_GROUPS.copy()
-        self.__filter_groups[group] = str(value)
-        if self.__app_pid != -1:
-            self.__filter_groups[PID_GROUP] = str(self.__app_pid)
-        
-        filter = GROUPS_SEPARATOR.join(self.__filter_groups)
+        if not isinstance(value, frozenset):
+            if group in (PID_GROUP, THREAD_GROUP):
+                value = int(value)
+            value = frozenset((value,))
+        filter = LogFilter() if reset_filter else self.__filter
+        filter = filter.with_field(group + 1, value)
+        if self.__app_tracker is not None:
+            filter = filter.with_field(PID_FIELD, self.__app_tracker.pids)
         self.set_filter(filter, folding)
     
     def set_filter(self, filter, folding=True):
         try:
-            self.__filter = re.compile(filter)
+            # Times like last:30s are relative to the latest line when the
+            # filter was set
+            self.__filter = as_filter(filter).anchored(self.__store.newest())
             if folding and self.__view:
-                self.__last_fold = apply_filter(self.__view, self.__filter)
+                self.refilter()
         except:
             traceback.print_exc()
             sublime.error_message("invalid regex")
+            return
+        if folding and self.__pushdown and not self.__stopped:
+            args = logcat_args(self.__filter)
+            if args != self.__pushed:
+                if len(args) > 0:
+                    self.add_text("[ADBView] Filtering on the device: %s" % " ".join(args))
+                else:
+                    self.add_text("[ADBView] Filtering on the host only")
+                self.__restart(args, True)
+
+    def __start_reader(self):
+        since = None
+        if self.__resume.time is not None and self.__new_logcat:
+            # Only what was logged since the last line read
+            since = format_time(self.__resume.time)
+        number = self.__reader_number
+        self.__reader_started = time.time()
+        self.__reader = subscribe_logcat(self.__sources, self.__pushed, since,
+                                         lambda records: self.__add_records(records, number),
+                                         lambda: self.__reader_closed(number))
+        if self.__reader.shared:
+            self.add_text("[ADBView] Sharing the logcat of another view")
+
+    def __restart(self, args, trial=False):
+        """Restart the logcat with the given filter arguments, leaving out
+        the lines the previous one has already read. With trial, the
+        arguments are dropped again if logcat doesn't take them."""
+        reader = self.__reader
+        with self.__lock:
+            self.__reader_number += 1
+            self.__resume.resume()
+        self.__pushed = args
+        self.__reader_trial = trial and len(args) > 0
+        self.__stats.restarts += 1
+        self.__bytes_read += reader.bytes_read
+        self.__parse_seconds += reader.parse_seconds
+        reader.close()
+        self.__start_reader()
     
-    def update_app_pid(self):
-        if self.__app_package:
-            adb = get_setting("adb_command")
-            # cmd_pid = [adb, "shell", "pidof", self.__app_package]
-            cmd_pid = [adb, "shell", "pgrep", "-f", self.__app_package]
-            proc_pid = subprocess.Popen(cmd_pid, shell=process_shell, stdout=subprocess.PIPE)
-            app_pid, err = proc_pid.communicate()
-            
-            if not app_pid:
-                app_pid = 0
-                if self.__app_pid == -1:
-                    self.add_text("PID not found for process: '%s'" % self.__app_package)
-            else:
-                app_pid = decode(app_pid)
-                app_pid = int(app_pid.split('\n')[0].strip())
-            
-            if self.__app_pid != app_pid:
-                self.__app_pid = app_pid
-                self.set_filter_by_group(PID_GROUP, app_pid, False, False)
-                if app_pid:
-                    self.add_text("PID for process: '%s' [%s]" % (self.__app_package, app_pid))
+    def refilter(self):
+        """Refold the whole view from the lines kept in memory"""
+        begin = time.time()
+        self.__generation += 1
+        store = self.__store
+        filter = self.__filter
+        if filter.indexed or len(store) <= REFILTER_CHUNK:
+            self.__refilter_end = None
+            self.__view.erase_status("adb_refilter")
+            self.__fold_rows(filter.select(store))
+            self.__refiltered(begin, begin)
+            return
+        self.__refilter_started = begin
+        # Too much to do without blocking the UI. The lines are filtered in
+        # chunks from the newest back, everything not filtered yet is hidden.
+        self.__refilter_first = store.first
+        self.__refilter_end = self.__refilter_from = store.first + len(store)
+        self.__refilter_rows = []
+        self.__show_refiltered()
+        threading.Thread(target=self.__refilter_thread,
+                         args=(self.__generation, filter, store.first, store.lines[:], get_filter_pool())).start()
+
+    def __refilter_thread(self, generation, filter, first, lines, pool):
+        chunks = [(begin, min(len(lines), begin + REFILTER_CHUNK)) for begin in range(0, len(lines), REFILTER_CHUNK)]
+        chunks.reverse()
+        done = 0
+        rows = []
+        posted = time.time()
+        if pool is not None:
+            try:
+                results = filter_in_pool(pool, filter, first, lines, chunks)
+                try:
+                    for chunk_rows in results:
+                        if generation != self.__generation:
+                            return
+                        rows = chunk_rows + rows
+                        done += 1
+                        if done == len(chunks) or time.time() - posted > 0.25:
+                            sublime.set_timeout(self.__refiltered_callback(generation, first + chunks[done - 1][0], rows), 0)
+                            rows = []
+                            posted = time.time()
+                finally:
+                    results.close()
+            except Exception:
+                # Carry on without the pool
+                traceback.print_exc()
+                discard_filter_pool(pool)
+        for begin, end in chunks[done:]:
+            if generation != self.__generation:
+                return
+            rows = filter_lines(filter, lines[begin:end], first + begin) + rows
+            if begin == 0 or time.time() - posted > 0.25:
+                sublime.set_timeout(self.__refiltered_callback(generation, first + begin, rows), 0)
+                rows = []
+                posted = time.time()
+
+    def __refiltered_callback(self, generation, begin, rows):
+        def __refiltered():
+            if generation != self.__generation:
+                return
+            self.__refilter_from = begin
+            self.__refilter_rows = rows + self.__refilter_rows
+            self.__show_refiltered()
+        return __refiltered
+
+    def __show_refiltered(self):
+        begin = time.time()
+        store = self.__store
+        base = store.first
+        rows = [row - base for row in self.__refilter_rows if row >= base]
+        # Lines added since the refilter started
+        matches = self.__filter.matches
+        rows.extend(row for row in range(max(0, self.__refilter_end - base), len(store)) if matches(store.record(row)))
+        if self.__filter.contextual:
+            test = self.__filter.context_test(store)
+            rows = [row for row in rows if test(row)]
+        self.__fold_rows(rows)
+        if self.__refilter_from <= self.__refilter_first:
+            self.__refilter_end = None
+            self.__view.erase_status("adb_refilter")
+            self.__refiltered(begin, self.__refilter_started)
+        else:
+            self.__stats.filter_seconds += time.time() - begin
+            done = self.__refilter_end - self.__refilter_from
+            self.__view.set_status("adb_refilter", "ADB: filtering %d%%" % (100 * done // (self.__refilter_end - self.__refilter_first)))
+
+    def __refiltered(self, begin, started):
+        now = time.time()
+        self.__stats.filter_seconds += now - begin
+        self.__stats.refilters += 1
+        self.__stats.refilter_last = now - started
+
+    def __fold_rows(self, rows):
+        """Fold everything but the given sorted rows and the info lines"""
+        store = self.__store
+        info = store.rows_with({PID_FIELD: INFO_PIDS})
+        if len(info) > 0:
+            rows = sorted(set(rows).union(info))
+        self.__view.run_command("unfold_all")
+        self.__view.fold([sublime.Region(a, b) for a, b in store.hidden_spans(rows)])
+        self.__fold_start = None
+        if store and (not rows or rows[-1] != len(store) - 1):
+            self.__fold_start = store.first + (rows[-1] + 1 if rows else 0)
+
+    def is_filtered(self, record):
+        # ADBView's own info lines are always shown
+        return record[PID_FIELD] >= 0 and not self.__filter.matches(record)
+
+    def go_to_time(self, text):
+        """Move the cursor to the first line logged at or after the given
+        time, see resolve_time. Returns False if no line has a time yet."""
+        store = self.__store
+        now = store.newest()
+        if now is None:
+            return False
+        point = store.point(store.row_at(resolve_time(text, now)))
+        self.__view.sel().clear()
+        self.__view.sel().add(sublime.Region(point))
+        self.__view.show_at_center(point)
+        return True
+
+    def crashes(self):
+        """The CrashEvents of the lines kept in memory, oldest first"""
+        return list(self.__store.crashes.events)
+
+    def go_to_row(self, row):
+        """Move the cursor to the row with the given absolute id, or the
+        first one kept if it's been trimmed"""
+        store = self.__store
+        point = store.point(max(0, row - store.first))
+        self.__view.sel().clear()
+        self.__view.sel().add(sublime.Region(point))
+        self.__view.show_at_center(point)
+
+    def export(self, path, format, window=None):
+        """Write the lines passing the filter, or all lines logged in the
+        TimeTerm window, to path on a background thread. See
+        export_records for the formats."""
+        store = self.__store
+        filter = self.__filter if window is None else LogFilter((window,))
+        filter = filter.anchored(store.newest())
+        rows = filter.select(store) if filter.indexed else None
+        test = filter.context_test(store) if filter.contextual and rows is None else None
+        columns = (store.lines[:], store.times[:], store.pids[:], store.tids[:], store.levels[:], store.tags[:], store.offsets[:])
+        threading.Thread(target=self.__export_thread, args=(path, format, filter, rows, test, columns)).start()
+
+    def __export_thread(self, path, format, filter, rows, test, columns):
+        begin = time.time()
+        if rows is not None:
+            lines, times, pids, tids, levels, tags, offsets = columns
+            records = ((lines[row], times[row], pids[row], tids[row], levels[row], tags[row], offsets[row]) for row in rows)
+        else:
+            matches = filter.matches
+            records = (record for row, record in enumerate(zip(*columns)) if matches(record) and (test is None or test(row)))
+        try:
+            with open(path, "wb") as f:
+                count = export_records(f, records, format)
+        except (IOError, OSError):
+            message = "Couldn't export to %s:\n\n%s" % (path, traceback.format_exc())
+            sublime.set_timeout(lambda: sublime.error_message(message), 0)
+            return
+        message = "ADB: Exported %d lines to %s in %.2fs" % (count, path, time.time() - begin)
+        sublime.set_timeout(lambda: sublime.status_message(message), 0)
+
+    def record_at(self, point):
+        row, _ = self.__view.rowcol(point)
+        if row < len(self.__store):
+            return self.__store.record(row)
+        return None
+
+    def clear(self):
+        if self.__collapser is not None:
+            self.__collapser.clear()
+            self.__show_repeats()
+        self.__generation += 1
+        self.__refilter_end = None
+        self.__view.erase_status("adb_refilter")
+        self.__store.clear()
+        self.__fold_start = None
+
+    def update_app_pid(self, records=()):
+        """Follow the app's pids through the records, asking the device for
+        them every adb_app_pid_poll_interval. Runs on the I/O loop."""
+        tracker = self.__app_tracker
+        if tracker is None:
+            return
+        if tracker.feed(records):
+            self.__app_pids_changed(True)
+        if tracker.poll_due():
+            get_io_loop().run_command(self.__app_pids_polled, adb_shell, self.__device, tracker.poll_command)
+
+    def __app_pids_polled(self, out, error):
+        tracker = self.__app_tracker
+        if error is not None:
+            print(error)
+            out = None
+        first = not tracker.polled
+        changed = tracker.found(out)
+        if changed or first:
+            self.__app_pids_changed(len(tracker.pids) > 0)
+        if first:
+            # The lines held back for the pids
+            self.__schedule_update()
+
+    def __app_pids_changed(self, found):
+        tracker = self.__app_tracker
+        self.set_filter_by_group(PID_GROUP, frozenset(tracker.pids), False, False)
+        if found:
+            self.add_text("PID for process: '%s' [%s]" % (self.__app_package, ", ".join(str(p) for p in sorted(tracker.pids))))
+        else:
+            self.add_text("PID not found for process: '%s'" % self.__app_package)
     
+    def __update_stats(self):
+        if get_adb_view(self.__view) is None:
+            return
+        self.__stats.update_rate()
+        self.__view.set_status("adb_stats", self.__stats.summary())
+        sublime.set_timeout(self.__update_stats, 1000)
+
+    def talkers(self):
+        """The busiest tags, pids and levels, see TalkerStats.top()"""
+        return self.__talkers.top(time.time())
+
+    def is_muted(self, field, value):
+        return value in self.__muted.get(field, ())
+
+    @property
+    def muted(self):
+        return self.__muted
+
+    def mute(self, field, value, muted=True):
+        """Drop the lines of the source before they get to the view"""
+        # Replaced rather than changed, it is read by the reader thread
+        sources = dict(self.__muted)
+        values = sources.get(field, frozenset())
+        values = values | frozenset((value,)) if muted else values - frozenset((value,))
+        if len(values) > 0:
+            sources[field] = values
+        else:
+            sources.pop(field, None)
+        self.__muted = sources
+        self.add_text("[ADBView] %s %s" % ("Muted" if muted else "Unmuted", FieldTerm(field, (value,))))
+
+    def unmute_all(self):
+        self.__muted = {}
+        self.add_text("[ADBView] Unmuted everything")
+
+    def stats(self):
+        """The counters of this view as a dict"""
+        stats = self.__stats.as_dict()
+        stats.update({
+            "name": self.__name,
+            "device": self.__device,
+            "pending": len(self.__lines),
+            "retained_lines": len(self.__store),
+            "retained_chars": self.__store.size,
+            "crashes": len(self.__store.crashes.events),
+            "bytes_read": self.__bytes_read + self.__reader.bytes_read,
+            "parse_seconds": self.__parse_seconds + self.__reader.parse_seconds,
+        })
+        return stats
+
     def add_text(self, text):
-        self.__view.set_read_only(False)
-        self.__view.run_command('insert', {"characters": text + '\n'})
-        self.__view.set_read_only(True)
+        # Goes through the same queue as the log lines so that the view and
+        # the line store stay in sync
+        with self.__lock:
+            self.__lines.append(info_record(text + "\n"))
+        self.__schedule_update()
     
     @property
     def name(self):
@@ -327,56 +1484,179 @@ class ADBView(object):
         return self.__filter
 
     @property
-    def running(self):
-        return self.__adb_process.poll() == None
+    def archive(self):
+        return self.__archive
 
-    def __output_thread(self, pipe):
-        while True:
-            try:
-                if self.__adb_process.poll() != None:
-                    break
-                line = decode(pipe.readline().strip())
+    @property
+    def running(self):
+        return self.__reader.running
+
+    def __add_records(self, records, number):
+        with self.__lock:
+            if number != self.__reader_number:
+                # From a logcat that has been restarted
+                return
+            records = self.__resume.filter(records)
+            self.__resume.seen(records)
+        if len(records) == 0:
+            return
+        if self.__attempts > 0:
+            self.__attempts = 0
+            self.add_text("[ADBView] Reconnected")
+        self.__stats.received += len(records)
+        self.__talkers.add(records, time.time())
+        if self.__archive is not None:
+            # Before anything can be dropped
+            self.__archive.append(records)
+        muted = self.__muted
+        if len(muted) > 0:
+            count = len(records)
+            records = [record for record in records if not any(record[field] in values for field, values in muted.items())]
+            self.__stats.muted += count - len(records)
+        with self.__lock:
+            self.__lines.extend(records)
+            overflow = len(self.__lines) - self.__max_pending
+            if overflow > 0:
+                # The view can't keep up, drop the oldest pending
+                # lines rather than growing without bounds
+                del self.__lines[:overflow]
+                self.__dropped += overflow
+        self.__schedule_update()
+
+    def __reader_closed(self, number):
+        if number != self.__reader_number:
+            return
+        if self.__stopped:
+            self.__ended()
+        elif self.__reader_trial and self.__reader.bytes_read == 0 and time.time() - self.__reader_started < 5:
+            # Most likely a logcat too old for the arguments, filter on the
+            # host instead
+            def __fall_back():
+                if number == self.__reader_number and not self.__stopped:
+                    self.__pushdown = False
+                    self.__new_logcat = False
+                    self.add_text("[ADBView] logcat ended right away, filtering on the host only")
+                    self.__restart([])
+            sublime.set_timeout(__fall_back, 0)
+        elif self.__reconnect and self.__attempts < get_setting("adb_reconnect_attempts"):
+            # Backing off in case the device is there but its logcat isn't
+            # up yet
+            delay = min(30, 2 ** self.__attempts)
+            self.__attempts += 1
+            if self.__attempts == 1:
+                self.add_text("[ADBView] logcat ended, waiting for the device to come back")
+            get_io_loop().call_later(delay, self.__wait_for_device, number)
+        else:
+            self.__ended()
 
-                if len(line) > 0:
-                    with self.__cond:
-                        self.__lines.append(line + "\n")
-                        self.__cond.notify()
-            except:
-                traceback.print_exc()
+    def __wait_for_device(self, number):
+        if self.__stopped:
+            self.__ended()
+            return
+        # adb wait-for-device rather than polling adb devices, with a
+        # timeout to notice the view being closed
+        get_io_loop().run_command(lambda online, error: self.__device_waited(number, online, error),
+                                  adb_wait_for_device, self.__device, 5)
+
+    def __device_waited(self, number, online, error):
+        if error is not None:
+            print(error)
+            self.__ended()
+        elif self.__stopped:
+            self.__ended()
+        elif not online:
+            self.__wait_for_device(number)
+        else:
+            def __reconnect():
+                if self.__stopped:
+                    self.__ended()
+                elif number == self.__reader_number:
+                    self.__restart(self.__pushed)
+            sublime.set_timeout(__reconnect, 0)
+
+    def __ended(self):
+        """The logcat has ended for good"""
         def __update_name():
             self.__name += " [Closed]"
             self.__view.set_name(self.__name)
-        sublime.set_timeout(__update_name, 0)
-
-        # shutdown the process thread
-        with self.__cond:
+        with self.__lock:
+            if self.__closing:
+                return
             self.__closing = True
-            self.__cond.notify()
-    
-    def __process_thread(self):
-        while True:
-            with self.__cond:
-                if self.__closing:
-                    break
-                self.__cond.wait()
-
-            # collect more logs, for better performance
-            time.sleep(0.01)
-            
-            self.update_app_pid()
-            sublime.set_timeout(self.__check_autoscroll, 0)
+        # Closes the archive once the lines still queued are shown
+        self.__schedule_update()
+        sublime.set_timeout(__update_name, 0)
 
-            lines = None
-            with self.__cond:
-                lines = self.__lines
-                self.__lines = []
+    def __schedule_update(self):
+        """Have the lines queued up handed to the UI thread, coalescing
+        everything arriving within one update interval into one update"""
+        with self.__lock:
+            if self.__update_scheduled:
+                return
+            self.__update_scheduled = True
+        get_io_loop().call_later(max(0, self.__last_update + self.__update_interval - time.time()), self.__post_update)
+
+    def __post_update(self):
+        with self.__lock:
+            self.__update_scheduled = False
+            if self.__ui_busy:
+                # Back pressure, don't hand the UI thread another batch
+                # before it is done with the previous one. Lines keep
+                # queuing up meanwhile, process_pending schedules the next.
+                return
+            tracker = self.__app_tracker
+            if tracker is not None and not tracker.polled and not self.__stopped:
+                # The first batch waits for the app's pids, so that it's
+                # filtered by them. The poll schedules the update.
+                return
+            lines = self.__lines
+            self.__lines = []
+            dropped = self.__dropped
+            self.__dropped = 0
+            if len(lines) == 0 and dropped == 0:
+                if self.__closing and self.__archive is not None:
+                    self.__archive.close()
+                return
+            self.__ui_busy = True
+        self.__stats.queue_depth = len(lines)
+        self.__stats.queue_max = max(self.__stats.queue_max, len(lines))
+
+        sublime.set_timeout(self.__check_autoscroll, 0)
+
+        # Done here rather than in the UI thread so that the filter knows
+        # about new pids before the lines from them are filtered
+        self.update_app_pid(lines)
+
+        if dropped > 0:
+            self.__stats.dropped += dropped
+            lines.insert(0, info_record("[ADBView] %d lines dropped, the view couldn't keep up\n" % dropped))
+
+        self.__ready = lines
+        sublime.set_timeout(self.__update_view, 0)
+        self.__last_update = time.time()
+
+    def __update_view(self):
+        if get_adb_view(self.__view) is None:
+            self.__ready = []
+            self.__ui_done()
+            return
+        self.__view.run_command("adb_add_line")
 
+    def process_pending(self, e):
+        try:
+            lines = self.__ready
+            self.__ready = []
             if len(lines) > 0:
-                def gen_func(view, lines):
-                    def __run():
-                        view.run_command("adb_add_line", {"data": lines})
-                    return __run
-                sublime.set_timeout(gen_func(self.__view, lines), 0)
+                self.process_lines(e, lines)
+        finally:
+            self.__ui_done()
+
+    def __ui_done(self):
+        with self.__lock:
+            self.__ui_busy = False
+            pending = len(self.__lines) > 0 or self.__dropped > 0 or self.__closing
+        if pending:
+            self.__schedule_update()
 
     def __check_autoscroll(self):
         if self.__do_scroll:
@@ -389,47 +1669,244 @@ class ADBView(object):
                 self.__manual_scroll = ns
                 sublime.status_message("ADB: manual scrolling enabled" if self.__manual_scroll else "ADB: automatic scrolling enabled")
 
-    def process_lines(self, e, lines):
-        overflowed = 0
-        row, _ = self.__view.rowcol(self.__view.size())
-        for line in lines:
-            filtered = (self.__filter.search(line) is None)
-            if filtered and self.__strip_filterd_lines:
+    def process_lines(self, e, records):
+        begin = time.time()
+        store = self.__store
+        view = self.__view
+        is_filtered = self.is_filtered
+        strip = self.__strip_filterd_lines
+        collapser = self.__collapser
+        row = store.first + len(store)
+        batch = []
+        hidden = []
+        for record in records:
+            filtered = is_filtered(record)
+            if filtered and strip:
                 continue
+            if collapser is not None and not collapser.add(record, row):
+                continue
+            batch.append(record)
+            hidden.append(filtered)
             row += 1
-            if row > self.__maxlines:
-                overflowed += 1
-            self.__view.set_read_only(False)
-            self.__view.insert(e, self.__view.size(), line)
-            self.__view.set_read_only(True)
-
-            if filtered:
-                region = self.__view.line(self.__view.size()-1)
-                if self.__last_fold != None:
-                    self.__last_fold = self.__last_fold.cover(region)
-                else:
-                    self.__last_fold = region
-            else:
-                if self.__last_fold is not None:
-                    foldregion = sublime.Region(self.__last_fold.begin()-1, self.__last_fold.end())
-                    self.__view.fold(foldregion)
-                self.__last_fold = None
-        if overflowed > 0:
-            remove_region = sublime.Region(0, self.__view.text_point(overflowed, 0))
-            self.__view.set_read_only(False)
-            self.__view.erase(e, remove_region)
-            self.__view.set_read_only(True)
-            if self.__last_fold is not None:
-                self.__last_fold = sublime.Region(self.__last_fold.begin() - remove_region.size(),
-                                                  self.__last_fold.end() - remove_region.size())
-        if self.__last_fold is not None:
-            foldregion = sublime.Region(self.__last_fold.begin()-1, self.__last_fold.end())
-            self.__view.fold(foldregion)
+
+        if len(batch) > 0:
+            first = store.first + len(store)
+            store.append(batch)
+            if self.__filter.contextual:
+                # Whether a line is part of a crash is only known once it's
+                # in the store
+                test = self.__filter.context_test(store)
+                hidden = [filtered or (record[PID_FIELD] >= 0 and not test(row))
+                          for row, (filtered, record) in enumerate(zip(hidden, batch), first - store.first)]
+            view.set_read_only(False)
+            view.insert(e, view.size(), "".join([record[0] for record in batch]))
+            if len(store) > self.__trim_threshold:
+                self.__stats.trimmed += len(store) - self.__maxlines
+                view.erase(e, sublime.Region(0, store.trim(len(store) - self.__maxlines)))
+                if collapser is not None:
+                    collapser.trim(store.first)
+            view.set_read_only(True)
+
+            # Work out the folds of the whole batch from the filter results
+            # and apply them in one go. A run of hidden lines at the end is
+            # left open so that the next batch can extend it.
+            spans = []
+            start = self.__fold_start
+            for row, filtered in enumerate(hidden, first):
+                if filtered:
+                    if start is None:
+                        start = row
+                elif start is not None:
+                    if row > store.first:
+                        spans.append(store.span(max(0, start - store.first), row - store.first))
+                    start = None
+            if start is not None:
+                spans.append(store.span(max(0, start - store.first), len(store)))
+            self.__fold_start = start
+            if len(spans) > 0:
+                view.fold([sublime.Region(a, b) for a, b in spans])
+
         if self.__do_scroll and not self.__manual_scroll:
             # keep the position of horizontal scroll bar
             curr = self.__view.viewport_position()
             bottom = self.__view.text_to_layout(self.__view.size())
             self.__view.set_viewport_position((curr[0], bottom[1]), True)
+        if collapser is not None:
+            self.__stats.collapsed = collapser.collapsed
+            if collapser.changed:
+                self.__show_repeats()
+        self.__stats.add_batch(len(records), time.time() - begin)
+
+    def __show_repeats(self):
+        """Redraw the phantoms of the rows whose repeat counts changed"""
+        collapser = self.__collapser
+        changed = collapser.changed
+        collapser.changed = set()
+        phantoms = self.__repeats
+        if phantoms is None:
+            return
+        view = self.__view
+        store = self.__store
+        first = store.first
+        counts = collapser.counts
+        for row in changed:
+            phantom = phantoms.pop(row, None)
+            if phantom is not None:
+                view.erase_phantom_by_id(phantom)
+            count = counts.get(row)
+            if count is not None:
+                # At the end of the line, before the newline
+                end = store.point(row - first + 1) - 1
+                phantoms[row] = view.add_phantom("adb_repeats", sublime.Region(end), REPEAT_HTML % count, sublime.LAYOUT_INLINE)
+
+
+################################################################################
+#             FileLogView class dealing with large saved log files             #
+################################################################################
+class FileLogView(object):
+    """A saved log file shown one window of adb_file_window_lines at a time.
+
+    The file is memory mapped rather than loaded into the editor. Filters
+    are run over the mapped file on a background thread, and the view shows
+    a window of the matching lines, updated as the matches come in.
+    """
+    SCAN_CHUNK = 16 * 1024 * 1024
+
+    def __init__(self, window, path):
+        self.__file = LogFile(path)
+        self.__window_lines = get_setting("adb_file_window_lines")
+        self.__filter = LogFilter()
+        self.__matches = None
+        self.__scanned = 0
+        self.__page = 0
+        self.__generation = 0
+        self.__closed = False
+        self.__text = ""
+        self.__view = window.new_file()
+        self.__view.set_name("ADB: %s" % os.path.basename(path))
+        self.__view.set_scratch(True)
+        self.__view.set_read_only(True)
+        self.__view.set_syntax_file("Packages/ADBView/adb.tmLanguage")
+        threading.Thread(target=self.__index_thread).start()
+
+    @property
+    def view(self):
+        return self.__view
+
+    @property
+    def filter(self):
+        return self.__filter
+
+    def close(self):
+        self.__closed = True
+        self.__generation += 1
+        self.__file.close()
+
+    def page(self, delta):
+        self.__page = max(0, self.__page + delta)
+        self.render()
+
+    def set_filter(self, filter):
+        try:
+            filter = as_filter(filter)
+            # Only the lines matching the hint need to be looked at, or
+            # else those the field terms could match, which is every line
+            # if there are none
+            hint = filter.hint
+            if hint is None:
+                hint = filter.line_hint
+            data_regex = re.compile((hint if hint is not None else "^").encode("utf-8"), re.MULTILINE)
+        except:
+            traceback.print_exc()
+            sublime.error_message("invalid regex")
+            return
+        self.__filter = filter
+        self.__generation += 1
+        self.__page = 0
+        if filter.matches_all:
+            self.__matches = None
+        else:
+            self.__matches = array("q")
+            self.__scanned = 0
+            threading.Thread(target=self.__scan_thread, args=(self.__generation, data_regex, None if filter.exact else filter)).start()
+        self.render()
+
+    def render(self):
+        count = self.__window_lines
+        log = self.__file
+        if self.__matches is None:
+            if log.lines is not None:
+                self.__page = min(self.__page, max(0, log.lines - 1) // count)
+            offset = log.offset_of(self.__page * count)
+            while offset is None:
+                # Not indexed that far yet
+                self.__page -= 1
+                offset = log.offset_of(self.__page * count)
+            self.__text = log.read(offset, log.skip(offset, count))
+        else:
+            if self.__scanned >= log.size:
+                self.__page = min(self.__page, max(0, len(self.__matches) - 1) // count)
+            first = self.__page * count
+            self.__text = log.read_lines(self.__matches[first:first + count])
+        self.__view.run_command("adb_render_file")
+        self.__update_status()
+
+    def render_into(self, edit):
+        self.__view.set_read_only(False)
+        self.__view.replace(edit, sublime.Region(0, self.__view.size()), self.__text)
+        self.__view.set_read_only(True)
+        self.__view.sel().clear()
+        self.__view.sel().add(sublime.Region(0))
+        self.__view.show(0)
+
+    def __update_status(self):
+        log = self.__file
+        first = self.__page * self.__window_lines + 1
+        if self.__matches is None:
+            total = "%d" % log.lines if log.lines is not None else "~%d (indexing)" % ((len(log.marks) - 1) * log.MARK_LINES)
+            status = "Lines %d-%d of %s" % (first, first + self.__window_lines - 1, total)
+        else:
+            status = "Matches %d-%d of %d" % (first, first + self.__window_lines - 1, len(self.__matches))
+            if self.__scanned < log.size:
+                status += " (filtering %d%%)" % (100 * self.__scanned // max(1, log.size))
+        self.__view.set_status("adb_file", status)
+
+    def __index_thread(self):
+        try:
+            self.__file.index(lambda: self.__closed)
+        except ValueError:
+            # The file was closed
+            return
+        sublime.set_timeout(self.__update_status, 0)
+
+    def __scan_thread(self, generation, regex, filter):
+        log = self.__file
+        pos = 0
+        try:
+            while pos < log.size and generation == self.__generation:
+                end = log.line_end(pos + self.SCAN_CHUNK) if pos + self.SCAN_CHUNK < log.size else log.size
+                offsets = log.scan(regex, pos, end)
+                if filter is not None:
+                    offsets = [offset for offset in offsets if filter.matches(parse_line(log.read(offset, log.line_end(offset))))]
+                sublime.set_timeout(self.__add_matches_callback(generation, offsets, end), 0)
+                pos = end
+        except ValueError:
+            # The file was closed
+            pass
+
+    def __add_matches_callback(self, generation, offsets, scanned):
+        def __add_matches():
+            if generation != self.__generation:
+                return
+            first = self.__page * self.__window_lines
+            visible = len(self.__matches) < first + self.__window_lines
+            self.__matches.extend(offsets)
+            self.__scanned = scanned
+            if visible and len(offsets) > 0:
+                self.render()
+            else:
+                self.__update_status()
+        return __add_matches
 
 
 ################################################################################
@@ -437,18 +1914,17 @@ class ADBView(object):
 ################################################################################
 
 class AdbAddLine(sublime_plugin.TextCommand):
-    def run(self, e, data):
+    def run(self, e):
         adb_view = get_adb_view(self.view)
         if adb_view:
-            adb_view.process_lines(e, data)
+            adb_view.process_pending(e)
 
 
 class AdbFilterByProcessId(sublime_plugin.TextCommand):
     def run(self, edit):
-        data = self.view.substr(self.view.full_line(self.view.sel()[0].a))
-        match = re.match(FILTER_PATTERN, data)
-        if match != None:
-            set_filter_by_group(self.view, PID_GROUP, match.group(PID_GROUP+1))
+        record = get_line_record(self.view)
+        if record != None:
+            set_filter_by_group(self.view, PID_GROUP, record[PID_GROUP+1])
         else:
             sublime.error_message("Couldn't extract process id")
 
@@ -460,10 +1936,9 @@ class AdbFilterByProcessId(sublime_plugin.TextCommand):
 
 class AdbFilterByTagName(sublime_plugin.TextCommand):
     def run(self, edit):
-        data = self.view.substr(self.view.full_line(self.view.sel()[0].a))
-        match = re.match(FILTER_PATTERN, data)
-        if match != None:
-            set_filter_by_group(self.view, TAG_GROUP, match.group(TAG_GROUP+1))
+        record = get_line_record(self.view)
+        if record != None:
+            set_filter_by_group(self.view, TAG_GROUP, record[TAG_GROUP+1])
         else:
             sublime.error_message("Couldn't extract tag name")
 
@@ -475,10 +1950,9 @@ class AdbFilterByTagName(sublime_plugin.TextCommand):
 
 class AdbFilterByThreadId(sublime_plugin.TextCommand):
     def run(self, edit):
-        data = self.view.substr(self.view.full_line(self.view.sel()[0].a))
-        match = re.match(FILTER_PATTERN, data)
-        if match != None:
-            set_filter_by_group(self.view, THREAD_GROUP, match.group(THREAD_GROUP+1))
+        record = get_line_record(self.view)
+        if record != None:
+            set_filter_by_group(self.view, THREAD_GROUP, record[THREAD_GROUP+1])
         else:
             sublime.error_message("Couldn't extract thread id")
 
@@ -491,10 +1965,9 @@ class AdbFilterByThreadId(sublime_plugin.TextCommand):
 
 class AdbFilterByMessageLevel(sublime_plugin.TextCommand):
     def run(self, edit):
-        data = self.view.substr(self.view.full_line(self.view.sel()[0].a))
-        match = re.match(FILTER_PATTERN, data)
-        if match != None:
-            set_filter_by_group(self.view, LEVEL_GROUP, match.group(LEVEL_GROUP+1))
+        record = get_line_record(self.view)
+        if record != None:
+            set_filter_by_group(self.view, LEVEL_GROUP, record[LEVEL_GROUP+1])
         else:
             sublime.error_message("Couldn't extract Message level")
 
@@ -514,20 +1987,14 @@ class AdbFilterByDebuggableApps(sublime_plugin.TextCommand):
         if device == "":
             sublime.error_message("Device is unset")
             return
-        adb = get_setting("adb_command")
-        cmd = [adb, "-s", device, "jdwp"]
-        try:
-            proc = subprocess.Popen(cmd, shell=process_shell, stdout=subprocess.PIPE)
-            out,err = proc.communicate()
-            out = decode(out)
-        except:
-            sublime.error_message("Error trying to launch ADB:\n\n%s\n\n%s" % (cmd, traceback.format_exc()))
-            return
-        pids = re.findall(r'\d+', out)
-        if len(pids) > 0:
-            set_filter(self.view, "( *(%s))" % "|".join(pids))
-        else:
-            sublime.error_message("No debuggable apps")
+        def on_pids(pids, error):
+            if error is not None:
+                sublime.error_message("Error trying to list debuggable apps on %s:\n\n%s" % (device, error))
+            elif len(pids) > 0:
+                set_filter(self.view, LogFilter((FieldTerm(PID_FIELD, pids),)))
+            else:
+                sublime.error_message("No debuggable apps")
+        adb_async(on_pids, adb_jdwp, device)
 
     def is_enabled(self):
         return is_adb_syntax(self.view)
@@ -541,20 +2008,8 @@ class AdbFilterByContainingSelections(sublime_plugin.TextCommand):
        set_filter(self.view, data)
 
     def run(self, edit):
-        adb_view = get_adb_view(self.view)
-        if adb_view:
-            filter = adb_view.filter.pattern
-        else:
-            filter = get_setting("adb_filter")
-        for region in self.view.sel():
-            if region.size() == 0:
-                continue
-            content_re = "(?=.*%s)" % re.escape(self.view.substr(region))
-            if filter.startswith("^"):
-                filter = "^%s%s" % (content_re, filter[1:])
-            else:
-                filter = "^%s.*?%s" % (content_re, filter)
-        self.set_filter(filter)
+        terms = [ContainsTerm(self.view.substr(region)) for region in self.view.sel() if region.size() > 0]
+        self.set_filter(get_filter(self.view).with_terms(*terms))
 
     def is_enabled(self):
         return is_adb_syntax(self.view) and any([r.size() > 0 for r in self.view.sel()])
@@ -568,20 +2023,8 @@ class AdbFilterByExcludingSelections(sublime_plugin.TextCommand):
        set_filter(self.view, data)
 
     def run(self, edit):
-        adb_view = get_adb_view(self.view)
-        if adb_view:
-            filter = adb_view.filter.pattern
-        else:
-            filter = get_setting("adb_filter")
-        for region in self.view.sel():
-            if region.size() == 0:
-                continue
-            content_re = "(?!.*%s)" % re.escape(self.view.substr(region))
-            if filter.startswith("^"):
-                filter = "^%s%s" % (content_re, filter[1:])
-            else:
-                filter = "^%s.*?%s" % (content_re, filter)
-        self.set_filter(filter)
+        terms = [NotTerm(ContainsTerm(self.view.substr(region))) for region in self.view.sel() if region.size() > 0]
+        self.set_filter(get_filter(self.view).with_terms(*terms))
 
     def is_enabled(self):
         return is_adb_syntax(self.view) and any([r.size() > 0 for r in self.view.sel()])
@@ -590,61 +2033,134 @@ class AdbFilterByExcludingSelections(sublime_plugin.TextCommand):
         return self.is_enabled()
 
 
+def parse_time_window(window):
+    """The TimeTerm of a window like "14:03..14:05", "time:14:03.." or
+    "last:30s", raises ValueError for anything else."""
+    window = window.strip()
+    name, value = "time", window
+    if window.startswith(("time:", "last:")):
+        name, value = window[:4], window[5:]
+    return TimeTerm(name, value.strip('"'))
+
+
+class AdbFilterByTimeWindow(sublime_plugin.TextCommand):
+    def run(self, edit, window=None):
+        if window is not None:
+            self.set_window(window)
+            return
+        terms = [term for term in get_filter(self.view).terms if isinstance(term, TimeTerm)]
+        window = str(terms[0]) if len(terms) > 0 else "last:30s"
+        self.view.window().show_input_panel("ADB Time window (e.g. 14:03..14:05 or last:30s)", window, self.set_window, None, None)
+
+    def set_window(self, window):
+        """Replace the time window of the filter, or remove it if window is empty"""
+        terms = [term for term in get_filter(self.view).terms if not isinstance(term, TimeTerm)]
+        if window.strip():
+            try:
+                terms.append(parse_time_window(window))
+            except ValueError:
+                sublime.error_message("invalid time window")
+                return
+        set_filter(self.view, LogFilter(terms))
+
+    def is_enabled(self):
+        return is_adb_syntax(self.view)
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
+class AdbGoToCrash(sublime_plugin.TextCommand):
+    KIND_NAMES = {"java": "Crash", "anr": "ANR", "native": "Native crash", "died": "Died"}
+
+    def run(self, edit):
+        adb_view = get_adb_view(self.view)
+        events = adb_view.crashes()
+        if len(events) == 0:
+            sublime.status_message("ADB: No crashes found")
+            return
+        events.reverse()
+        items = [["%s: %s" % (self.KIND_NAMES[event.kind], event.process or event.tag),
+                  "%s  pid %d  %s" % (format_time(event.time), event.pid, event.detail or event.title)] for event in events]
+        def on_done(picked):
+            if picked != -1:
+                adb_view.go_to_row(events[picked].rows[0])
+        self.view.window().show_quick_panel(items, on_done)
+
+    def is_enabled(self):
+        return get_adb_view(self.view) != None
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
+class AdbFilterByCrashes(sublime_plugin.TextCommand):
+    def run(self, edit):
+        set_filter(self.view, LogFilter((CrashTerm(),)))
+
+    def is_enabled(self):
+        return get_adb_view(self.view) != None
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
+class AdbGoToTime(sublime_plugin.TextCommand):
+    def run(self, edit, time=None):
+        if time is not None:
+            self.go_to(time)
+            return
+        record = get_line_record(self.view)
+        time = format_time(record[TIME_GROUP+1]) if record is not None else ""
+        self.view.window().show_input_panel("ADB Go to time (e.g. 14:03:12 or -30s)", time, self.go_to, None, None)
+
+    def go_to(self, time):
+        adb_view = get_adb_view(self.view)
+        if adb_view is None:
+            return
+        try:
+            if not adb_view.go_to_time(time):
+                sublime.status_message("ADB: Nothing logged yet")
+        except ValueError:
+            sublime.error_message("invalid time")
+
+    def is_enabled(self):
+        return get_adb_view(self.view) != None
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
 class AdbLaunch(sublime_plugin.WindowCommand):
-    def run(self, fresh_logcat=False):
+    def run(self, fresh_logcat=False, merge=False):
+        # Clearing the logcat and finding and describing the devices all
+        # run adb, done off the UI thread
+        def find_devices():
+            if fresh_logcat:
+                clear_logcat()
+            devices = adb_devices()
+            return devices, [] if merge else describe_devices(devices)
+        sublime.status_message("ADB: Looking for devices")
+        adb_async(lambda found, error: self.found(found, error, fresh_logcat, merge), find_devices)
+
+    def found(self, found, error, fresh_logcat, merge):
         view_info = ''
         if fresh_logcat:
-          clear_logcat()
           view_info = 'Logcat Cleared'
         
-        adb = get_setting("adb_command")
-        cmd = [adb, "devices"]
-        try:
-            proc = subprocess.Popen(cmd, shell=process_shell, stdout=subprocess.PIPE)
-            out,err = proc.communicate()
-            out = decode(out)
-        except:
-            sublime.error_message("Error trying to launch ADB:\n\n%s\n\n%s" % (cmd, traceback.format_exc()))
-            return
-        # get list of device ids
-        self.devices = []
-        for line in out.split("\n"):
-            line = line.strip()
-            if line.endswith("device"):
-                self.devices.append(re.sub(r"[ \t]*device$", "", line))
+        if error is not None:
+            sublime.error_message("Error trying to launch ADB:\n\n%s" % error)
+            return
+        # list of device ids
+        self.devices, descriptions = found
+        if merge:
+            self.launch_merged(view_info)
+            return
         # build quick menu options displaying name, version, and device id
         self.options = []
         for view in adb_views:
             self.options.append([view.name, "Focus existing view"])
-        for device in self.devices:
-            # dump build.prop
-            cmd = [adb, "-s", device, "shell", "cat /system/build.prop"]
-            proc = subprocess.Popen(cmd, shell=process_shell, stdout=subprocess.PIPE)
-            build_prop = decode(proc.stdout.read().strip())
-            # get name
-            product = "Unknown"  # should never actually see this
-            if device.startswith("emulator"):
-                port = int(device.rsplit("-")[-1])
-                t = telnetlib.Telnet("localhost", port)
-                t.read_until(b"OK", 1000)
-                t.write(b"avd name\n")
-                product = t.read_until(b"OK", 1000).decode("utf-8")
-                t.close()
-                product = product.replace("OK", "").strip()
-            else:
-                product = re.findall(r"^ro\.product\.model=(.*)$", build_prop, re.MULTILINE)
-                if product:
-                    product = product[0]
-            # get version
-            version = re.findall(r"ro\.build\.version\.release=(.*)$", build_prop, re.MULTILINE)
-            if version:
-                version = version[0]
-            else:
-                version = "x.x.x"
-            product = str(product).strip()
-            version = str(version).strip()
-            device = str(device).strip()
-            self.options.append("%s %s - %s" % (product, version, device))
+        self.options.extend(descriptions)
         
         if len(self.options) == 0:
             sublime.status_message("ADB: No device attached!")
@@ -658,6 +2174,16 @@ class AdbLaunch(sublime_plugin.WindowCommand):
     def launch(self, cmd, name, device, info=""):
         adb_views.append(ADBView(cmd, name, device, info))
 
+    def launch_merged(self, info=""):
+        if len(self.devices) == 0:
+            sublime.status_message("ADB: No device attached!")
+            return
+        adb = get_setting("adb_command")
+        args = get_setting("adb_args")
+        merge = [(device, [adb, "-s", device] + args) for device in self.devices]
+        name = "Merged (%s)" % ", ".join(self.devices)
+        adb_views.append(ADBView(None, name, "", info, merge))
+
     def on_done(self, picked):
         if picked == -1:
             return
@@ -691,12 +2217,8 @@ class AdbSetFilter(sublime_plugin.TextCommand):
        set_filter(self.view, data)
 
     def run(self, edit):
-        adb_view = get_adb_view(self.view)
-        if adb_view:
-            filter = adb_view.filter.pattern
-        else:
-            filter = get_setting("adb_filter")
-        self.view.window().show_input_panel("ADB Regex filter", filter, self.set_filter, None, None)
+        filter = get_filter(self.view).pattern
+        self.view.window().show_input_panel("ADB Filter (terms or a regex)", filter, self.set_filter, None, None)
 
     def is_enabled(self):
         return is_adb_syntax(self.view)
@@ -705,8 +2227,307 @@ class AdbSetFilter(sublime_plugin.TextCommand):
         return self.is_enabled()
 
 
+def read_archive_page(archive, number, row=None, time=None):
+    """(lines, row) of a segment of the archive. With a time, row is that of
+    the first line at or after it, looked for up to the given row."""
+    first_row = archive.segments()[number]["first_row"]
+    lines = archive.read(number)
+    if time is not None:
+        # find_time only knows the marks, so look for the first line at or
+        # after the time between the previous mark and this one
+        for at in range(max(row - archive.mark_every, first_row), row):
+            record = parse_line(lines[at - first_row])
+            if record[PID_FIELD] >= 0 and record[TIME_FIELD] >= time:
+                row = at
+                break
+    return lines, row
+
+
+def show_archive_page(window, adb_view, number, row=None, time=None):
+    """Show a segment of a view's archive in a separate view, once it's been
+    read off the UI thread, see read_archive_page"""
+    archive = adb_view.archive
+    first_row = archive.segments()[number]["first_row"]
+    def done(result, error):
+        if error is not None:
+            sublime.error_message("Error trying to read the archive:\n\n%s" % error)
+            return
+        lines, row = result
+        view = window.new_file()
+        view.set_name("%s [History %d]" % (adb_view.name, number))
+        view.set_scratch(True)
+        view.set_syntax_file("Packages/ADBView/adb.tmLanguage")
+        view.run_command("append", {"characters": "".join(lines)})
+        view.set_read_only(True)
+        if row is not None:
+            point = view.text_point(row - first_row, 0)
+            view.sel().clear()
+            view.sel().add(sublime.Region(point))
+            view.show_at_center(point)
+    adb_async(done, read_archive_page, archive, number, row, time)
+
+
+class AdbShowArchive(sublime_plugin.TextCommand):
+    def run(self, edit):
+        adb_view = get_adb_view(self.view)
+        segments = adb_view.archive.segments()
+        if len(segments) == 0:
+            sublime.status_message("ADB: Nothing archived yet")
+            return
+        items = [["Lines %d - %d" % (s["first_row"], s["first_row"] + s["rows"] - 1),
+                  "%s - %s" % (format_time(s["first_time"]), format_time(s["last_time"]))] for s in segments]
+        def on_done(picked):
+            if picked != -1:
+                show_archive_page(self.view.window(), adb_view, segments[picked]["number"])
+        self.view.window().show_quick_panel(items, on_done)
+
+    def is_enabled(self):
+        adb_view = get_adb_view(self.view)
+        return adb_view != None and adb_view.archive != None
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
+class AdbShowArchivedTime(sublime_plugin.TextCommand):
+    def run(self, edit, time=None):
+        if time is not None:
+            self.go_to(time)
+            return
+        self.view.window().show_input_panel("ADB Show archived time (e.g. 14:03 or -1h)", "", self.go_to, None, None)
+
+    def go_to(self, text):
+        adb_view = get_adb_view(self.view)
+        archive = adb_view.archive
+        segments = archive.segments()
+        if len(segments) == 0:
+            sublime.status_message("ADB: Nothing archived yet")
+            return
+        try:
+            time = resolve_time(text, segments[-1]["last_time"])
+        except ValueError:
+            sublime.error_message("invalid time")
+            return
+        row = archive.find_time(time)
+        if row is None:
+            sublime.status_message("ADB: Nothing archived at or after %s" % format_time(time))
+            return
+        show_archive_page(self.view.window(), adb_view, archive.segment_of(row), row, time)
+
+    def is_enabled(self):
+        adb_view = get_adb_view(self.view)
+        return adb_view != None and adb_view.archive != None
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
+class AdbSearchArchive(sublime_plugin.TextCommand):
+    MAX_RESULTS = 1000
+
+    def run(self, edit):
+        self.view.window().show_input_panel("ADB Search archive (regex)", "", self.search, None, None)
+
+    def search(self, pattern):
+        try:
+            regex = re.compile(pattern)
+        except:
+            sublime.error_message("invalid regex")
+            return
+        adb_view = get_adb_view(self.view)
+        window = self.view.window()
+        def search_thread():
+            hits = []
+            for row, line in adb_view.archive.search(regex):
+                hits.append((row, line))
+                if len(hits) >= self.MAX_RESULTS:
+                    break
+            sublime.set_timeout(lambda: self.show_hits(window, adb_view, hits), 0)
+        sublime.status_message("ADB: Searching archive...")
+        threading.Thread(target=search_thread).start()
+
+    def show_hits(self, window, adb_view, hits):
+        if len(hits) == 0:
+            sublime.status_message("ADB: No matches in the archive")
+            return
+        archive = adb_view.archive
+        def on_done(picked):
+            if picked != -1:
+                row = hits[picked][0]
+                show_archive_page(window, adb_view, archive.segment_of(row), row)
+        window.show_quick_panel([line.rstrip("\n") for row, line in hits], on_done)
+
+    def is_enabled(self):
+        adb_view = get_adb_view(self.view)
+        return adb_view != None and adb_view.archive != None
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
+class AdbTopTalkers(sublime_plugin.TextCommand):
+    def run(self, edit):
+        adb_view = get_adb_view(self.view)
+        items = []
+        sources = []
+        if len(adb_view.muted) > 0:
+            items.append(["Unmute all", "%d muted" % sum(len(values) for values in adb_view.muted.values())])
+            sources.append(None)
+        for field, value, lines, size in adb_view.talkers():
+            muted = adb_view.is_muted(field, value)
+            items.append(["%s%s" % (FieldTerm(field, (value,)), " (muted)" if muted else ""),
+                          "%.1f lines/s, %.1f KB/s" % (lines, size / 1024.0)])
+            sources.append((field, value, muted))
+        if len(items) == 0:
+            sublime.status_message("ADB: Nothing logged yet")
+            return
+        def on_done(picked):
+            if picked == -1:
+                return
+            source = sources[picked]
+            if source is None:
+                adb_view.unmute_all()
+            else:
+                field, value, muted = source
+                adb_view.mute(field, value, not muted)
+        self.view.window().show_quick_panel(items, on_done)
+
+    def is_enabled(self):
+        return get_adb_view(self.view) != None
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
+class AdbShowStats(sublime_plugin.TextCommand):
+    def run(self, edit):
+        adb_view = get_adb_view(self.view)
+        view = self.view.window().new_file()
+        view.set_name("%s [Stats]" % adb_view.name)
+        view.set_scratch(True)
+        view.run_command("append", {"characters": json.dumps(adb_view.stats(), indent=2, sort_keys=True)})
+        view.set_read_only(True)
+
+    def is_enabled(self):
+        return get_adb_view(self.view) != None
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
+class AdbSaveStats(sublime_plugin.TextCommand):
+    def run(self, edit, path=None):
+        if path:
+            self.save(path)
+            return
+        path = os.path.join("~", "adbview-stats-%s.json" % time.strftime("%Y%m%d-%H%M%S"))
+        self.view.window().show_input_panel("ADB Save stats to", path, self.save, None, None)
+
+    def save(self, path):
+        adb_view = get_adb_view(self.view)
+        if adb_view is None:
+            return
+        try:
+            with open(os.path.expanduser(path), "w") as f:
+                json.dump(adb_view.stats(), f, indent=2, sort_keys=True)
+        except (IOError, OSError):
+            sublime.error_message("Couldn't save the stats to %s:\n\n%s" % (path, traceback.format_exc()))
+            return
+        sublime.status_message("ADB: Stats saved to %s" % path)
+
+    def is_enabled(self):
+        return get_adb_view(self.view) != None
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
+class AdbExport(sublime_plugin.TextCommand):
+    FORMATS = [["Text", "The lines as they are"],
+               ["JSON Lines", "time, pid, tid, level, tag and message of each line"],
+               ["CSV", "time, pid, tid, level, tag and message of each line"]]
+    EXTENSIONS = {"raw": "txt", "jsonl": "jsonl", "csv": "csv"}
+
+    def run(self, edit, format=None, path=None, window=None, time_range=False):
+        """Exports the lines passing the filter, or with time_range those
+        logged in a window, asking for whatever isn't given"""
+        args = {"format": format, "path": path, "window": window}
+        if time_range and window is None:
+            def on_window(window):
+                args["window"] = window
+                self.view.run_command("adb_export", args)
+            self.view.window().show_input_panel("ADB Export lines logged in (e.g. 14:03..14:05 or last:60s)", "last:60s", on_window, None, None)
+            return
+        if format is None:
+            def on_format(picked):
+                if picked != -1:
+                    args["format"] = EXPORT_FORMATS[picked]
+                    self.view.run_command("adb_export", args)
+            self.view.window().show_quick_panel(self.FORMATS, on_format)
+            return
+        if not path:
+            def on_path(path):
+                args["path"] = path
+                self.view.run_command("adb_export", args)
+            path = os.path.join("~", "adbview-%s.%s" % (time.strftime("%Y%m%d-%H%M%S"), self.EXTENSIONS[format]))
+            self.view.window().show_input_panel("ADB Export to", path, on_path, None, None)
+            return
+        try:
+            window = parse_time_window(window) if window else None
+        except ValueError:
+            sublime.error_message("invalid time window")
+            return
+        get_adb_view(self.view).export(os.path.expanduser(path), format, window)
+
+    def is_enabled(self):
+        return get_adb_view(self.view) != None
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
+class AdbOpenFile(sublime_plugin.WindowCommand):
+    def run(self, path=None):
+        if path:
+            self.open(path)
+            return
+        view = self.window.active_view()
+        path = (view.file_name() if view else None) or ""
+        self.window.show_input_panel("ADB Log file", path, self.open, None, None)
+
+    def open(self, path):
+        try:
+            file_view = FileLogView(self.window, os.path.expanduser(path))
+        except (IOError, OSError):
+            sublime.error_message("Couldn't open %s:\n\n%s" % (path, traceback.format_exc()))
+            return
+        file_views.append(file_view)
+        file_view.render()
+
+
+class AdbRenderFile(sublime_plugin.TextCommand):
+    def run(self, edit):
+        file_view = get_file_view(self.view)
+        if file_view:
+            file_view.render_into(edit)
+
+
+class AdbFilePage(sublime_plugin.TextCommand):
+    def run(self, edit, forward=True):
+        get_file_view(self.view).page(1 if forward else -1)
+
+    def is_enabled(self):
+        return get_file_view(self.view) != None
+
+    def is_visible(self):
+        return self.is_enabled()
+
+
 class AdbClearView(sublime_plugin.TextCommand):
     def run(self, edit):
+        adb_view = get_adb_view(self.view)
+        if adb_view:
+            adb_view.clear()
         self.view.set_read_only(False)
         self.view.erase(edit, sublime.Region(0, self.view.size()))
         self.view.set_read_only(True)
@@ -725,4 +2546,8 @@ class AdbEventListener(sublime_plugin.EventListener):
         if adb_view:
             adb_view.close()
             adb_views.remove(adb_view)
+        file_view = get_file_view(view)
+        if file_view:
+            file_view.close()
+            file_views.remove(file_view)
         view.settings().erase("adb_has_shown_message")
@@ -0,0 +1,109 @@
+"""
+Copyright (c) 2012 Fredrik Ehnbom
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+   1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+
+   2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+
+   3. This notice may not be removed or altered from any source
+   distribution.
+"""
+# Synthetic logcat output for the benchmarks. Run as a script it writes the
+# log to stdout, so that it can stand in for "adb logcat":
+#
+#   python loggen.py --lines 100000 --format threadtime --rate 20000
+import sys
+import time
+import random
+import argparse
+
+LEVELS = "VDIWEF"
+WORDS = ["activity", "service", "binder", "surface", "buffer", "frame", "window", "input",
+         "package", "intent", "broadcast", "wakelock", "alarm", "network", "socket", "cache"]
+
+
+def generate(count, format="threadtime", tags=50, pids=20, length=60, seed=1, start=0.0):
+    """Yields count logcat lines.
+
+    tags and pids are the number of distinct tags and processes, length is
+    the average message length. Timestamps start at start seconds into the
+    year and advance a millisecond per line.
+    """
+    r = random.Random(seed)
+    tag_names = ["Tag%d" % i for i in range(tags)]
+    pid_values = [1000 + 17 * i for i in range(pids)]
+    millis = int(start * 1000)
+    for i in range(count):
+        seconds, ms = divmod(millis + i, 1000)
+        minutes, second = divmod(seconds, 60)
+        hours, minute = divmod(minutes, 60)
+        days, hour = divmod(hours, 24)
+        stamp = "%02d-%02d %02d:%02d:%02d.%03d" % (1 + days // 28 % 12, 1 + days % 28, hour, minute, second, ms)
+        pid = r.choice(pid_values)
+        tid = pid + r.randrange(4)
+        level = LEVELS[min(5, int(r.expovariate(0.8)))]
+        tag = r.choice(tag_names)
+        words = []
+        size = 0
+        target = r.randint(length // 2, length * 3 // 2)
+        while size < target:
+            word = r.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        message = "%d %s" % (i, " ".join(words))
+        if format == "time":
+            yield "%s %s/%s(%5d): %s\n" % (stamp, level, tag, pid, message)
+        else:
+            yield "%s %5d %5d %s %s: %s\n" % (stamp, pid, tid, level, tag, message)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic logcat to stdout")
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--format", choices=("time", "threadtime"), default="threadtime")
+    parser.add_argument("--tags", type=int, default=50, help="number of distinct tags")
+    parser.add_argument("--pids", type=int, default=20, help="number of distinct processes")
+    parser.add_argument("--length", type=int, default=60, help="average message length")
+    parser.add_argument("--rate", type=float, default=0, help="lines per second, 0 for as fast as possible")
+    parser.add_argument("--burst-every", type=float, default=0, help="seconds between bursts")
+    parser.add_argument("--burst-lines", type=int, default=0, help="extra lines written at once in a burst")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    out = sys.stdout.buffer if hasattr(sys.stdout, "buffer") else sys.stdout
+    lines = generate(args.lines, args.format, args.tags, args.pids, args.length, args.seed)
+    tick = 0.01
+    begin = time.time()
+    written = 0
+    bursts = 0
+    for line in lines:
+        out.write(line.encode("utf-8"))
+        written += 1
+        if args.rate <= 0:
+            continue
+        elapsed = time.time() - begin
+        if args.burst_every > 0 and elapsed >= (bursts + 1) * args.burst_every:
+            # Let the next burst_lines lines through without pacing
+            bursts += 1
+            begin -= args.burst_lines / args.rate
+        ahead = written / args.rate - elapsed
+        if ahead > tick:
+            out.flush()
+            time.sleep(ahead)
+    out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Copyright (c) 2012 Fredrik Ehnbom
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+   1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+
+   2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+
+   3. This notice may not be removed or altered from any source
+   distribution.
+"""
+# Benchmarks of adbview.py run outside of the editor, against the stub
+# sublime modules next to this file and logs from loggen.py.
+#
+#   python bench/run.py [--quick] [--output results.json] [--only ingest,refilter]
+#
+# The results are written as JSON so that runs can be compared. Only the
+# plugin's own work is measured, the stub views don't render anything.
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [BENCH_DIR, os.path.dirname(BENCH_DIR)]
+
+import sublime
+import adbview
+from adblog import LogStore, parse_line
+from loggen import generate
+
+LOGGEN = os.path.join(BENCH_DIR, "loggen.py")
+
+
+def private(obj, name):
+    return getattr(obj, "_%s__%s" % (type(obj).__name__, name))
+
+
+def configure(**settings):
+    values = sublime.load_settings("ADBView.sublime-settings")
+    defaults = {"adb_native_client": False, "adb_archive_dir": "", "adb_app_package": False, "adb_reconnect": False}
+    defaults.update(settings)
+    for key, value in defaults.items():
+        values.set("adb_" + key if not key.startswith("adb_") else key, value)
+
+
+def open_view(args):
+    view = adbview.ADBView([sys.executable, LOGGEN] + [str(arg) for arg in args], "bench")
+    adbview.adb_views.append(view)
+    return view
+
+
+def close_view(view):
+    view.close()
+    adbview.adb_views.remove(view)
+    wait_closed(view)
+
+
+def wait_closed(view, timeout=600):
+    """Act as the UI thread until the logcat has ended and every line of it
+    is in the view"""
+    end = time.time() + timeout
+    idle = 0
+    while time.time() < end:
+        if sublime.run_callbacks() > 0:
+            idle = 0
+            continue
+        done = (view.view.name.endswith("[Closed]") and len(private(view, "lines")) == 0 and
+                len(private(view, "ready")) == 0)
+        idle = idle + 1 if done else 0
+        if idle > 20:
+            return
+        time.sleep(0.005)
+    raise RuntimeError("timed out waiting for the logcat to end")
+
+
+def wait_refiltered(view):
+    while private(view, "refilter_end") is not None:
+        if sublime.run_callbacks() == 0:
+            time.sleep(0.001)
+
+
+def records_for(count, format="threadtime"):
+    return [parse_line(line) for line in generate(count, format)]
+
+
+def load(view, records, batch=2000):
+    for i in range(0, len(records), batch):
+        view.process_lines(None, records[i:i + batch])
+
+
+def bench_ingest(quick):
+    """Lines per second from the logcat process through LogcatReader and
+    the process thread to process_lines"""
+    results = []
+    count = 50000 if quick else 300000
+    for format in ("time", "threadtime"):
+        for rate in (0, 20000):
+            configure(maxlines=count * 2)
+            sublime.command_times.clear()
+            sublime.command_calls.clear()
+            begin = time.time()
+            view = open_view(["--lines", count, "--format", format, "--rate", rate])
+            wait_closed(view)
+            elapsed = time.time() - begin
+            results.append({
+                "benchmark": "ingest",
+                "format": format,
+                "rate": rate,
+                "lines": count,
+                "seconds": elapsed,
+                "lines_per_second": count / elapsed,
+                "ui_seconds": sublime.command_times.get("adb_add_line", 0.0),
+                "updates": sublime.command_calls.get("adb_add_line", 0),
+                "dropped": view.stats()["dropped"],
+            })
+            close_view(view)
+    return results
+
+
+def bench_trim(quick):
+    """The cost of process_lines with and without trimming at adb_maxlines"""
+    results = []
+    count = 100000 if quick else 400000
+    records = records_for(count)
+    for maxlines in (count, count // 4):
+        configure(maxlines=maxlines)
+        view = open_view(["--lines", 0])
+        wait_closed(view)
+        times = []
+        for i in range(0, count, 2000):
+            begin = time.time()
+            view.process_lines(None, records[i:i + 2000])
+            times.append(time.time() - begin)
+        results.append({
+            "benchmark": "trim",
+            "maxlines": maxlines,
+            "lines": count,
+            "retained": len(private(view, "store")),
+            "seconds": sum(times),
+            "batch_mean_ms": 1000 * sum(times) / len(times),
+            "batch_max_ms": 1000 * max(times),
+        })
+        close_view(view)
+    return results
+
+
+def bench_refilter(quick):
+    """Time to refilter a view against the size of the buffer, compared to
+    apply_filter folding a plain view line by line"""
+    results = []
+    sizes = (10000, 50000) if quick else (10000, 50000, 100000, 200000)
+    filters = ("message .*7 frame", "tag:Tag3", "level>=W has:binder")
+    for size in sizes:
+        records = records_for(size)
+        configure(maxlines=size * 2)
+        view = open_view(["--lines", 0])
+        wait_closed(view)
+        load(view, records)
+        for pattern in filters:
+            begin = time.time()
+            adbview.set_filter(view.view, pattern)
+            blocked = time.time() - begin
+            wait_refiltered(view)
+            results.append({
+                "benchmark": "refilter",
+                "lines": size,
+                "filter": pattern,
+                "seconds": time.time() - begin,
+                "ui_blocked_seconds": blocked,
+            })
+            adbview.set_filter(view.view, ".")
+        close_view(view)
+
+        plain = sublime.active_window().new_file()
+        plain.insert(None, 0, "".join(record[0] for record in records))
+        begin = time.time()
+        adbview.apply_filter(plain, filters[0])
+        results.append({
+            "benchmark": "apply_filter",
+            "lines": size,
+            "filter": filters[0],
+            "seconds": time.time() - begin,
+        })
+    return results
+
+
+def bench_memory(quick):
+    """Memory held per line retained in a LogStore"""
+    results = []
+    count = 50000 if quick else 200000
+    for format in ("time", "threadtime"):
+        store = LogStore()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        store.append([parse_line(line) for line in generate(count, format)])
+        retained = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        results.append({
+            "benchmark": "memory",
+            "format": format,
+            "lines": count,
+            "bytes": retained,
+            "bytes_per_line": retained / count,
+            "chars_per_line": store.size / count,
+        })
+    return results
+
+
+BENCHMARKS = [
+    ("ingest", bench_ingest),
+    ("trim", bench_trim),
+    ("refilter", bench_refilter),
+    ("memory", bench_memory),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ADBView outside of Sublime Text")
+    parser.add_argument("--quick", action="store_true", help="smaller logs, for a quick check")
+    parser.add_argument("--only", help="comma separated benchmarks to run, of %s" % ", ".join(name for name, _ in BENCHMARKS))
+    parser.add_argument("--output", help="file to write the results to instead of stdout")
+    args = parser.parse_args(argv)
+
+    only = set(args.only.split(",")) if args.only else None
+    results = []
+    for name, benchmark in BENCHMARKS:
+        if only is None or name in only:
+            sys.stderr.write("running %s\n" % name)
+            results.extend(benchmark(args.quick))
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
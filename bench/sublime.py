@@ -0,0 +1,389 @@
+"""
+Copyright (c) 2012 Fredrik Ehnbom
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+   1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+
+   2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+
+   3. This notice may not be removed or altered from any source
+   distribution.
+"""
+# A stand-in for the sublime module that is just enough to run adbview.py
+# outside of the editor. Views keep their text in memory, and callbacks
+# given to set_timeout() run when the benchmark calls run_callbacks(), which
+# makes the calling thread the UI thread.
+import sys
+import time
+import heapq
+import threading
+from bisect import bisect_right
+
+try:
+    import sublime_plugin
+except ImportError:
+    sublime_plugin = None
+
+
+class Region(object):
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return self.end() - self.begin()
+
+    def cover(self, other):
+        return Region(min(self.begin(), other.begin()), max(self.end(), other.end()))
+
+    def __repr__(self):
+        return "Region(%d, %d)" % (self.a, self.b)
+
+
+class Settings(object):
+    def __init__(self, values=None):
+        self.__values = dict(values or {})
+
+    def get(self, key, default=None):
+        return self.__values.get(key, default)
+
+    def has(self, key):
+        return key in self.__values
+
+    def set(self, key, value):
+        self.__values[key] = value
+
+    def erase(self, key):
+        self.__values.pop(key, None)
+
+
+class Selection(list):
+    def clear(self):
+        del self[:]
+
+    def add(self, region):
+        self.append(region)
+
+
+# Seconds spent in and number of calls of each command, by command name
+command_times = {}
+command_calls = {}
+
+
+def run_command(target, name, args):
+    if sublime_plugin is None or name not in sublime_plugin.commands:
+        return
+    begin = time.time()
+    command = sublime_plugin.commands[name](target)
+    if isinstance(target, View):
+        command.run(None, **(args or {}))
+    else:
+        command.run(**(args or {}))
+    command_times[name] = command_times.get(name, 0.0) + time.time() - begin
+    command_calls[name] = command_calls.get(name, 0) + 1
+
+
+class View(object):
+    __next_id = 1
+
+    def __init__(self, window=None):
+        self.__id = View.__next_id
+        View.__next_id += 1
+        self.__window = window
+        self.__settings = Settings()
+        self.__text = ""
+        self.__starts = None
+        self.__sel = Selection([Region(0)])
+        self.__status = {}
+        self.name = ""
+        self.folds = []
+        # id: (key, region, content)
+        self.phantoms = {}
+        self.__next_phantom = 1
+
+    def id(self):
+        return self.__id
+
+    def window(self):
+        return self.__window
+
+    def settings(self):
+        return self.__settings
+
+    def file_name(self):
+        return None
+
+    def set_name(self, name):
+        self.name = name
+
+    def set_scratch(self, scratch):
+        pass
+
+    def set_read_only(self, read_only):
+        pass
+
+    def set_syntax_file(self, syntax):
+        pass
+
+    def set_status(self, key, value):
+        self.__status[key] = value
+
+    def get_status(self, key):
+        return self.__status.get(key, "")
+
+    def erase_status(self, key):
+        self.__status.pop(key, None)
+
+    def size(self):
+        return len(self.__text)
+
+    def substr(self, region):
+        if isinstance(region, int):
+            return self.__text[region]
+        return self.__text[region.begin():region.end()]
+
+    def insert(self, edit, point, text):
+        self.__text = self.__text[:point] + text + self.__text[point:]
+        self.__starts = None
+        if point < len(self.__text) - len(text):
+            n = len(text)
+            self.folds = [(a + n if a >= point else a, b + n if b >= point else b) for a, b in self.folds]
+        return len(text)
+
+    def erase(self, edit, region):
+        a, b = region.begin(), region.end()
+        self.__text = self.__text[:a] + self.__text[b:]
+        self.__starts = None
+        n = b - a
+        def move(p):
+            return p if p <= a else (a if p <= b else p - n)
+        self.folds = [(move(x), move(y)) for x, y in self.folds if move(y) > move(x)]
+
+    def replace(self, edit, region, text):
+        self.erase(edit, region)
+        self.insert(edit, region.begin(), text)
+
+    def __line_starts(self):
+        if self.__starts is None:
+            text = self.__text
+            starts = [0]
+            find = text.find
+            pos = find("\n")
+            while pos != -1:
+                starts.append(pos + 1)
+                pos = find("\n", pos + 1)
+            self.__starts = starts
+        return self.__starts
+
+    def rowcol(self, point):
+        starts = self.__line_starts()
+        row = bisect_right(starts, point) - 1
+        return row, point - starts[row]
+
+    def text_point(self, row, col):
+        starts = self.__line_starts()
+        if row >= len(starts):
+            return len(self.__text)
+        return starts[row] + col
+
+    def line(self, point):
+        if isinstance(point, Region):
+            point = point.begin()
+        row, _ = self.rowcol(point)
+        starts = self.__line_starts()
+        end = starts[row + 1] - 1 if row + 1 < len(starts) else len(self.__text)
+        return Region(starts[row], end)
+
+    def full_line(self, point):
+        region = self.line(point)
+        return Region(region.a, min(len(self.__text), region.b + 1))
+
+    def fold(self, regions):
+        if isinstance(regions, Region):
+            regions = [regions]
+        self.folds.extend((r.begin(), r.end()) for r in regions)
+
+    def unfold(self, regions):
+        pass
+
+    def visible_text(self):
+        """The text with the folded regions left out"""
+        parts = []
+        last = 0
+        for a, b in sorted(self.folds):
+            if a > last:
+                parts.append(self.__text[last:a])
+            last = max(last, b)
+        parts.append(self.__text[last:])
+        return "".join(parts)
+
+    def run_command(self, name, args=None):
+        if name == "unfold_all":
+            self.folds = []
+        elif name == "append":
+            self.insert(None, self.size(), args["characters"])
+        else:
+            run_command(self, name, args)
+
+    def sel(self):
+        return self.__sel
+
+    def scope_name(self, point):
+        return "source.adb"
+
+    def viewport_position(self):
+        return (0.0, 0.0)
+
+    def viewport_extent(self):
+        return (800.0, 600.0)
+
+    def text_to_layout(self, point):
+        return (0.0, self.rowcol(point)[0] * 16.0)
+
+    def layout_to_text(self, vector):
+        return self.text_point(int(vector[1] / 16.0), 0)
+
+    def set_viewport_position(self, vector, animate=True):
+        pass
+
+    def show(self, point, *args, **kwargs):
+        pass
+
+    def show_at_center(self, point):
+        pass
+
+    def add_phantom(self, key, region, content, layout, on_navigate=None):
+        phantom = self.__next_phantom
+        self.__next_phantom += 1
+        self.phantoms[phantom] = (key, region, content)
+        return phantom
+
+    def erase_phantom_by_id(self, phantom):
+        self.phantoms.pop(phantom, None)
+
+
+LAYOUT_INLINE = 0
+LAYOUT_BELOW = 1
+LAYOUT_BLOCK = 2
+
+
+class Phantom(object):
+    def __init__(self, region, content, layout, on_navigate=None):
+        self.region = region
+        self.content = content
+        self.layout = layout
+
+
+class PhantomSet(object):
+    def __init__(self, view, key=""):
+        self.view = view
+        self.key = key
+        self.phantoms = []
+
+    def update(self, phantoms):
+        self.phantoms = list(phantoms)
+
+
+class Window(object):
+    def __init__(self):
+        self.__views = [View(self)]
+
+    def new_file(self):
+        view = View(self)
+        self.__views.append(view)
+        return view
+
+    def views(self):
+        return list(self.__views)
+
+    def active_view(self):
+        return self.__views[-1] if self.__views else None
+
+    def focus_view(self, view):
+        pass
+
+    def show_quick_panel(self, items, on_done, *args, **kwargs):
+        pass
+
+    def show_input_panel(self, caption, initial, on_done, on_change, on_cancel):
+        pass
+
+    def run_command(self, name, args=None):
+        run_command(self, name, args)
+
+
+__window = Window()
+__settings = {}
+__callbacks = []
+__callbacks_lock = threading.Lock()
+__callback_count = [0]
+
+
+def active_window():
+    return __window
+
+
+def windows():
+    return [__window]
+
+
+def load_settings(name):
+    if name not in __settings:
+        __settings[name] = Settings()
+    return __settings[name]
+
+
+def set_timeout(callback, delay=0):
+    with __callbacks_lock:
+        __callback_count[0] += 1
+        heapq.heappush(__callbacks, (time.time() + delay / 1000.0, __callback_count[0], callback))
+
+
+def set_timeout_async(callback, delay=0):
+    set_timeout(callback, delay)
+
+
+def run_callbacks():
+    """Run the callbacks that are due, returns how many were run"""
+    count = 0
+    while True:
+        with __callbacks_lock:
+            if len(__callbacks) == 0 or __callbacks[0][0] > time.time():
+                return count
+            callback = heapq.heappop(__callbacks)[2]
+        callback()
+        count += 1
+
+
+def pending_callbacks():
+    with __callbacks_lock:
+        return len(__callbacks)
+
+
+def status_message(message):
+    pass
+
+
+def error_message(message):
+    sys.stderr.write("error: %s\n" % message)
+
+
+def message_dialog(message):
+    pass
@@ -0,0 +1,52 @@
+"""
+Copyright (c) 2012 Fredrik Ehnbom
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+   1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+
+   2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+
+   3. This notice may not be removed or altered from any source
+   distribution.
+"""
+# A stand-in for the sublime_plugin module, see sublime.py. Commands are
+# registered by name when they're defined, like the editor does when it
+# loads a plugin.
+import re
+
+commands = {}
+
+
+def command_name(cls):
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", cls.__name__).lower()
+
+
+class Command(object):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        commands[command_name(cls)] = cls
+
+
+class TextCommand(Command):
+    def __init__(self, view):
+        self.view = view
+
+
+class WindowCommand(Command):
+    def __init__(self, window):
+        self.window = window
+
+
+class EventListener(object):
+    pass
@@ -0,0 +1,172 @@
+"""
+Copyright (c) 2012 Fredrik Ehnbom
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+   1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+
+   2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+
+   3. This notice may not be removed or altered from any source
+   distribution.
+"""
+# Tests of adbclient.py and its use in adbview.py against a fake adb server.
+import os
+import sys
+import socket
+import threading
+import time
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(TESTS_DIR), "bench"), os.path.dirname(TESTS_DIR)]
+
+import adbview
+from adbclient import AdbClient, AdbError
+from run import configure
+
+
+class FakeAdbServer(object):
+    """Answers each request with the response the test gives for it:
+    OKAY followed by some data, FAIL with a message, or None to drop the
+    connection without answering. Each answer takes delay seconds."""
+    def __init__(self, responses, delay=0):
+        self.responses = responses
+        self.delay = delay
+        self.requests = []
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        thread = threading.Thread(target=self.__serve)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.sock.close()
+
+    def __serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            try:
+                while self.__handle(conn):
+                    pass
+            finally:
+                conn.close()
+
+    def __handle(self, conn):
+        length = self.__read(conn, 4)
+        if len(length) < 4:
+            return False
+        request = self.__read(conn, int(length, 16)).decode("utf-8")
+        self.requests.append(request)
+        time.sleep(self.delay)
+        response = self.responses.get(request)
+        if response is None:
+            return False
+        status, data = response
+        if status == "FAIL":
+            conn.sendall(b"FAIL" + ("%04x" % len(data)).encode("ascii") + data)
+            return False
+        conn.sendall(b"OKAY" + data)
+        # Transport requests are followed by the actual one
+        return request.startswith("host:transport")
+
+    def __read(self, conn, size):
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if len(chunk) == 0:
+                break
+            data += chunk
+        return data
+
+
+def message(text):
+    return ("%04x" % len(text)).encode("ascii") + text
+
+
+class AdbClientTest(unittest.TestCase):
+    def serve(self, responses):
+        server = FakeAdbServer(responses)
+        self.addCleanup(server.close)
+        return server, AdbClient(port=server.port, timeout=2.0)
+
+    def test_okay(self):
+        server, client = self.serve({"host:devices": ("OKAY", message(b"dev1\tdevice\ndev2\toffline\n"))})
+        self.assertEqual(client.devices(), [("dev1", "device"), ("dev2", "offline")])
+
+    def test_shell(self):
+        server, client = self.serve({"host:transport:dev1": ("OKAY", b""),
+                                     "shell:getprop ro.product.model": ("OKAY", b"Pixel\n")})
+        self.assertEqual(client.shell("dev1", "getprop ro.product.model"), b"Pixel\n")
+        self.assertEqual(server.requests, ["host:transport:dev1", "shell:getprop ro.product.model"])
+
+    def test_fail(self):
+        server, client = self.serve({"host:transport:dev1": ("FAIL", b"device offline")})
+        with self.assertRaises(AdbError) as raised:
+            client.shell("dev1", "true")
+        self.assertEqual(str(raised.exception), "device offline")
+
+    def test_dropped(self):
+        server, client = self.serve({})
+        self.assertRaises(AdbError, client.devices)
+
+
+class FallbackTest(unittest.TestCase):
+    def tearDown(self):
+        configure(command="adb")
+
+    def test_logcat_falls_back_to_adb(self):
+        # A device the server doesn't know is left to adb itself, which
+        # reports it and exits
+        server = FakeAdbServer({"host:transport:dev1": ("FAIL", b"device 'dev1' not found")})
+        self.addCleanup(server.close)
+        configure(native_client=True, server_port=server.port, command=sys.executable)
+        logcat = adbview.open_logcat([sys.executable, "-s", "dev1", "logcat"])
+        self.addCleanup(logcat.close)
+        self.assertIsInstance(logcat, adbview.LogcatProcess)
+        self.assertEqual(server.requests, ["host:transport:dev1"])
+
+    def test_shell_falls_back_to_adb(self):
+        server = FakeAdbServer({})
+        self.addCleanup(server.close)
+        configure(native_client=True, server_port=server.port, command=sys.executable)
+        # Runs "python -s dev1 shell ..." which fails as there's no such script
+        self.assertEqual(adbview.adb_shell("dev1", "true", 10).strip(), "")
+
+
+class OpenTest(unittest.TestCase):
+    def tearDown(self):
+        configure(command="adb")
+
+    def test_subscribe_doesnt_wait_for_server(self):
+        server = FakeAdbServer({"host:transport:dev1": ("FAIL", b"device 'dev1' not found")}, delay=1.0)
+        self.addCleanup(server.close)
+        configure(native_client=True, server_port=server.port, command=sys.executable)
+        closed = threading.Event()
+        begin = time.time()
+        subscription = adbview.subscribe_logcat([("dev1", [sys.executable, "-s", "dev1", "logcat"])], [], None,
+                                                lambda records: None, closed.set)
+        self.assertLess(time.time() - begin, 0.5)
+        self.assertTrue(subscription.running)
+        # Then falls back to "python -s dev1 logcat", which exits
+        self.assertTrue(closed.wait(10))
+        self.assertFalse(subscription.running)
+
+
+if __name__ == "__main__":
+    unittest.main()
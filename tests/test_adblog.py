@@ -0,0 +1,611 @@
+"""
+Copyright (c) 2012 Fredrik Ehnbom
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+   1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+
+   2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+
+   3. This notice may not be removed or altered from any source
+   distribution.
+"""
+# Tests of adblog.py, which doesn't need the sublime modules.
+import io
+import os
+import re
+import csv
+import json
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(TESTS_DIR)]
+
+from adblog import parse_filter, parse_line, format_time, logcat_args, export_records
+from adblog import LogStore, LogResume, SessionArchive, CrashIndex, LogMerger, RepeatCollapser, TalkerStats
+from adblog import FieldTerm, LevelTerm, ContainsTerm, RegexTerm, MessageTerm, NotTerm
+from adblog import LINE_FIELD, TIME_FIELD, PID_FIELD, TID_FIELD, LEVEL_FIELD, TAG_FIELD, OFFSET_FIELD
+
+
+def line(second, pid=100, tag="Tag", level="I", message="message", tid=None):
+    """A threadtime line logged second seconds into 01-01"""
+    minute, second = divmod(second, 60)
+    return "01-01 00:%02d:%06.3f %5d %5d %s %-8s: %s\n" % (minute, second, pid, tid or pid, level, tag, message)
+
+
+def records(count, **fields):
+    return [parse_line(line(i * 0.001, message="line %d" % i, **fields)) for i in range(count)]
+
+
+def store_of(records):
+    store = LogStore()
+    store.append(records)
+    return store
+
+
+def mixed_records(count, begin=0):
+    """count records of a few pids, tids, levels and tags, with an info line
+    every so often"""
+    return [parse_line("--------- info %d\n" % i) if i % 13 == 0 else
+            parse_line(line(i * 0.001, pid=100 + i % 3, tid=200 + i % 5, level="VDIWE"[i % 5 // 2 + i % 2], tag="Tag%d" % (i % 4)))
+            for i in range(begin, begin + count)]
+
+
+FILTER_RECORDS = [parse_line(text) for text in (
+    line(0.0, pid=100, tag="Activity", level="I", message="started in 12ms"),
+    line(0.1, pid=100, tag="Activity", level="W", message="slow frame"),
+    line(0.2, pid=200, tag="Net", level="D", message="connect to a,b"),
+    line(0.3, pid=200, tag="Net", level="E", message="timeout after 30ms"),
+    line(0.4, pid=300, tag="Tag with space", level="V", message="verbose"),
+    "--------- beginning of main\n",
+    line(0.5, pid=100, tag="Activity", level="F", message="fatal"),
+)]
+
+
+class TimeTest(unittest.TestCase):
+    def test_leap_day_round_trip(self):
+        stamps = ["02-28 23:59:59.999", "02-29 00:00:00.000", "02-29 23:59:59.999", "03-01 00:00:00.000", "12-31 23:59:59.999"]
+        times = [parse_line("%s  100  100 I Tag: message\n" % stamp)[TIME_FIELD] for stamp in stamps]
+        self.assertEqual([format_time(time) for time in times], stamps)
+        self.assertEqual(times, sorted(set(times)))
+
+
+class ParseFilterTest(unittest.TestCase):
+    def test_terms(self):
+        filter = parse_filter(r'tag:A,B pid:1 level>=W has:"some text" -has:x re:"\\d+ms" msg:^done')
+        self.assertEqual([type(term) for term in filter.terms],
+                         [FieldTerm, FieldTerm, LevelTerm, ContainsTerm, NotTerm, RegexTerm, MessageTerm])
+        tag, pid, level, has, not_has, regex, message = filter.terms
+        self.assertEqual((tag.field, tag.values), (TAG_FIELD, frozenset(["A", "B"])))
+        self.assertEqual((pid.field, pid.values), (PID_FIELD, frozenset([1])))
+        self.assertEqual(level.values, frozenset("WEFA"))
+        self.assertEqual(has.text, "some text")
+        self.assertEqual(not_has.term.text, "x")
+        self.assertEqual(regex.hint, "\\d+ms")
+        self.assertEqual(message.pattern, "^done")
+
+    def test_pattern_round_trip(self):
+        for text in (r'tag:A,B pid:1 level>=W has:"some text" -has:x re:"\\d+ms" msg:^done',
+                     'tag:"Tag with space","a,b" -tid:7', r'has:"quote \" in it"', "Activity.*frame"):
+            filter = parse_filter(text)
+            again = parse_filter(filter.pattern)
+            self.assertEqual(again.pattern, filter.pattern, text)
+            self.assertEqual([type(term) for term in again.terms], [type(term) for term in filter.terms], text)
+
+    def test_text_is_regex(self):
+        # Anything that isn't all terms is a regex as a whole
+        for text in ("Activity.*frame", "level>=X", "foo tag:A", "tag:A (x|y)"):
+            term, = parse_filter(text).terms
+            self.assertIsInstance(term, RegexTerm, text)
+            self.assertEqual(term.hint, text)
+
+    def test_matches_all(self):
+        for text in ("", " ", "."):
+            self.assertTrue(parse_filter(text).matches_all, repr(text))
+
+    def test_cheapest_first(self):
+        filter = parse_filter("re:x -has:y msg:z -tag:A level>=W")
+        checks = filter._LogFilter__checks
+        self.assertEqual([term.cost for term in checks], sorted(term.cost for term in filter.terms))
+        self.assertIsInstance(checks[0], (FieldTerm, NotTerm))
+
+    def test_empty_field_is_text(self):
+        for text in ("tag:", "pid:", "crash:"):
+            terms = parse_filter(text).terms
+            self.assertEqual([type(term) for term in terms], [RegexTerm], text)
+
+    def test_empty_tag(self):
+        term, = parse_filter('tag:""').terms
+        self.assertIsInstance(term, FieldTerm)
+        self.assertEqual(term.field, TAG_FIELD)
+        self.assertEqual(term.values, frozenset([""]))
+
+
+class SessionArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_segments_readable_before_and_after_writing(self):
+        archive = SessionArchive(self.directory, segment_lines=100, mark_every=10)
+        lines = [record[0] for record in records(250)]
+        archive.append(parse_line(text) for text in lines)
+        # Whether or not the writer has got to them yet
+        self.assertEqual(sum((archive.read(n) for n in range(3)), []), lines)
+        archive.close()
+        archive.flush()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["index.jsonl", "segment-000000.gz", "segment-000001.gz", "segment-000002.gz"])
+        self.assertEqual(sum((archive.read(n) for n in range(3)), []), lines)
+        self.assertEqual([s["first_row"] for s in archive.segments()], [0, 100, 200])
+
+
+class LineHintTest(unittest.TestCase):
+    LINES = [record[LINE_FIELD] for record in FILTER_RECORDS] + [
+        "01-01 00:00:01.000 W/Activity( 100): -v time\n",
+        "01-01 00:00:01.000 I/Net     ( 2001): -v time, other pid\n",
+        "[emulator-5554] 01-01 00:00:01.000  100  100 E Net     : merged\n",
+        "01-01 00:00:01.000  1000  100 E Net     : pid 1000, tid 100\n",
+        "01-01 00:00:01.000  100  100 E NetX    : Net : in the message\n",
+    ]
+
+    def check(self, text, exact=True):
+        filter = parse_filter(text)
+        regex = re.compile(filter.line_hint, re.MULTILINE)
+        for line in self.LINES:
+            matches = filter.matches(parse_line(line))
+            hinted = regex.match(line) is not None
+            if exact:
+                self.assertEqual(hinted, matches, (text, line))
+            else:
+                self.assertTrue(hinted or not matches, (text, line))
+        # Also when searching the whole text, like LogFile.scan does
+        data = "".join(self.LINES)
+        found = set(data.count("\n", 0, m.start()) for m in regex.finditer(data))
+        self.assertTrue(set(i for i, line in enumerate(self.LINES) if filter.matches(parse_line(line))) <= found, text)
+
+    def test_fields(self):
+        for text in ("tag:Net", "tag:Activity,Net", 'tag:"Tag with space"', "pid:100", "pid:100,200 level>=W",
+                     "level>=E", "tid:100", "tag:Net pid:100 tid:100 level>=E", "tag:Net tag:Activity", "level:I,W"):
+            self.check(text)
+
+    def test_with_other_terms(self):
+        for text in ("tag:Net has:merged", "-tag:Net pid:100", "pid:100 re:frame"):
+            self.check(text, exact=False)
+
+    def test_none(self):
+        for text in ("has:x", "-tag:Net", "tag:\"\"", "pid:-1", "Activity.*"):
+            self.assertIsNone(parse_filter(text).line_hint, text)
+
+
+class SelectTest(unittest.TestCase):
+    def check(self, text, rows):
+        filter = parse_filter(text)
+        self.assertEqual(filter.select(store_of(FILTER_RECORDS)), rows, text)
+        # The same as checking each line
+        self.assertEqual([i for i, record in enumerate(FILTER_RECORDS) if filter.matches(record)], rows, text)
+
+    def test_fields(self):
+        self.check("tag:Activity", [0, 1, 6])
+        self.check('tag:"Tag with space"', [4])
+        self.check("pid:200,300", [2, 3, 4])
+        self.check("level>=E", [3, 6])
+
+    def test_terms_all_match(self):
+        self.check("tag:Activity level>=W", [1, 6])
+        self.check("pid:100,200 -level>=E", [0, 1, 2])
+        self.check("tag:Activity tag:Net", [])
+        self.check('pid:200 has:"a,b"', [2])
+
+    def test_negation(self):
+        # Lines that aren't log messages have no tag either
+        self.check("-tag:Activity", [2, 3, 4, 5])
+        self.check("-has:ms -level>=W", [2, 4, 5])
+
+    def test_text(self):
+        self.check('has:"a,b"', [2])
+        self.check(r're:"\\d+ms"', [0, 3])
+        self.check("Activity.*frame", [1])
+        # msg: only looks at the message
+        self.check("msg:^slow", [1])
+        self.check("msg:Activity", [])
+
+    def test_empty_field_is_text(self):
+        self.check("tag:", [])
+        self.check("level>=", [])
+
+    def test_after_trim(self):
+        store = store_of(FILTER_RECORDS)
+        store.trim(2)
+        self.assertEqual(parse_filter("tag:Activity").select(store), [4])
+        self.assertEqual(parse_filter("-tag:Activity").select(store), [0, 1, 2, 3])
+
+
+class LogcatArgsTest(unittest.TestCase):
+    def check(self, text, args):
+        self.assertEqual(logcat_args(parse_filter(text)), args, text)
+
+    def test_pushed_down(self):
+        self.check("tag:A,B level>=W", ["A:W", "B:W", "*:S"])
+        self.check("tag:A level>=I level>=E", ["A:E", "*:S"])
+        self.check("level>=W", ["*:W"])
+        self.check("-tag:Chatty level>=I", ["Chatty:S", "*:I"])
+        self.check("pid:123", ["--pid=123"])
+        self.check("msg:^done", ["-e", "^done"])
+        # Options go before the filterspecs
+        self.check("tag:A pid:123 msg:x", ["--pid=123", "-e", "x", "A:V", "*:S"])
+
+    def test_kept_on_the_host(self):
+        # --pid takes one pid, -e has no inline flags, filterspecs can't
+        # name tags with spaces, and the rest has no logcat option at all
+        for text in ("pid:1,2", "msg:(?i)x", 'tag:"a b"', "tid:5", "has:x", "re:x", "Activity.*", "last:30s"):
+            self.check(text, [])
+
+    def test_partly_pushed_down(self):
+        # The tags with a space stay on the host, the level is still pushed
+        self.check('tag:"a b" level>=E', ["*:E"])
+        self.check("pid:1,2 -tag:Chatty", ["Chatty:S", "*:V"])
+
+
+class LogResumeTest(unittest.TestCase):
+    def test_repeated_lines_left_out(self):
+        a, b, c, d = [parse_line(line(second, message=message)) for second, message in
+                      ((1.0, "a"), (1.0, "b"), (1.0, "c"), (1.001, "d"))]
+        older = parse_line(line(0.5, message="older"))
+        info = parse_line("--------- beginning of main\n")
+        resume = LogResume()
+        resume.seen([older, a, b])
+        resume.resume()
+        # logcat -T starts with the lines logged at the last time seen, of
+        # which c wasn't read before the reconnect
+        self.assertEqual(resume.filter([older, info, a, b, c]), [info, c])
+        self.assertEqual(resume.filter([b, d, a]), [d, a])
+        # Done resuming once a newer line came in
+        self.assertEqual(resume.filter([a]), [a])
+
+    def test_not_resuming(self):
+        records = [parse_line(line(1.0))]
+        resume = LogResume()
+        resume.resume()
+        self.assertEqual(resume.filter(records), records)
+        resume.seen(records)
+        self.assertEqual(resume.filter(records), records)
+
+    def test_since_on_a_leap_day(self):
+        resume = LogResume()
+        resume.seen([parse_line("02-29 23:59:58.123  100  100 I Tag: message\n")])
+        self.assertEqual(format_time(resume.time), "02-29 23:59:58.123")
+
+
+class TimeLookupTest(unittest.TestCase):
+    def setUp(self):
+        # The device clock is set back 9 seconds after row 2
+        self.records = [parse_line(line(second, message="at %s" % second)) for second in (10.0, 10.5, 11.0, 1.0, 1.5, 2.0)]
+        self.store = store_of(self.records)
+
+    def time(self, second):
+        return parse_line(line(second))[TIME_FIELD]
+
+    def test_clock_jump(self):
+        store = self.store
+        self.assertEqual(store.rows_between(self.time(10.4), self.time(11.0)), [(1, 3)])
+        self.assertEqual(store.rows_between(self.time(1.2), self.time(1.8)), [(4, 5)])
+        self.assertEqual(store.rows_between(), [(0, 3), (3, 6)])
+        self.assertEqual(store.row_at(self.time(10.5)), 1)
+        self.assertEqual(store.row_at(self.time(1.5)), 4)
+        # Between the runs, the closest one
+        self.assertEqual(store.row_at(self.time(2.5)), 5)
+        self.assertEqual(store.newest(), self.time(11.0))
+
+    def test_after_trim(self):
+        store = self.store
+        store.trim(2)
+        self.assertEqual(store.rows_between(self.time(10.4), self.time(11.0)), [(0, 1)])
+        self.assertEqual(store.row_at(self.time(1.5)), 2)
+        store.trim(2)
+        # The run from before the jump is gone
+        self.assertEqual(store.rows_between(), [(0, 2)])
+        self.assertEqual(store.row_at(self.time(11.0)), 1)
+        self.assertEqual(store.newest(), self.time(2.0))
+
+    def test_time_window_filter(self):
+        for text, rows in (('time:"01-01 00:00:01"', [3, 4]), ("time:00:00:10..00:00:10", [0, 1]),
+                           ("last:1s", [0, 1, 2]), ("-last:1s", [3, 4, 5])):
+            filter = parse_filter(text).anchored(self.store.newest())
+            self.assertEqual(filter.select(self.store), rows, text)
+            self.assertEqual([i for i, record in enumerate(self.records) if filter.matches(record)], rows, text)
+
+
+CRASH_RECORDS = [parse_line(line(second, pid=pid, tag=tag, level=level, message=message)) for second, pid, tag, level, message in (
+    (5.0, 1234, "AndroidRuntime", "E", "FATAL EXCEPTION: main"),
+    (5.0, 1234, "AndroidRuntime", "E", "Process: com.app, PID: 1234"),
+    (5.0, 77, "Other", "I", "in between"),
+    (5.0, 1234, "AndroidRuntime", "E", "java.lang.NullPointerException: boom"),
+    (5.0, 1234, "AndroidRuntime", "E", "\tat com.app.Main.run(Main.java:1)"),
+    (6.0, 1234, "AndroidRuntime", "E", "much later"),
+    (7.0, 500, "ActivityManager", "E", "ANR in com.other (com.other/.Main)"),
+    (7.0, 500, "ActivityManager", "E", "PID: 4321"),
+    (7.0, 500, "ActivityManager", "E", "Reason: Input dispatching timed out"),
+    (8.0, 500, "ActivityManager", "I", "Process com.app (pid 1234) has died"),
+    (9.0, 999, "DEBUG", "F", "*** *** *** *** *** *** *** *** *** ***"),
+    (9.5, 999, "DEBUG", "F", "pid: 999, tid: 999, name: main  >>> com.native <<<"),
+    (10.0, 999, "DEBUG", "F", "signal 11 (SIGSEGV), code 1"),
+    (12.0, 999, "DEBUG", "F", "after the gap"),
+)]
+
+
+class CrashIndexTest(unittest.TestCase):
+    def summary(self, index):
+        return [(event.kind, event.process, event.pid, event.detail, list(event.rows)) for event in index.events]
+
+    def test_blocks(self):
+        index = CrashIndex()
+        index.add(CRASH_RECORDS, 0)
+        self.assertEqual(self.summary(index), [
+            ("java", "com.app", 1234, "java.lang.NullPointerException: boom", [0, 1, 3, 4]),
+            ("anr", "com.other", 4321, "Input dispatching timed out", [6, 7, 8]),
+            ("died", "com.app", 1234, None, [9]),
+            ("native", "com.native", 999, "signal 11 (SIGSEGV), code 1", [10, 11, 12]),
+        ])
+
+    def test_across_batches(self):
+        whole = CrashIndex()
+        whole.add(CRASH_RECORDS, 100)
+        for size in (1, 2, 3, 5):
+            index = CrashIndex()
+            for begin in range(0, len(CRASH_RECORDS), size):
+                index.add(CRASH_RECORDS[begin:begin + size], 100 + begin)
+            self.assertEqual(self.summary(index), self.summary(whole), size)
+
+    def test_rows_and_trim(self):
+        index = CrashIndex()
+        index.add(CRASH_RECORDS, 100)
+        self.assertEqual(index.rows(("java", "died"), 100), [0, 1, 3, 4, 9])
+        index.trim(105)
+        self.assertEqual([event.kind for event in index.events], ["anr", "died", "native"])
+        self.assertEqual(index.rows(CrashIndex.KINDS, 106), [0, 1, 2, 3, 4, 5, 6])
+
+    def test_crash_filter(self):
+        store = store_of(CRASH_RECORDS)
+        self.assertEqual(parse_filter("crash:any").select(store), [0, 1, 3, 4, 6, 7, 8, 9, 10, 11, 12])
+        self.assertEqual(parse_filter("crash:anr,died").select(store), [6, 7, 8, 9])
+        self.assertEqual(parse_filter("crash:java has:boom").select(store), [3])
+
+
+EXPORT_RECORDS = [parse_line(text) for text in (
+    line(1.5, pid=100, tid=101, tag="My Tag", level="W", message='say "hi", then\tbye \\ \u00e9\u4e2d\x01'),
+    line(2.0, tag="a,b", message="carriage\rreturn"),
+    "--------- beginning of main, \"crash\"\n",
+    '01-01 00:00:03.250 E/Old     ( 42): from -v time\n',
+)]
+
+
+class ExportTest(unittest.TestCase):
+    def export(self, format):
+        out = io.BytesIO()
+        self.assertEqual(export_records(out, iter(EXPORT_RECORDS), format), len(EXPORT_RECORDS))
+        return out.getvalue().decode("utf-8")
+
+    def test_raw(self):
+        self.assertEqual(self.export("raw"), "".join(record[0] for record in EXPORT_RECORDS))
+
+    def test_csv_escaping(self):
+        rows = list(csv.reader(io.StringIO(self.export("csv"), newline="")))
+        self.assertEqual(rows, [
+            ["time", "pid", "tid", "level", "tag", "message"],
+            ["01-01 00:00:01.500", "100", "101", "W", "My Tag", 'say "hi", then\tbye \\ \u00e9\u4e2d\x01'],
+            ["01-01 00:00:02.000", "100", "100", "I", "a,b", "carriage\rreturn"],
+            ["", "", "", "", "", '--------- beginning of main, "crash"'],
+            ["01-01 00:00:03.250", "42", "", "E", "Old", "from -v time"],
+        ])
+
+    def test_jsonl_escaping(self):
+        text = self.export("jsonl")
+        self.assertEqual(len(text.splitlines()), len(EXPORT_RECORDS))
+        objects = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual(objects, [
+            {"time": "01-01 00:00:01.500", "pid": 100, "tid": 101, "level": "W", "tag": "My Tag",
+             "message": 'say "hi", then\tbye \\ \u00e9\u4e2d\x01'},
+            {"time": "01-01 00:00:02.000", "pid": 100, "tid": 100, "level": "I", "tag": "a,b", "message": "carriage\rreturn"},
+            {"time": None, "pid": None, "tid": None, "level": None, "tag": None,
+             "message": '--------- beginning of main, "crash"'},
+            {"time": "01-01 00:00:03.250", "pid": 42, "tid": None, "level": "E", "tag": "Old", "message": "from -v time"},
+        ])
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, export_records, io.BytesIO(), [], "xml")
+
+
+class IndexTest(unittest.TestCase):
+    def check(self, store, records):
+        """The indexes give the rows of store, holding records, that have
+        each value"""
+        for field in (PID_FIELD, TID_FIELD, LEVEL_FIELD, TAG_FIELD):
+            index = store.index[field]
+            for value, posting in index.items():
+                self.assertTrue(len(posting) > 0 and posting[0] >= store.first, (field, value))
+            values = set(record[field] for record in records)
+            self.assertEqual(set(index), values, field)
+            for value in values:
+                self.assertEqual(store.rows_with({field: [value]}),
+                                 [i for i, record in enumerate(records) if record[field] == value], (field, value))
+
+    def test_after_trims(self):
+        records = mixed_records(200)
+        store = store_of(records)
+        self.check(store, records)
+        for count in (1, 12, 50, 7):
+            store.trim(count)
+            del records[:count]
+            self.check(store, records)
+        more = mixed_records(40, 200)
+        store.append(more)
+        records += more
+        self.check(store, records)
+        self.assertEqual(store.rows_with({PID_FIELD: [100, 101], LEVEL_FIELD: ["E"]}),
+                         [i for i, record in enumerate(records) if record[PID_FIELD] in (100, 101) and record[LEVEL_FIELD] == "E"])
+
+    def test_trimmed_characters(self):
+        records = mixed_records(20)
+        store = store_of(records)
+        removed = store.trim(5)
+        self.assertEqual(removed, sum(len(record[0]) for record in records[:5]))
+        self.assertEqual(store.size, sum(len(record[0]) for record in records[5:]))
+        self.assertEqual(store.point(1), len(records[5][0]))
+        self.assertEqual(store.trim(0), 0)
+
+    def test_trim_everything(self):
+        store = store_of(mixed_records(30))
+        store.trim(100)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.first, 30)
+        self.check(store, [])
+        records = mixed_records(5, 30)
+        store.append(records)
+        self.check(store, records)
+
+
+class LogMergerTest(unittest.TestCase):
+    def device(self, name, seconds):
+        return [parse_line(line(second, message="%s %.1f" % (name, second))) for second in seconds]
+
+    def test_interleaved_in_order(self):
+        a = self.device("a", [i * 0.1 for i in range(0, 40, 2)])
+        b = self.device("b", [i * 0.1 for i in range(1, 40, 2)])
+        merger = LogMerger(window=0.5)
+        merged = []
+        now = 0.0
+        # Each device's chunk overlaps the other's in time
+        for i in range(0, 20, 4):
+            merger.push("a", a[i:i + 4], now)
+            merged += merger.pop(now)
+            merger.push("b", b[i:i + 4], now)
+            merged += merger.pop(now)
+            now += 0.1
+        merged += merger.flush()
+        self.assertEqual(sorted(merged, key=lambda record: record[TIME_FIELD]), merged)
+        self.assertEqual(sorted(merged), sorted(a + b))
+
+    def test_held_back_for_window(self):
+        merger = LogMerger(window=0.5)
+        merger.push("a", self.device("a", [1.0, 2.0]), 100.0)
+        # 1.0 is more than the window older than the newest line
+        self.assertEqual([record[TIME_FIELD] for record in merger.pop(100.0)], [parse_line(line(1.0))[TIME_FIELD]])
+        self.assertEqual(merger.pop(100.4), [])
+        # Not held back longer than the window in wall clock time either
+        self.assertEqual(len(merger.pop(100.5)), 1)
+        self.assertEqual(len(merger), 0)
+
+    def test_same_time_and_info_lines(self):
+        merger = LogMerger(window=0.5)
+        info = parse_line("--------- beginning of main\n")
+        a = self.device("a", [1.0, 1.0]) + [info]
+        b = self.device("b", [1.0, 3.0])
+        merger.push("a", a, 0.0)
+        merger.push("b", b, 0.0)
+        # The same timestamp keeps the order the lines came in, a line
+        # without one stays after the line before it
+        self.assertEqual(merger.flush(), [a[0], a[1], info, b[0], b[1]])
+
+    def test_max_pending(self):
+        merger = LogMerger(window=10, max_pending=3)
+        merger.push("a", self.device("a", [1.0, 1.1, 1.2, 1.3, 1.4]), 0.0)
+        self.assertEqual(len(merger.pop(0.0)), 2)
+        self.assertEqual(len(merger), 3)
+
+
+class RepeatCollapserTest(unittest.TestCase):
+    def collapse(self, collapser, batches, row=0):
+        """The messages kept of each batch, numbering the kept lines from row
+        on like a view does"""
+        kept = []
+        for batch in batches:
+            for record in batch:
+                if collapser.add(record, row):
+                    kept.append(record[LINE_FIELD][record[OFFSET_FIELD]:].strip())
+                    row += 1
+        return kept
+
+    def message(self, text, pid=100):
+        return parse_line(line(1.0, pid=pid, message=text))
+
+    def test_across_batches(self):
+        collapser = RepeatCollapser(window=3)
+        a, b = self.message("a"), self.message("b")
+        kept = self.collapse(collapser, [[a, b, a], [a], [b, a]])
+        self.assertEqual(kept, ["a", "b"])
+        self.assertEqual(collapser.counts, {0: 4, 1: 2})
+        self.assertEqual(collapser.collapsed, 4)
+
+    def test_split_past_window(self):
+        collapser = RepeatCollapser(window=2)
+        a = self.message("a")
+        others = [self.message("x%d" % i) for i in range(3)]
+        # a's first copy is 3 rows back when it comes again
+        kept = self.collapse(collapser, [[a] + others[:2], [others[2], a], [a]])
+        self.assertEqual(kept, ["a", "x0", "x1", "x2", "a"])
+        self.assertEqual(collapser.counts, {4: 2})
+
+    def test_not_repeats(self):
+        collapser = RepeatCollapser(window=10)
+        info = parse_line("--------- beginning of main\n")
+        kept = self.collapse(collapser, [[self.message("a"), self.message("a", pid=200), info], [info]])
+        self.assertEqual(kept, ["a", "a", "--------- beginning of main", "--------- beginning of main"])
+        self.assertEqual(collapser.counts, {})
+
+    def test_trim(self):
+        collapser = RepeatCollapser(window=10)
+        a, b = self.message("a"), self.message("b")
+        self.collapse(collapser, [[a, a, b, b]])
+        self.assertEqual(collapser.changed, set([0, 1]))
+        collapser.changed = set()
+        collapser.trim(1)
+        self.assertEqual(collapser.counts, {1: 2})
+        self.assertEqual(collapser.changed, set([0]))
+
+
+class TalkerStatsTest(unittest.TestCase):
+    def test_rates(self):
+        stats = TalkerStats(window=10)
+        busy = parse_line(line(1.0, pid=100, tag="Busy", level="D", message="x" * 57))
+        quiet = parse_line(line(1.0, pid=200, tag="Quiet", level="E", message="y"))
+        size = len(busy[LINE_FIELD])
+        stats.add([busy] * 30 + [quiet, parse_line("--------- beginning of main\n")], 1000.0)
+        stats.add([busy] * 10, 1001.5)
+        # Two seconds since the first lines, as the window isn't full yet
+        top = dict(((field, value), (lines, chars)) for field, value, lines, chars in stats.top(1002.0))
+        self.assertEqual(top[(TAG_FIELD, "Busy")], (20.0, 20.0 * size))
+        self.assertEqual(top[(PID_FIELD, 100)], (20.0, 20.0 * size))
+        self.assertEqual(top[(LEVEL_FIELD, "D")], (20.0, 20.0 * size))
+        self.assertEqual(top[(TAG_FIELD, "Quiet")], (0.5, 0.5 * len(quiet[LINE_FIELD])))
+        self.assertEqual(len(top), 6)
+        self.assertEqual(stats.top(1002.0)[0][3], 20.0 * size)
+        self.assertEqual(stats.top(1002.0)[-1][3], 0.5 * len(quiet[LINE_FIELD]))
+
+    def test_window(self):
+        stats = TalkerStats(window=10)
+        record = parse_line(line(1.0, tag="Old"))
+        stats.add([record] * 5, 1000.0)
+        stats.add([parse_line(line(1.0, tag="New"))], 1012.0)
+        tags = [value for field, value, lines, chars in stats.top(1012.0) if field == TAG_FIELD]
+        self.assertEqual(tags, ["New"])
+
+    def test_nothing_yet(self):
+        self.assertEqual(TalkerStats().top(0.0), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,251 @@
+"""
+Copyright (c) 2012 Fredrik Ehnbom
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+   1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+
+   2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+
+   3. This notice may not be removed or altered from any source
+   distribution.
+"""
+# Tests of adbview.py run outside of the editor, against the stub sublime
+# modules of the benchmarks.
+#
+#   python -m unittest discover tests
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(TESTS_DIR), "bench"), os.path.dirname(TESTS_DIR)]
+
+import sublime
+import adbview
+from run import configure, open_view, close_view, wait_closed, wait_refiltered, private, records_for, load, LOGGEN
+
+
+def wait_shown(view, timeout=10):
+    """Act as the UI thread until everything queued for the view is in it"""
+    end = time.time() + timeout
+    while time.time() < end:
+        if sublime.run_callbacks() > 0:
+            continue
+        if len(private(view, "lines")) == 0 and len(private(view, "ready")) == 0 and not private(view, "ui_busy"):
+            return
+        time.sleep(0.005)
+    raise RuntimeError("timed out waiting for the view to update")
+
+
+class InfoLinesTest(unittest.TestCase):
+    def open(self, **settings):
+        configure(maxlines=10000, **settings)
+        view = open_view(["--lines", 0])
+        wait_closed(view)
+        self.addCleanup(close_view, view)
+        load(view, records_for(1000))
+        return view
+
+    def test_shown_under_tag_filter(self):
+        view = self.open()
+        adbview.set_filter(view.view, "tag:Tag3")
+        wait_refiltered(view)
+        view.add_text("[ADBView] Status")
+        wait_shown(view)
+        text = view.view.visible_text()
+        self.assertIn("[ADBView] Status\n", text)
+        self.assertNotIn("Tag1 ", text)
+
+    def test_shown_after_refilter(self):
+        view = self.open()
+        view.add_text("[ADBView] Status")
+        wait_shown(view)
+        adbview.set_filter(view.view, "level>=E tag:Tag3")
+        wait_refiltered(view)
+        self.assertIn("[ADBView] Status\n", view.view.visible_text())
+
+    def test_not_stripped(self):
+        view = self.open(strip_filtered_lines=True)
+        adbview.set_filter(view.view, "tag:Tag3")
+        view.add_text("[ADBView] Status")
+        wait_shown(view)
+        self.assertIn("[ADBView] Status\n", view.view.visible_text())
+
+
+class TrimTest(unittest.TestCase):
+    def test_trimmed_in_blocks(self):
+        configure(maxlines=1000, trim_slack=0.1)
+        view = open_view(["--lines", 0])
+        wait_closed(view)
+        self.addCleanup(close_view, view)
+        store = private(view, "store")
+        trims = 0
+        records = records_for(3000)
+        for begin in range(0, len(records), 50):
+            first = store.first
+            load(view, records[begin:begin + 50])
+            if store.first != first:
+                trims += 1
+                self.assertEqual(len(store), 1000)
+            self.assertTrue(len(store) <= 1100, len(store))
+            # Every row still starts where its line is in the view
+            self.assertEqual(view.view.substr(sublime.Region(0, view.view.size())), "".join(store.lines))
+            self.assertEqual(store.point(len(store) - 1), view.view.size() - len(store.lines[-1]))
+        # Once past the limit, only when 100 lines more have come in, which
+        # with batches of 50 is every third batch
+        self.assertEqual(trims, 13)
+        self.assertEqual(store.lines[-1], records[-1][0])
+
+
+class RepeatsTest(unittest.TestCase):
+    def test_only_changed_counts_redrawn(self):
+        configure(maxlines=300, trim_slack=0.1, collapse_repeats=True, collapse_window=100)
+        self.addCleanup(configure, collapse_repeats=False)
+        view = open_view(["--lines", 0])
+        wait_closed(view)
+        self.addCleanup(close_view, view)
+        collapser = private(view, "collapser")
+        tick = adbview.parse_line("01-01 00:00:01.000  1000  1000 I Beat    : tick\n")
+        records = records_for(600)
+        drawn = []
+        for begin in range(0, len(records), 20):
+            before = private(view.view, "next_phantom")
+            load(view, records[begin:begin + 20] + [tick])
+            drawn.append(private(view.view, "next_phantom") - before)
+            contents = sorted(content for key, region, content in view.view.phantoms.values())
+            self.assertEqual(contents, sorted(adbview.REPEAT_HTML % count for count in collapser.counts.values()))
+            self.assertTrue(all(row >= private(view, "store").first for row in collapser.counts))
+        # One tick per batch, counted on its latest copy
+        self.assertEqual(max(drawn), 1)
+        self.assertTrue(private(view, "store").first > 0)
+
+
+class LogcatProcessTest(unittest.TestCase):
+    def test_close_reaps(self):
+        logcat = adbview.LogcatProcess([sys.executable, LOGGEN, "--rate", "10"])
+        process = private(logcat, "process")
+        self.assertTrue(logcat.running)
+        logcat.close()
+        self.assertTrue(process.stdout.closed)
+        end = time.time() + 10
+        while process.returncode is None and time.time() < end:
+            time.sleep(0.01)
+        self.assertIsNotNone(process.returncode)
+
+
+class AppPidTrackerTest(unittest.TestCase):
+    def am(self, message):
+        return adbview.parse_line("01-01 00:00:00.000  500  600 I ActivityManager: %s\n" % message)
+
+    def test_poll_drops_dead(self):
+        tracker = adbview.AppPidTracker("com.example", poll_interval=0)
+        self.assertTrue(tracker.poll_due())
+        self.assertTrue(tracker.found("100\n200\n"))
+        self.assertEqual(tracker.pids, set([100, 200]))
+        # 200 died without a line in the log
+        self.assertTrue(tracker.poll_due())
+        self.assertTrue(tracker.found("100\n"))
+        self.assertEqual(tracker.pids, set([100]))
+        self.assertEqual(tracker.alive, set([100]))
+        self.assertTrue(tracker.poll_due())
+        self.assertFalse(tracker.found("100\n"))
+
+    def test_failed_poll_keeps_pids(self):
+        tracker = adbview.AppPidTracker("com.example", poll_interval=0)
+        tracker.poll_due()
+        tracker.found("100\n")
+        tracker.poll_due()
+        self.assertFalse(tracker.found(None))
+        self.assertEqual(tracker.pids, set([100]))
+
+    def test_started_during_poll(self):
+        tracker = adbview.AppPidTracker("com.example", poll_interval=0)
+        tracker.poll_due()
+        tracker.found("100\n")
+        self.assertTrue(tracker.poll_due())
+        self.assertTrue(tracker.feed([self.am("Start proc 300:com.example:remote/u0a12 for service")]))
+        # The output of the poll is older than the line
+        self.assertFalse(tracker.found("100\n"))
+        self.assertEqual(tracker.pids, set([100, 300]))
+
+    def test_rate_limited(self):
+        tracker = adbview.AppPidTracker("com.example", poll_interval=60)
+        self.assertTrue(tracker.poll_due())
+        self.assertFalse(tracker.poll_due())
+        tracker.found("100\n")
+        self.assertFalse(tracker.poll_due())
+
+
+class ArchivedTimeTest(unittest.TestCase):
+    def test_shows_line_at_time(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        configure(maxlines=10000, archive_dir=directory, archive_segment_lines=2000)
+        view = open_view(["--lines", 5000])
+        wait_closed(view)
+        self.addCleanup(close_view, view)
+        window = view.view.window()
+        pages = len(window.views())
+        adbview.AdbShowArchivedTime(view.view).go_to("00:00:03.500")
+        # The page is read off the UI thread
+        end = time.time() + 10
+        while len(window.views()) == pages and time.time() < end:
+            if sublime.run_callbacks() == 0:
+                time.sleep(0.005)
+        page = window.active_view()
+        self.assertIn("[History 1]", page.name)
+        line = page.substr(page.line(page.sel()[0]))
+        self.assertIn(" 00:00:03.500 ", line)
+
+
+class FeedTest(unittest.TestCase):
+    def subscribe(self, cmd):
+        subscription = adbview.subscribe_logcat([("emulator-5554", cmd)], [], None, lambda records: None, lambda: None)
+        self.addCleanup(subscription.close)
+        return subscription
+
+    def test_shared_with_and_without_serial(self):
+        configure()
+        logcat = [LOGGEN, "--lines", "100000", "--rate", "100"]
+        # The launch_single command doesn't name the device, the quick
+        # panel's does
+        self.assertFalse(self.subscribe([sys.executable] + logcat).shared)
+        self.assertTrue(self.subscribe([sys.executable, "-s", "emulator-5554"] + logcat).shared)
+        self.assertFalse(self.subscribe([sys.executable] + logcat + ["--seed", "2"]).shared)
+
+
+class FilterPoolTest(unittest.TestCase):
+    def test_same_rows_as_in_process(self):
+        configure(filter_python=sys.executable, filter_workers=2)
+        self.addCleanup(configure, filter_python="")
+        self.addCleanup(adbview.shutdown_filter_pool)
+        pool = adbview.get_filter_pool()
+        lines = [record[0] for record in records_for(5000)]
+        lines[2500:2500] = ["01-01 00:00:02.500  1017  1017 I Tag3    : pid: 1234\n"] * 10
+        chunks = [(begin, min(len(lines), begin + 1000)) for begin in range(0, len(lines), 1000)]
+        filters = [adbview.parse_filter(text) for text in ("tag:Tag3 level>=W", "-has:frame re:\\d{3}", "last:2s")]
+        filters.append(filters[-1].anchored(records_for(5000)[-1][adbview.TIME_FIELD]))
+        # Neither of these is parsed back from its pattern
+        filters.append(adbview.LogFilter((adbview.FieldTerm(adbview.PID_FIELD, []),)))
+        filters.append(adbview.LogFilter((adbview.FieldTerm(adbview.PID_FIELD, [1017, 1034]), adbview.ContainsTerm("a,b"))))
+        for filter in filters:
+            pooled = sum(adbview.filter_in_pool(pool, filter, 100, lines, chunks), [])
+            self.assertEqual(pooled, adbview.filter_lines(filter, lines, 100), filter.pattern)
+
+
+if __name__ == "__main__":
+    unittest.main()